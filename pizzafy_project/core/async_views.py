@@ -0,0 +1,97 @@
+"""
+Async counterpart of DRF's APIView.
+
+DRF views are synchronous, so under ASGI Django runs each one on a worker
+thread. AsyncAPIView is a plain Django async view that does the same
+authentication, permission checks and error rendering as our APIViews, but
+leaves the handler free to use the async ORM. Responses are rendered with
+the first of ``renderer_classes`` the Accept header allows, JSON by default
+(timed for core.metrics) so they match the sync views byte for byte.
+
+Request bodies are JSON, or MessagePack when sent as application/msgpack.
+"""
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.utils.decorators import classonlymethod
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.settings import api_settings
+
+from .parsers import MessagePackParser
+from .renderers import MessagePackRenderer, TimedJSONRenderer
+
+
+class AsyncAPIView(View):
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [TimedJSONRenderer, MessagePackRenderer]
+
+    @classonlymethod
+    def as_view(cls, **initkwargs):
+        # Token-authenticated like the DRF views, so CSRF does not apply
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def get_renderer(self):
+        # Unlike DRF, an unacceptable Accept header gets the default rather than a 406
+        renderers = {renderer_class.media_type: renderer_class for renderer_class in self.renderer_classes}
+        media_type = self.request.get_preferred_type(list(renderers))
+        return renderers.get(media_type, self.renderer_classes[0])()
+
+    def render(self, data, status=status.HTTP_200_OK, headers=None):
+        renderer = self.get_renderer()
+        response = HttpResponse(renderer.render(data), status=status, content_type=renderer.media_type)
+        for header, value in (headers or {}).items():
+            response[header] = value
+        return response
+
+    def get_data(self, request):
+        if request.content_type == MessagePackParser.media_type:
+            return MessagePackParser().parse(io.BytesIO(request.body)) if request.body else {}
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError as exc:
+            raise exceptions.ParseError(f"JSON parse error - {exc}")
+
+    def _authenticate(self, request):
+        for authentication_class in self.authentication_classes:
+            authenticator = authentication_class()
+            user_auth = authenticator.authenticate(request)
+            if user_auth is not None:
+                request.user, request.auth = user_auth
+                return
+        # Replace the session-backed lazy user, which would need a sync database lookup
+        request.user, request.auth = AnonymousUser(), None
+
+    async def initial(self, request):
+        # Authenticators may hit the cache or database, so they run in the sync thread
+        await sync_to_async(self._authenticate)(request)
+        for permission_class in self.permission_classes:
+            if not permission_class().has_permission(request, self):
+                if request.auth is None and not request.user.is_authenticated:
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied()
+
+    def handle_exception(self, exc):
+        headers = {}
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            authenticator = self.authentication_classes[0]()
+            headers["WWW-Authenticate"] = authenticator.authenticate_header(self.request)
+            exc.status_code = status.HTTP_401_UNAUTHORIZED
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {"detail": exc.detail}
+        return self.render(data, status=exc.status_code, headers=headers)
+
+    async def dispatch(self, request, *args, **kwargs):
+        handler = getattr(self, request.method.lower(), None)
+        if request.method.lower() not in self.http_method_names or handler is None:
+            return await self.http_method_not_allowed(request, *args, **kwargs)
+        try:
+            await self.initial(request)
+            return await handler(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc)
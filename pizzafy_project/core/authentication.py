@@ -0,0 +1,88 @@
+"""
+Stateless JWT authentication.
+
+Access tokens carry the user's ``role``, ``is_available``, ``is_active`` and a
+``token_version`` claim (see core.serializers.RoleTokenObtainPairSerializer).
+RoleJWTAuthentication builds the request user from those claims without a
+database query. Any other field is loaded from the database the first time
+it is read.
+
+The ``token_version`` claim is checked against User.token_version (read through
+the cache). Bumping it, as UpdateProfileView does when a role changes, makes
+every outstanding access token fail with ``token_outdated`` until the client
+refreshes. Activating or deactivating a user bumps it too (see core.signals),
+and a token whose ``is_active`` claim is false is rejected like simplejwt
+rejects inactive users, so a deactivated user loses access at once.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User as CustomUser
+from .routers import note_authenticated_user
+
+# Claims copied onto the lightweight request user
+TOKEN_USER_CLAIMS = ("role", "is_available", "is_active")
+
+
+def _token_version_key(user_id):
+    return f"core:token-version:{user_id}"
+
+
+def get_token_version(user_id):
+    key = _token_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = CustomUser.objects.filter(id=user_id).values_list("token_version", flat=True).first()
+        cache.set(key, version, getattr(settings, "TOKEN_VERSION_CACHE_TIMEOUT", 300))
+    return version
+
+
+def bump_token_version(user):
+    """
+    Invalidate every access token issued to ``user`` so far.
+    """
+    CustomUser.objects.filter(id=user.id).update(token_version=F("token_version") + 1)
+    user.refresh_from_db(fields=["token_version"])
+    cache.set(_token_version_key(user.id), user.token_version, getattr(settings, "TOKEN_VERSION_CACHE_TIMEOUT", 300))
+
+
+def add_role_claims(token, user):
+    for claim in TOKEN_USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    token["token_version"] = user.token_version
+    return token
+
+
+class RoleJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        user_auth = super().authenticate(request)
+        if user_auth is not None:
+            note_authenticated_user(user_auth[0].id)
+        return user_auth
+
+    def get_user(self, validated_token):
+        # Tokens issued before role claims existed go through the regular database lookup
+        if not all(claim in validated_token for claim in TOKEN_USER_CLAIMS + ("token_version",)):
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if validated_token["token_version"] != get_token_version(user_id):
+            raise AuthenticationFailed(_("Token is outdated, please refresh it"), code="token_outdated")
+        if api_settings.CHECK_USER_IS_ACTIVE and not validated_token["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        # A model instance with only the token's fields loaded; the rest are deferred and
+        # fetched on first access, so views can still use it like a normal user
+        values = {"id": user_id, "token_version": validated_token["token_version"]}
+        values.update((claim, validated_token[claim]) for claim in TOKEN_USER_CLAIMS)
+        field_names = [field.attname for field in CustomUser._meta.concrete_fields if field.attname in values]
+        return CustomUser.from_db("default", field_names, [values[name] for name in field_names])
@@ -0,0 +1,106 @@
+"""
+Response compression negotiated with Accept-Encoding.
+
+compression_middleware (core.middleware) hands every response to
+``compress_response``. A body is compressed when all of these hold:
+
+* its content type is in ``COMPRESSIBLE_TYPES``,
+* it is at least ``RESPONSE_COMPRESSION_MIN_BYTES`` long, since below about
+  one network packet compression saves no round trips and costs CPU on both
+  ends,
+* it is not streamed and not already encoded,
+* the client accepts a coding we support, and the compressed body is smaller.
+
+Codings are brotli ("br", when the brotli package is installed) and gzip, in
+that order of preference when the client weights them equally. Compressed
+responses get ``Vary: Accept-Encoding`` and a weak ETag, like Django's
+GZipMiddleware.
+
+Only the API's own content types are compressed. They carry no CSRF token,
+the secret BREACH-style attacks usually go after in compressed HTML pages.
+"""
+import gzip
+import re
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # Optional; only gzip is offered without it
+    brotli = None
+
+COMPRESSIBLE_TYPES = frozenset({"application/json", "application/msgpack"})
+
+_weak_etag = re.compile(r"^(?!W/)")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _gzip(data, level):
+    # mtime=0 so identical bodies compress to identical bytes
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _brotli(data, level):
+    # Brotli levels run 0-11; gzip's scale is mapped onto it
+    return brotli.compress(data, quality=min(11, level + 1))
+
+
+CODINGS = {"gzip": _gzip}
+if brotli is not None:
+    CODINGS = {"br": _brotli, **CODINGS}
+
+
+def accepted_coding(header):
+    """
+    The supported coding ``header`` (an Accept-Encoding value) weights highest, or None.
+    """
+    weights = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if coding:
+            weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for coding in CODINGS:  # Our order of preference breaks ties
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def compress_response(request, response):
+    if response.streaming or response.has_header("Content-Encoding"):
+        return response
+    content_type = response.get("Content-Type", "").split(";")[0].strip().lower()
+    if content_type not in COMPRESSIBLE_TYPES:
+        return response
+    if len(response.content) < _setting("RESPONSE_COMPRESSION_MIN_BYTES", 1024):
+        return response
+
+    # The representation now depends on Accept-Encoding, whichever one this client gets
+    patch_vary_headers(response, ("Accept-Encoding",))
+    coding = accepted_coding(request.headers.get("Accept-Encoding", ""))
+    if coding is None:
+        return response
+    compressed = CODINGS[coding](response.content, _setting("RESPONSE_COMPRESSION_LEVEL", 6))
+    if len(compressed) >= len(response.content):
+        return response
+
+    response.content = compressed
+    response["Content-Length"] = str(len(compressed))
+    response["Content-Encoding"] = coding
+    if response.has_header("ETag"):
+        response["ETag"] = _weak_etag.sub("W/", response["ETag"])
+    return response
@@ -0,0 +1,146 @@
+"""
+Streaming data exports.
+
+An export is a list of parent rows, each with its child rows, e.g. orders
+with their lines. It is read in chunks of ``EXPORT_CHUNK_SIZE`` parents.
+Each chunk is a primary-key range query of its own, plus one query for that
+chunk's children, so only one chunk is ever in memory and no query runs for
+long, however many rows are exported.
+
+Rows are written out as they are read, in one of two formats:
+
+* NDJSON: one JSON object per parent, with its children nested in a list.
+* CSV: one row per child, with the parent's columns repeated. A parent with
+  no children gets a single row with the child columns left empty.
+
+Decimals are written as strings and datetimes in ISO 8601, so no precision
+is lost. CSV text cells that a spreadsheet would run as a formula are
+prefixed with a quote. Chunks are separate queries, so rows written while an
+export runs may or may not be included.
+"""
+import csv
+import io
+import json
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+# Leading characters that make a spreadsheet treat a cell as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def export_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def csv_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return export_value(value)
+
+
+class ExportSource:
+    """
+    One table of parents to export, with their children through the reverse foreign key ``relation``.
+
+    ``fields`` and ``child_fields`` map output columns to values() paths. ``constants`` are columns with
+    the same value for every row of this source, e.g. which tier it came from.
+    """
+
+    def __init__(self, queryset, fields, relation, child_fields, constants=None):
+        self.queryset = queryset
+        self.fields = fields
+        self.relation = relation
+        self.child_fields = child_fields
+        self.constants = constants or {}
+
+    def chunks(self, chunk_size):
+        """
+        Lists of ``(parent, children)`` dicts, walking the primary key ``chunk_size`` parents at a time.
+        """
+        relation = self.queryset.model._meta.get_field(self.relation)
+        child_model, foreign_key = relation.related_model, relation.field.attname
+        names, child_names = list(self.fields), list(self.child_fields)
+        last_pk = None
+        while True:
+            parents = self.queryset.order_by("pk")
+            if last_pk is not None:
+                parents = parents.filter(pk__gt=last_pk)
+            rows = list(parents.values_list("pk", *self.fields.values())[:chunk_size])
+            if not rows:
+                return
+            children = defaultdict(list)
+            child_rows = (
+                child_model.objects.filter(**{f"{foreign_key}__in": [row[0] for row in rows]})
+                .order_by("pk")
+                .values_list(foreign_key, *self.child_fields.values())
+            )
+            for row in child_rows:
+                children[row[0]].append(dict(zip(child_names, row[1:])))
+            yield [({**dict(zip(names, row[1:])), **self.constants}, children[row[0]]) for row in rows]
+            last_pk = rows[-1][0]
+
+
+class Export:
+    """
+    Parents from one or more ExportSources with the same columns, read in order, as a streamed file.
+    """
+
+    def __init__(self, name, sources, children_key, child_prefix):
+        self.name = name
+        self.sources = sources
+        self.children_key = children_key  # Key of the nested list in NDJSON
+        self.child_prefix = child_prefix  # Prefix of the child columns in CSV
+
+    @property
+    def columns(self):
+        source = self.sources[0]
+        return list(source.fields) + list(source.constants)
+
+    @property
+    def child_columns(self):
+        return list(self.sources[0].child_fields)
+
+    def records(self, chunk_size=None):
+        chunk_size = chunk_size or getattr(settings, "EXPORT_CHUNK_SIZE", 1000)
+        for source in self.sources:
+            yield from source.chunks(chunk_size)
+
+    def ndjson(self, chunk_size=None):
+        encoder = json.JSONEncoder(default=export_value, ensure_ascii=False, separators=(",", ":"))
+        for chunk in self.records(chunk_size):
+            yield "".join(
+                encoder.encode({**parent, self.children_key: children}) + "\n" for parent, children in chunk
+            ).encode()
+
+    def csv(self, chunk_size=None):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.columns + [f"{self.child_prefix}_{column}" for column in self.child_columns])
+        empty = [None] * len(self.child_columns)
+        for chunk in self.records(chunk_size):
+            for parent, children in chunk:
+                values = [csv_cell(parent[column]) for column in self.columns]
+                for child in children or [None]:
+                    cells = empty if child is None else [csv_cell(child[column]) for column in self.child_columns]
+                    writer.writerow(values + cells)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode()  # Just the header; nothing matched
+
+    def response(self, export_format, chunk_size=None):
+        content = self.csv(chunk_size) if export_format == "csv" else self.ndjson(chunk_size)
+        response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[export_format])
+        response["Content-Disposition"] = f'attachment; filename="{self.name}.{export_format}"'
+        return response
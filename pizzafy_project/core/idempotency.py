@@ -0,0 +1,214 @@
+"""
+Idempotency-Key support for retried writes.
+
+Decorate a view handler with ``@idempotent`` and a request carrying an
+``Idempotency-Key`` header runs at most once per user and key:
+
+* The first request claims the key by inserting an IdempotencyKey row in a
+  transaction of its own, runs the handler and stores the response on the row.
+* A retry with the same key and the same method, path and body gets the
+  stored response back, read from that row alone.
+* A duplicate that arrives while the first request is still running waits for
+  it, up to ``IDEMPOTENCY_WAIT_SECONDS``, instead of running the handler again.
+* Reusing a key for a different request is rejected with 422.
+
+Server errors (5xx), exceptions and the retryable answers in
+``RETRYABLE_STATUSES`` (402 payment still pending, 409 not enough stock)
+release the key so the client can retry.
+A claim older than ``IDEMPOTENCY_LOCK_SECONDS`` belongs to a request that
+died and may be taken over. Stored responses expire after
+``IDEMPOTENCY_TTL_SECONDS``; expired rows are evicted at most once every
+``IDEMPOTENCY_EVICT_SECONDS`` per process.
+
+The rows live in the database rather than the cache so every worker process
+sees the same claims.
+"""
+import asyncio
+import hashlib
+import time
+from datetime import timedelta
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = "Idempotency-Key"
+POLL_SECONDS = 0.05
+# Answers that depend on state the client is expected to wait out; retrying the key must run the handler again
+RETRYABLE_STATUSES = {status.HTTP_402_PAYMENT_REQUIRED, status.HTTP_409_CONFLICT}
+
+_last_eviction = 0.0
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.path}\n".encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def evict_expired():
+    global _last_eviction
+    now = time.monotonic()
+    if now - _last_eviction < _setting("IDEMPOTENCY_EVICT_SECONDS", 60):
+        return
+    _last_eviction = now
+    IdempotencyKey.objects.filter(expires_at__lt=timezone.now()).delete()
+
+
+def error_response(message, status_code):
+    return HttpResponse(JSONRenderer().render({"error": message}), status=status_code, content_type="application/json")
+
+
+def replay(record):
+    response = HttpResponse(record.response_body, status=record.response_status, content_type=record.content_type)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def claim(user, key, request_fingerprint):
+    """
+    Try to claim ``key`` for a new request.
+
+    Returns ``(record, None)`` when the caller should run the handler, or
+    ``(None, response)`` with a stored, conflicting or pending outcome. A
+    pending outcome is None in place of a response: the caller should wait.
+    """
+    now = timezone.now()
+    evict_expired()
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                user=user,
+                key=key,
+                fingerprint=request_fingerprint,
+                locked_at=now,
+                expires_at=now + timedelta(seconds=_setting("IDEMPOTENCY_TTL_SECONDS", 24 * 3600)),
+            )
+        return record, None
+    except IntegrityError:
+        pass
+
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if record is None or record.expires_at < now:
+        # Gone or expired since the insert failed; drop it and claim afresh
+        IdempotencyKey.objects.filter(user=user, key=key, expires_at__lt=now).delete()
+        return claim(user, key, request_fingerprint)
+    if record.fingerprint != request_fingerprint:
+        return None, error_response(
+            f"{HEADER} was already used for a different request", status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if record.response_status is not None:
+        return None, replay(record)
+
+    # Still running; take over only if its owner has been silent too long
+    stale = now - timedelta(seconds=_setting("IDEMPOTENCY_LOCK_SECONDS", 30))
+    taken = IdempotencyKey.objects.filter(
+        id=record.id, response_status__isnull=True, locked_at=record.locked_at, locked_at__lt=stale
+    ).update(locked_at=now)
+    if taken:
+        record.locked_at = now
+        return record, None
+    return None, None
+
+
+def store(record, response, request=None):
+    """
+    Save the handler's response on the claimed row, or release the claim after a retryable answer.
+    """
+    if response.status_code >= 500 or response.status_code in RETRYABLE_STATUSES:
+        release(record)
+        return
+    if isinstance(response, Response):
+        # DRF renders after the handler returns; store what content negotiation picked for this client
+        renderer = getattr(request, "accepted_renderer", None) or JSONRenderer()
+        media_type = getattr(request, "accepted_media_type", None) or renderer.media_type
+        context = {**(getattr(request, "parser_context", None) or {}), "request": request, "response": response}
+        body = renderer.render(response.data, media_type, context)
+        content_type = f"{renderer.media_type}; charset={renderer.charset}" if renderer.charset else renderer.media_type
+    else:
+        body, content_type = response.content, response["Content-Type"]
+    IdempotencyKey.objects.filter(id=record.id).update(
+        response_status=response.status_code, response_body=body, content_type=content_type
+    )
+
+
+def release(record):
+    IdempotencyKey.objects.filter(id=record.id, response_status__isnull=True).delete()
+
+
+def timed_out():
+    return error_response(
+        f"A request with this {HEADER} is still in progress, retry later", status.HTTP_409_CONFLICT
+    )
+
+
+def idempotent(handler):
+    """
+    Make a view handler honour the Idempotency-Key header. Works on sync and async handlers.
+    """
+    if asyncio.iscoroutinefunction(handler):
+
+        @wraps(handler)
+        async def async_wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+            if not key:
+                return await handler(view, request, *args, **kwargs)
+            request_fingerprint = fingerprint(request)
+            deadline = time.monotonic() + _setting("IDEMPOTENCY_WAIT_SECONDS", 10)
+            while True:
+                record, response = await sync_to_async(claim)(request.user, key, request_fingerprint)
+                if record is not None or response is not None:
+                    break
+                if time.monotonic() > deadline:
+                    return timed_out()
+                await asyncio.sleep(POLL_SECONDS)
+            if response is not None:
+                return response
+            try:
+                response = await handler(view, request, *args, **kwargs)
+            except BaseException:
+                await sync_to_async(release)(record)
+                raise
+            await sync_to_async(store)(record, response)
+            return response
+
+        return async_wrapper
+
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return handler(view, request, *args, **kwargs)
+        request_fingerprint = fingerprint(request)
+        deadline = time.monotonic() + _setting("IDEMPOTENCY_WAIT_SECONDS", 10)
+        while True:
+            record, response = claim(request.user, key, request_fingerprint)
+            if record is not None or response is not None:
+                break
+            if time.monotonic() > deadline:
+                return timed_out()
+            time.sleep(POLL_SECONDS)
+        if response is not None:
+            return response
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except BaseException:
+            release(record)
+            raise
+        store(record, response, request)
+        return response
+
+    return wrapper
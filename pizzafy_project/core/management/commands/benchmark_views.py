@@ -0,0 +1,47 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.loadtest import run_load
+from core.models import User as CustomUser
+from core.serializers import RoleTokenObtainPairSerializer
+
+ENDPOINTS = {
+    "checkouts": ("GET", "/api/checkout/checkouts/", None),
+    "my-orders": ("GET", "/api/checkout/my-orders/", None),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/s and latency percentiles of running servers, e.g. a WSGI or "
+        "DJANGO_ASYNC_VIEWS=false deployment against 'DJANGO_ASYNC_VIEWS=true uvicorn "
+        "pizzafy_project.asgi:application'. Pass --url once per server."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", action="append", required=True, help="Base URL of a running server")
+        parser.add_argument("--email", required=True, help="Customer whose token is used for the requests")
+        parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), action="append")
+        parser.add_argument("--concurrency", type=int, default=500)
+        parser.add_argument("--requests", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(email=options["email"])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No user with email {options['email']}")
+        access = RoleTokenObtainPairSerializer.get_token(user).access_token
+        headers = {"Authorization": f"Bearer {access}"}
+
+        self.stdout.write(f"{'server':<32} {'endpoint':<12} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for endpoint in options["endpoint"] or sorted(ENDPOINTS):
+            method, path, body = ENDPOINTS[endpoint]
+            for url in options["url"]:
+                stats = asyncio.run(
+                    run_load(url, method, path, options["requests"], options["concurrency"], body, headers)
+                )
+                self.stdout.write(
+                    f"{url:<32} {endpoint:<12} {stats['rps']:>9.1f} {stats['p50_ms']:>9.1f} "
+                    f"{stats['p99_ms']:>9.1f} {stats['errors']:>7}"
+                )
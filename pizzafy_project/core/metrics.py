@@ -0,0 +1,254 @@
+"""
+Per-request performance metrics.
+
+metrics_middleware (core.middleware) opens a RequestMetrics for every
+request. Database time is collected by an execute wrapper installed on every
+connection (see CoreConfig.ready). Serialization time is what serializers
+spend building response data (TimedSerializerMixin, RowSerializer), and
+render time what the renderers in core.renderers spend encoding it into
+bytes. Serialization time includes queries a serializer runs lazily, so it
+may overlap db time. All of them report to the current request through a context variable,
+so they follow the request into the threads Django uses for sync code under
+ASGI.
+
+Totals are kept per URL name in a process-local registry. When METRICS_DIR
+is set, each process periodically writes its registry there as
+``<pid>.json`` and /metrics sums every file, so the endpoint reports all
+worker processes no matter which one serves the scrape. A process removes
+its file when it exits; for workers killed outright, call
+``remove_process_file`` from the server's child-exit hook.
+
+/metrics is served to admins and to the addresses in METRICS_ALLOWED_IPS,
+e.g. the Prometheus scraper.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current = ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialization_time = 0.0
+        self.render_time = 0.0
+        self.serializing = False
+
+
+def begin_request():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def record_query(execute, sql, params, many, context):
+    # Connection execute wrapper: charge the query to whichever request is running it
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_time += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def timed_serialization():
+    metrics = _current.get()
+    if metrics is None or metrics.serializing:
+        # Nested serializers are part of the outermost one's time
+        yield
+        return
+    metrics.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serializing = False
+        metrics.serialization_time += time.perf_counter() - started
+
+
+@contextmanager
+def timed_render():
+    metrics = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.render_time += time.perf_counter() - started
+
+
+COUNTERS = ("count", "sum", "queries", "db_seconds", "serialization_seconds", "render_seconds", "over_budget")
+
+
+def _process_file(directory, pid):
+    return os.path.join(directory, f"{pid}.json")
+
+
+def remove_process_file(pid):
+    """
+    Drop the totals process ``pid`` wrote to METRICS_DIR, once it has exited.
+    """
+    directory = getattr(settings, "METRICS_DIR", None)
+    if not directory:
+        return
+    for path in (_process_file(directory, pid), _process_file(directory, pid) + ".tmp"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _empty_stats():
+    return {"buckets": [0] * len(LATENCY_BUCKETS), **{counter: 0 for counter in COUNTERS}}
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.last_flush = 0.0
+        self.cleanup_registered = False
+
+    def observe(self, view, duration, metrics, over_budget):
+        with self.lock:
+            stats = self.views.setdefault(view, _empty_stats())
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    stats["buckets"][index] += 1
+            stats["count"] += 1
+            stats["sum"] += duration
+            stats["queries"] += metrics.queries
+            stats["db_seconds"] += metrics.db_time
+            stats["serialization_seconds"] += metrics.serialization_time
+            stats["render_seconds"] += metrics.render_time
+            stats["over_budget"] += int(over_budget)
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return json.loads(json.dumps(self.views))
+
+    def maybe_flush(self, force=False):
+        directory = getattr(settings, "METRICS_DIR", None)
+        now = time.monotonic()
+        if not directory or (not force and now - self.last_flush < settings.METRICS_FLUSH_SECONDS):
+            return
+        self.last_flush = now
+        os.makedirs(directory, exist_ok=True)
+        pid = os.getpid()
+        path = _process_file(directory, pid)
+        if not self.cleanup_registered:
+            # Totals of exited workers would otherwise be summed forever
+            atexit.register(remove_process_file, pid)
+            self.cleanup_registered = True
+        # Write then rename so a concurrent scrape never reads a half-written file
+        with open(f"{path}.tmp", "w") as handle:
+            json.dump(self.snapshot(), handle)
+        os.replace(f"{path}.tmp", path)
+
+    def collect(self):
+        directory = getattr(settings, "METRICS_DIR", None)
+        if not directory:
+            return self.snapshot()
+        self.maybe_flush(force=True)
+        totals = {}
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name)) as handle:
+                    views = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            for view, stats in views.items():
+                merged = totals.setdefault(view, _empty_stats())
+                merged["buckets"] = [a + b for a, b in zip(merged["buckets"], stats["buckets"])]
+                for counter in COUNTERS:
+                    merged[counter] += stats.get(counter, 0)
+        return totals
+
+
+registry = Registry()
+
+
+def query_budget(view):
+    return settings.METRICS_QUERY_BUDGETS.get(view, settings.METRICS_QUERY_BUDGET)
+
+
+def end_request(request, response, metrics, token):
+    _current.reset(token)
+    duration = time.perf_counter() - metrics.started
+    match = getattr(request, "resolver_match", None)
+    view = (match.url_name or match.route) if match else "unmatched"
+
+    budget = query_budget(view)
+    over_budget = budget is not None and metrics.queries > budget
+    if over_budget:
+        log.warning(
+            "%s %s ran %d queries (budget %d) - possible N+1", request.method, request.path, metrics.queries, budget
+        )
+
+    registry.observe(view, duration, metrics, over_budget)
+    response["Server-Timing"] = ", ".join(
+        [
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.queries} queries"',
+            f"serialization;dur={metrics.serialization_time * 1000:.1f}",
+            f"render;dur={metrics.render_time * 1000:.1f}",
+            f"total;dur={duration * 1000:.1f}",
+        ]
+    )
+    return response
+
+
+def _labels(view):
+    return 'view="%s"' % view.replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render_prometheus(views):
+    lines = [
+        "# HELP pizzafy_request_duration_seconds Request latency by URL name.",
+        "# TYPE pizzafy_request_duration_seconds histogram",
+    ]
+    for view, stats in sorted(views.items()):
+        labels = _labels(view)
+        for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+            lines.append(f'pizzafy_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'pizzafy_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats["count"]}')
+        lines.append(f"pizzafy_request_duration_seconds_sum{{{labels}}} {stats['sum']}")
+        lines.append(f"pizzafy_request_duration_seconds_count{{{labels}}} {stats['count']}")
+
+    for name, key, help_text in (
+        ("pizzafy_db_queries_total", "queries", "Database queries run by requests."),
+        ("pizzafy_db_query_seconds_total", "db_seconds", "Time spent in database queries."),
+        ("pizzafy_serialization_seconds_total", "serialization_seconds", "Time serializers spent on response data."),
+        ("pizzafy_render_seconds_total", "render_seconds", "Time spent rendering response data into bodies."),
+        ("pizzafy_query_budget_exceeded_total", "over_budget", "Requests that ran more queries than their budget."),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for view, stats in sorted(views.items()):
+            lines.append(f"{name}{{{_labels(view)}}} {stats[key]}")
+    return "\n".join(lines) + "\n"
+
@@ -0,0 +1,64 @@
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from . import metrics
+from .compression import compress_response
+from .routers import begin_request, end_request
+
+
+@sync_and_async_middleware
+def read_replica_middleware(get_response):
+    # Tracks each request for ReadReplicaRouter; see core.routers
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            token = begin_request(request)
+            response = await get_response(request)
+            end_request(token, response)
+            return response
+
+    else:
+
+        def middleware(request):
+            token = begin_request(request)
+            response = get_response(request)
+            end_request(token, response)
+            return response
+
+    return middleware
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    # Latency, query and serialisation metrics plus the Server-Timing header; see core.metrics
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            request_metrics, token = metrics.begin_request()
+            response = await get_response(request)
+            return metrics.end_request(request, response, request_metrics, token)
+
+    else:
+
+        def middleware(request):
+            request_metrics, token = metrics.begin_request()
+            response = get_response(request)
+            return metrics.end_request(request, response, request_metrics, token)
+
+    return middleware
+
+
+@sync_and_async_middleware
+def compression_middleware(get_response):
+    # Compresses large API responses the client accepts an encoding for; see core.compression
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            return compress_response(request, await get_response(request))
+
+    else:
+
+        def middleware(request):
+            return compress_response(request, get_response(request))
+
+    return middleware
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db import models
+from django.db.models import Q
+from django.utils import timezone
 
 # Create your models here.
 
@@ -29,7 +31,7 @@ class User(AbstractBaseUser):
     )
 
     email = models.EmailField(unique=True)
-    username = models.CharField(max_length=150)
+    username = models.CharField(max_length=150, db_index=True)
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     is_available = models.BooleanField(default=True)  # Availability for delivery partners
@@ -37,12 +39,30 @@ class User(AbstractBaseUser):
     is_staff = models.BooleanField(default=False)
     is_admin = models.BooleanField(default=False)
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='Customer')  # Role field
+    active_orders = models.PositiveIntegerField(default=0)  # Unfulfilled orders assigned to a delivery partner
+    last_assigned_at = models.DateTimeField(default=timezone.now)  # When the dispatcher last assigned an order
+    token_version = models.PositiveIntegerField(default=0)  # Bumped to invalidate issued access tokens
 
     objects = CustomUserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
 
+    class Meta:
+        indexes = [
+            # Availability pool scanned by order.dispatch, one index per strategy ordering
+            models.Index(
+                fields=['active_orders', 'last_assigned_at', 'id'],
+                condition=Q(role='DeliveryPartner', is_available=True),
+                name='user_dispatch_load_idx',
+            ),
+            models.Index(
+                fields=['last_assigned_at', 'id', 'active_orders'],
+                condition=Q(role='DeliveryPartner', is_available=True),
+                name='user_dispatch_rr_idx',
+            ),
+        ]
+
     def __str__(self):
         return self.username
 
@@ -56,4 +76,20 @@ class User(AbstractBaseUser):
 
     # Helper method to check if user is a Customer
     def is_customer(self):
-        return self.role == 'Customer'
\ No newline at end of file
+        return self.role == 'Customer'
+
+class IdempotencyKey(models.Model):
+    # Stored outcome of a request sent with an Idempotency-Key header (see core.idempotency)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)  # Hash of method, path and body, to catch reused keys
+    response_status = models.PositiveSmallIntegerField(null=True)  # Null while the first request is running
+    response_body = models.BinaryField(null=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(default=timezone.now)  # When the running request claimed the key
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key'),
+        ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import permissions
 
 
@@ -22,3 +23,14 @@ class IsCustomer(permissions.BasePermission):
     
     def has_permission(self, request, view):
         return bool(request.user and request.user.is_authenticated and request.user.role == "Customer")
+
+
+class IsAdminOrMetricsScraper(permissions.BasePermission):
+    """
+    Allow admins, and requests from an address in METRICS_ALLOWED_IPS without a token
+    """
+
+    def has_permission(self, request, view):
+        if request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS:
+            return True
+        return bool(request.user and request.user.is_authenticated and request.user.role == "Admin")
@@ -0,0 +1,73 @@
+import msgpack
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+from .metrics import timed_render
+
+try:
+    import orjson
+except ImportError:  # Optional; FastJSONRenderer falls back to the standard library
+    orjson = None
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that reports its time to the request metrics
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed_render():
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class FastJSONRenderer(TimedJSONRenderer):
+    """
+    TimedJSONRenderer encoding with orjson when it is installed.
+
+    Output is byte-for-byte JSONRenderer's for strings, integers, booleans,
+    None, lists and dicts, which is everything RowSerializer produces. Other
+    types go through DRF's encoder, except floats, which orjson writes in its
+    own shortest form. Indented output, non-compact or ASCII-only settings and
+    values orjson rejects (e.g. integers beyond 64 bits) use JSONRenderer.
+    """
+
+    options = orjson and orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_SUBCLASS
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {}) is not None
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        with timed_render():
+            try:
+                body = orjson.dumps(data, default=self.encoder_class().default, option=self.options)
+            except orjson.JSONEncodeError:
+                body = None
+        if body is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Same escaping as JSONRenderer, so the output stays a strict JavaScript subset
+        return body.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renders MessagePack for clients that accept application/msgpack.
+
+    Values JSON has no type for (decimals, dates, UUIDs, ...) are converted by
+    DRF's JSON encoder first, so both formats carry the same data.
+    """
+
+    media_type = "application/msgpack"
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        with timed_render():
+            return msgpack.packb(data, default=encoders.JSONEncoder().default)
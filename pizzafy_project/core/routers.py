@@ -0,0 +1,119 @@
+"""
+Read replica routing.
+
+ReadReplicaRouter sends reads to the READ_REPLICA_ALIAS database only while
+ReadReplicaMiddleware has marked the current request as a safe read path:
+a GET/HEAD to a URL name listed in READ_REPLICA_URL_NAMES by a user who has
+not written anything in the last READ_AFTER_WRITE_SECONDS. Everything else,
+including all writes, goes to the primary. Without a replica configured the
+router stays out of the way.
+
+The routing state lives in a context variable, so it follows the request
+across the threads and tasks Django uses under both WSGI and ASGI.
+
+A user's writes pin them to the primary through the READ_AFTER_WRITE_CACHE
+cache. The next read may land on any worker, so with a replica configured
+that cache must be shared; check_pin_cache, run at startup by
+CoreConfig.ready, refuses a missing or per-process one.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Backends that keep nothing other processes can read
+PROCESS_LOCAL_CACHES = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+_routing_state = ContextVar("db_routing_state", default=None)
+
+
+def _pin_key(user_id):
+    return f"core:db-pinned:{user_id}"
+
+
+def _pins():
+    return caches[settings.READ_AFTER_WRITE_CACHE]
+
+
+def check_pin_cache():
+    """
+    Raise ImproperlyConfigured when a replica is configured without a shared cache for the pins.
+    """
+    if not settings.READ_REPLICA_ALIAS:
+        return
+    config = settings.CACHES.get(settings.READ_AFTER_WRITE_CACHE)
+    if config is None or config["BACKEND"] in PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            f"A read replica needs CACHES[{settings.READ_AFTER_WRITE_CACHE!r}] on a cache every worker shares "
+            "(set ROUTING_CACHE_LOCATION), or users may not read their own writes"
+        )
+
+
+class RoutingState:
+    def __init__(self, request):
+        self.request = request
+        self.user_id = None
+        self._use_replica = None
+
+    def use_replica(self):
+        if self._use_replica is not None:
+            return self._use_replica
+        match = getattr(self.request, "resolver_match", None)
+        if (
+            self.request.method not in SAFE_METHODS
+            or match is None
+            or match.url_name not in settings.READ_REPLICA_URL_NAMES
+        ):
+            return False
+        if self.user_id is None:
+            # Still authenticating; stay on the primary until we know who is asking
+            return False
+        self._use_replica = not _pins().get(_pin_key(self.user_id))
+        return self._use_replica
+
+
+def note_authenticated_user(user_id):
+    """
+    Called by the authentication class so the router can honour read-your-writes.
+    """
+    state = _routing_state.get()
+    if state is not None:
+        state.user_id = user_id
+
+
+def begin_request(request):
+    return _routing_state.set(RoutingState(request))
+
+
+def end_request(token, response):
+    state = _routing_state.get()
+    _routing_state.reset(token)
+    # Keep this user on the primary for a while so they read their own writes despite replica lag
+    if (
+        settings.READ_REPLICA_ALIAS
+        and state.request.method not in SAFE_METHODS
+        and state.user_id is not None
+        and response.status_code < 400
+    ):
+        _pins().set(_pin_key(state.user_id), True, settings.READ_AFTER_WRITE_SECONDS)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _routing_state.get()
+        if settings.READ_REPLICA_ALIAS and state is not None and state.use_replica():
+            return settings.READ_REPLICA_ALIAS
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
@@ -0,0 +1,124 @@
+"""
+Read-only row serialization.
+
+A DRF ModelSerializer builds a field object per value it writes out, which
+dominates the cost of list responses. RowSerializer is a read-only stand-in
+compiled from an existing ModelSerializer. It fetches plain tuples with
+``values_list()``, with nested ``many=True`` serializers fetched as one extra
+query per relation, like prefetch_related. Each tuple becomes a dict through
+one generated function per serializer. Values are converted with the
+serializer's own fields, and only where the database value is not already
+what DRF would output, so the output matches the ModelSerializer's.
+
+Fields that read something other than a column, like StringRelatedField,
+need their values() path spelled out with ``paths``. Fields that cannot be
+mapped raise ImproperlyConfigured when the serializer is first used.
+"""
+from functools import cached_property
+
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework import serializers
+
+from .metrics import timed_serialization
+
+# Fields whose to_representation returns the database value unchanged
+PASSTHROUGH_FIELDS = (
+    serializers.BooleanField,
+    serializers.CharField,
+    serializers.ChoiceField,
+    serializers.IntegerField,
+    serializers.PrimaryKeyRelatedField,
+)
+
+# Parent ids per nested query, well under SQLite's variable limit
+NESTED_BATCH = 1000
+
+
+class RowSerializer:
+    def __init__(self, serializer_class, paths=None):
+        """
+        ``paths`` maps output keys to values() paths, or, for nested serializers, to their own ``paths``.
+        """
+        self.serializer_class = serializer_class
+        self.paths = paths or {}
+
+    @cached_property
+    def plan(self):
+        # Compiled on first use, once the app registry is ready
+        fields = self.serializer_class().fields
+        model = self.serializer_class.Meta.model
+        columns, outputs, nested, converters = [], [], [], {}
+
+        def column(path):
+            if path not in columns:
+                columns.append(path)
+            return columns.index(path)
+
+        pk_index = column(model._meta.pk.attname)
+        for key, field in fields.items():
+            if isinstance(field, serializers.ListSerializer):
+                child = RowSerializer(type(field.child), self.paths.get(key))
+                outputs.append(f"{key!r}: children[{len(nested)}].get(row[{pk_index}]) or []")
+                nested.append((field.source, child))
+            elif key in self.paths:
+                outputs.append(f"{key!r}: row[{column(self.paths[key])}]")
+            elif isinstance(field, (serializers.StringRelatedField, serializers.SerializerMethodField)) or (
+                field.source == "*"
+            ):
+                raise ImproperlyConfigured(
+                    f"{self.serializer_class.__name__}.{key} does not read a column; give its path in paths"
+                )
+            else:
+                index = column(field.source.replace(".", "__"))
+                if isinstance(field, PASSTHROUGH_FIELDS):
+                    outputs.append(f"{key!r}: row[{index}]")
+                else:
+                    # Values are written as DRF would, None left as None
+                    converters[f"convert_{index}"] = field.to_representation
+                    outputs.append(f"{key!r}: None if row[{index}] is None else convert_{index}(row[{index}])")
+
+        source = "def extract(row, children):\n    return {" + ", ".join(outputs) + "}\n"
+        namespace = dict(converters)
+        exec(compile(source, f"<{self.serializer_class.__name__} rows>", "exec"), namespace)
+        return columns, nested, namespace["extract"]
+
+    @property
+    def columns(self):
+        return self.plan[0]
+
+    def rows(self, queryset, named=False):
+        """
+        The queryset as the tuples ``to_representation`` takes; ``named`` tuples also expose columns as attributes.
+        """
+        return queryset.prefetch_related(None).values_list(*self.columns, named=named)
+
+    def to_representation(self, model, rows):
+        """
+        Dicts for ``rows`` of ``model``, in order, with nested relations fetched in one query each.
+        """
+        columns, nested, extract = self.plan
+        with timed_serialization():
+            rows = list(rows)
+            if not rows:
+                return []
+            pk_index = columns.index(model._meta.pk.attname)
+            parent_ids = [row[pk_index] for row in rows]
+            children = [child.group(model._meta.get_field(relation), parent_ids) for relation, child in nested]
+            return [extract(row, children) for row in rows]
+
+    def group(self, relation, parent_ids):
+        # {parent id: [child dicts]} for a reverse foreign key, children in primary key order
+        model, foreign_key = relation.related_model, relation.field.attname
+        columns, nested, extract = self.plan
+        rows = []
+        for start in range(0, len(parent_ids), NESTED_BATCH):
+            batch = parent_ids[start : start + NESTED_BATCH]
+            queryset = model.objects.filter(**{f"{foreign_key}__in": batch}).order_by("pk")
+            rows += queryset.values_list(*columns, foreign_key)
+        grouped = {}
+        for row, data in zip(rows, self.to_representation(model, rows)):
+            grouped.setdefault(row[-1], []).append(data)
+        return grouped
+
+    def serialize(self, queryset):
+        return self.to_representation(queryset.model, self.rows(queryset))
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from .authentication import bump_token_version
+from .models import User
+
+
+@receiver(pre_save, sender=User)
+def note_activation_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Access tokens carry is_active, so compare with the stored value before it is overwritten
+    instance._activation_changed = False
+    if raw or instance.pk is None or "is_active" in instance.get_deferred_fields():
+        return
+    if update_fields is not None and "is_active" not in update_fields:
+        return
+    stored = User.objects.filter(pk=instance.pk).values_list("is_active", flat=True).first()
+    instance._activation_changed = stored is not None and stored != instance.is_active
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens_on_activation_change(sender, instance, **kwargs):
+    # Saves only; a queryset.update() of is_active must call bump_token_version itself
+    if getattr(instance, "_activation_changed", False):
+        instance._activation_changed = False
+        bump_token_version(instance)
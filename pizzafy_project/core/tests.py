@@ -1,3 +1,323 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import async_to_sync
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from rest_framework.test import APIClient, APIRequestFactory
+
+from order.models import Order, OrderLine
+from order.serializers import OrderSerializer
+from order.views import AsyncCustomerOrderHistoryView
+from pizza.models import Pizza
+
+from .compression import accepted_coding
+from .metrics import _current as _current_metrics, begin_request as begin_metrics, remove_process_file
+from .renderers import TimedJSONRenderer
+from .models import User as CustomUser
+from .serializers import RoleTokenObtainPairSerializer
+from .routers import ReadReplicaRouter, begin_request, check_pin_cache, end_request, note_authenticated_user
+from .views import async_login_view
+
+
+class RoleJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            email="customer@example.com", username="customer", password="secret"
+        )
+        self.client = APIClient()
+        tokens = self.client.post(
+            reverse("login"), {"email": "customer@example.com", "password": "secret"}, format="json"
+        ).json()
+        self.access, self.refresh = tokens["access"], tokens["refresh"]
+
+    def _get_orders(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("customer-order-history"))
+        return response, [query["sql"] for query in ctx.captured_queries]
+
+    def test_authenticates_without_loading_user(self):
+        self._get_orders(self.access)  # warm the token version cache
+
+        response, queries = self._get_orders(self.access)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([sql for sql in queries if 'FROM "core_user"' in sql])
+
+    def test_role_change_forces_refresh(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        response = self.client.put(reverse("update_profile"), {"role": "DeliveryPartner"}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        response, _ = self._get_orders(self.access)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data["code"], "token_outdated")
+
+        self.client.credentials()
+        access = self.client.post(reverse("token_refresh"), {"refresh": self.refresh}, format="json").json()["access"]
+        response, _ = self._get_orders(access)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user.role, "DeliveryPartner")
+
+    def test_deactivated_user_is_rejected(self):
+        self._get_orders(self.access)  # warm the token version cache
+        self.user.is_active = False
+        self.user.save()
+
+        response, _ = self._get_orders(self.access)
+        self.assertEqual(response.status_code, 401)
+
+        # A token minted with the new state carries is_active=false and is refused outright
+        access = RoleTokenObtainPairSerializer.get_token(self.user).access_token
+        response, _ = self._get_orders(str(access))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data["code"], "user_inactive")
+
+
+class LoginViewTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="customer@example.com", username="customer", password="secret"
+        )
+        self.credentials = {"email": "customer@example.com", "password": "secret"}
+
+    def test_login_looks_user_up_once(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = APIClient().post(reverse("login"), self.credentials, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["user"]["id"], self.user.id)
+        self.assertEqual(len([query for query in ctx.captured_queries if 'FROM "core_user"' in query["sql"]]), 1)
+
+    def test_bad_credentials_rejected(self):
+        response = APIClient().post(reverse("login"), {**self.credentials, "password": "wrong"}, format="json")
+
+        self.assertEqual(response.status_code, 401)
+
+
+class AsyncLoginViewTests(TransactionTestCase):
+    # The pool thread has its own connection, so the user must be committed
+    def test_async_login_hashes_in_pool(self):
+        CustomUser.objects.create_user(email="customer@example.com", username="customer", password="secret")
+        request = APIRequestFactory().post(
+            "/api/auth/login/", {"email": "customer@example.com", "password": "secret"}, format="json"
+        )
+
+        response = async_to_sync(async_login_view)(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["user"]["email"], "customer@example.com")
+
+
+LOCAL_CACHE = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+
+
+@override_settings(READ_REPLICA_ALIAS="replica", CACHES={"default": LOCAL_CACHE, "routing": LOCAL_CACHE})
+class ReadReplicaRouterTests(TestCase):
+    def setUp(self):
+        caches["routing"].clear()
+        self.router = ReadReplicaRouter()
+
+    def _route(self, method, path, user_id=7):
+        request = getattr(RequestFactory(), method)(path)
+        request.resolver_match = resolve(path)
+        token = begin_request(request)
+        if user_id:
+            note_authenticated_user(user_id)
+        alias = self.router.db_for_read(CustomUser)
+        end_request(token, HttpResponse())
+        return alias
+
+    def test_safe_read_paths_use_replica(self):
+        self.assertEqual(self._route("get", reverse("customer-order-history")), "replica")
+        self.assertEqual(self._route("get", reverse("pizza-list-create")), "replica")
+
+    def test_other_requests_use_primary(self):
+        self.assertEqual(self._route("get", reverse("update_profile")), "default")
+        self.assertEqual(self._route("post", reverse("pizza-list-create")), "default")
+        self.assertEqual(self._route("get", reverse("customer-order-history"), user_id=None), "default")
+        self.assertEqual(self.router.db_for_read(CustomUser), "default")
+
+    def test_reads_stay_on_primary_after_a_write(self):
+        self._route("post", reverse("create-checkout"))
+
+        self.assertEqual(self._route("get", reverse("customer-order-history")), "default")
+        self.assertEqual(self._route("get", reverse("customer-order-history"), user_id=8), "replica")
+
+    def test_replica_requires_a_shared_pin_cache(self):
+        with self.settings(CACHES={"default": LOCAL_CACHE}):
+            self.assertRaises(ImproperlyConfigured, check_pin_cache)
+        self.assertRaises(ImproperlyConfigured, check_pin_cache)
+
+        with tempfile.TemporaryDirectory() as directory:
+            shared = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory}
+            with self.settings(CACHES={"default": LOCAL_CACHE, "routing": shared}):
+                check_pin_cache()
+        with self.settings(READ_REPLICA_ALIAS=None, CACHES={"default": LOCAL_CACHE}):
+            check_pin_cache()
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("customer-order-history"))
+
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="\d+ queries", serialization;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$'
+        )
+
+    def test_metrics_endpoint_reports_views(self):
+        self.client.get(reverse("customer-order-history"))
+        admin = CustomUser.objects.create(email="admin@example.com", username="admin", password="!", role="Admin")
+        self.client.force_authenticate(user=admin)
+
+        body = self.client.get(reverse("metrics")).content.decode()
+
+        self.assertIn('pizzafy_request_duration_seconds_bucket{view="customer-order-history",le="+Inf"}', body)
+        self.assertIn('pizzafy_db_queries_total{view="customer-order-history"}', body)
+        self.assertIn('pizzafy_render_seconds_total{view="customer-order-history"}', body)
+
+    def test_serializer_and_render_times_are_separate(self):
+        pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=100)
+        order = Order.objects.create(
+            user=self.user, total_price=20, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        OrderLine.objects.create(order=order, pizza=pizza, quantity=2, price=10, size="Small")
+        request_metrics, token = begin_metrics()
+        try:
+            data = OrderSerializer(Order.objects.with_lines(), many=True).data
+            self.assertGreater(request_metrics.serialization_time, 0)
+            self.assertEqual(request_metrics.render_time, 0)
+
+            TimedJSONRenderer().render(data)
+            self.assertGreater(request_metrics.render_time, 0)
+        finally:
+            _current_metrics.reset(token)
+
+    def test_metrics_endpoint_is_internal(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        self.assertEqual(APIClient().get(reverse("metrics")).status_code, 401)
+
+        with self.settings(METRICS_ALLOWED_IPS=["127.0.0.1"]):
+            self.assertEqual(APIClient().get(reverse("metrics")).status_code, 200)
+
+    def test_exited_process_file_is_removed(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory, METRICS_FLUSH_SECONDS=0):
+            self.client.get(reverse("customer-order-history"))
+            self.assertEqual(os.listdir(directory), [f"{os.getpid()}.json"])
+
+            remove_process_file(os.getpid())
+
+            self.assertEqual(os.listdir(directory), [])
+
+    @override_settings(METRICS_QUERY_BUDGETS={"customer-order-history": 0})
+    def test_warns_when_over_query_budget(self):
+        with self.assertLogs("core.metrics", level="WARNING") as logs:
+            self.client.get(reverse("customer-order-history"))
+
+        self.assertIn("possible N+1", logs.output[0])
+
+
+@override_settings(RESPONSE_COMPRESSION_MIN_BYTES=1024)
+class WireFormatTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=100)
+
+    def _orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(
+                user=self.user, total_price=20, shipping_address="1 Main St", billing_address="1 Main St"
+            )
+            OrderLine.objects.create(order=order, pizza=self.pizza, quantity=2, price=10, size="Small")
+
+    def test_renders_msgpack_when_accepted(self):
+        self._orders(3)
+        url = reverse("customer-order-history")
+
+        as_json = self.client.get(url)
+        as_msgpack = self.client.get(url, HTTP_ACCEPT="application/msgpack")
+
+        self.assertEqual(as_msgpack["Content-Type"], "application/msgpack")
+        self.assertEqual(msgpack.unpackb(as_msgpack.content), json.loads(as_json.content))
+        self.assertLess(len(as_msgpack.content), len(as_json.content))
+
+    def test_parses_msgpack_request_bodies(self):
+        body = {
+            "shipping_address": "1 Main St",
+            "billing_address": "1 Main St",
+            "checkout_lines": [{"pizza_id": self.pizza.id, "price": 10, "quantity": 2, "size": "Medium"}],
+        }
+
+        response = self.client.post(
+            reverse("create-checkout"), msgpack.packb(body), content_type="application/msgpack",
+            HTTP_ACCEPT="application/msgpack",
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(msgpack.unpackb(response.content)["checkout_data"]["shipping_address"], "1 Main St")
+
+        response = self.client.post(reverse("create-checkout"), b"\x92\x01", content_type="application/msgpack")
+        self.assertEqual(response.status_code, 400)
+
+    def test_async_views_negotiate_msgpack(self):
+        self._orders(2)
+        access = RoleTokenObtainPairSerializer.get_token(self.user).access_token
+        request = APIRequestFactory().get(
+            "/api/checkout/my-orders/", HTTP_AUTHORIZATION=f"Bearer {access}", HTTP_ACCEPT="application/msgpack"
+        )
+
+        response = async_to_sync(AsyncCustomerOrderHistoryView.as_view())(request)
+
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(len(msgpack.unpackb(response.content)["results"]), 2)
+
+    def test_compresses_large_responses_the_client_accepts(self):
+        self._orders(20)
+        url = reverse("customer-order-history")
+        plain = self.client.get(url)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="deflate, gzip;q=0.8")
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Content-Length"], str(len(response.content)))
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertNotIn("Content-Encoding", plain)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip;q=0")
+        self.assertNotIn("Content-Encoding", response)
+
+    def test_leaves_small_responses_uncompressed(self):
+        self._orders(1)
+
+        response = self.client.get(reverse("customer-order-history"), HTTP_ACCEPT_ENCODING="gzip")
+
+        self.assertLess(len(response.content), 1024)
+        self.assertNotIn("Content-Encoding", response)
+
+    def test_accepted_coding(self):
+        self.assertEqual(accepted_coding("gzip, deflate"), "gzip")
+        self.assertEqual(accepted_coding("*;q=0.5"), accepted_coding("br, gzip"))
+        self.assertIsNone(accepted_coding("identity, deflate"))
+        self.assertIsNone(accepted_coding("gzip;q=0, *;q=0"))
+        self.assertIsNone(accepted_coding(""))
@@ -1,10 +1,11 @@
 from rest_framework_simplejwt import views as jwt_views
+from django.conf import settings
 from django.urls import path
 from . import views
 
 urlpatterns = [
     path('register/', views.RegisterView.as_view(), name='register'),
-    path('login/', views.CustomTokenObtainPairView.as_view(), name='login'),  
+    path('login/', views.async_login_view if settings.USE_ASYNC_VIEWS else views.CustomTokenObtainPairView.as_view(), name='login'),
     path('token/refresh/', jwt_views.TokenRefreshView.as_view(), name='token_refresh'),
     path('update-profile/', views.UpdateProfileView.as_view(), name='update_profile'),
 ]
\ No newline at end of file
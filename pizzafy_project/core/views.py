@@ -1,14 +1,24 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from .models import User as CustomUser
 from .serializers import UserSerializer, RegisterSerializer
+from .authentication import bump_token_version
+from .metrics import registry, render_prometheus
+from .permissions import IsAdminOrMetricsScraper
 from rest_framework.decorators import api_view
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 
 
 # Create your views here.
@@ -25,31 +35,71 @@ class CustomTokenObtainPairView(TokenObtainPairView):
     permission_classes = [AllowAny]
 
     def post(self, request, *args, **kwargs):
-        response = super().post(request, *args, **kwargs)
-
-        if response.status_code == 200:
-            # Get the username from request.data instead of request.get()
-            username_or_email = request.data.get("username") or request.data.get("email")
-            user = CustomUser.objects.filter(username=username_or_email).first() or CustomUser.objects.filter(email=username_or_email).first()
-            user_data = UserSerializer(user).data if user else {}
-            
-            return JsonResponse(
-                {
-                    "access": response.data.get("access"),
-                    "refresh": response.data.get("refresh"),
-                    "user": user_data,
-                }
-            )
-        return response
-    
+        serializer = self.get_serializer(data=request.data)
+
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        # The serializer already authenticated the user, so reuse it instead of looking it up again
+        return Response(
+            {
+                "access": serializer.validated_data.get("access"),
+                "refresh": serializer.validated_data.get("refresh"),
+                "user": UserSerializer(serializer.user).data,
+            }
+        )
+
+
+# Password hashing (PBKDF2) is CPU-bound; under ASGI it runs on this bounded pool instead of
+# the single thread Django uses for sync views, so a login storm can't stall other requests
+login_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "LOGIN_HASH_WORKERS", 4), thread_name_prefix="login-hash"
+)
+_sync_login_view = CustomTokenObtainPairView.as_view()
+
+
+def _login_in_pool(request, *args, **kwargs):
+    # Pool threads sit outside Django's request cycle, so manage their connections here
+    close_old_connections()
+    try:
+        # Rendered here too, so the encoding stays off the event loop
+        return _sync_login_view(request, *args, **kwargs).render()
+    finally:
+        close_old_connections()
+
+
+@csrf_exempt
+async def async_login_view(request, *args, **kwargs):
+    return await sync_to_async(_login_in_pool, thread_sensitive=False, executor=login_executor)(
+        request, *args, **kwargs
+    )
+
 
 class UpdateProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def put(self, request):
-        user = request.user
+        # Load the full row: the token-backed request user may hold stale claim values
+        user = CustomUser.objects.get(id=request.user.id)
+        previous_role = user.role
         serializer = RegisterSerializer(user, data=request.data, partial=True)  # `partial=True` allows updating only provided fields
         if serializer.is_valid():
             serializer.save()
+            # Tokens carry the role, so make clients refresh once it changes
+            if user.role != previous_role:
+                bump_token_version(user)
             return Response({"message": "Profile updated successfully"}, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsView(APIView):
+    """
+    Request metrics of every worker process as Prometheus text (see core.metrics)
+    """
+
+    permission_classes = [IsAdminOrMetricsScraper]
+
+    def get(self, request):
+        return HttpResponse(render_prometheus(registry.collect()), content_type="text/plain; version=0.0.4")
@@ -0,0 +1,112 @@
+"""
+Hot/cold order archival.
+
+Orders that are Fulfilled or Cancelled and were placed more than
+``ORDER_ARCHIVE_AGE_DAYS`` ago are moved, with their lines, from Order and
+OrderLine into ArchivedOrder and ArchivedOrderLine. Those tables keep the
+original ids and only the history index, so the live tables hold just the
+orders that are still being worked on. Orders are placed-time aged because
+no status change is timestamped.
+
+Payments and reviews are relinked from ``order`` to ``archived_order`` in the
+same transaction; both expose ``placed_order`` to resolve either. Order
+history reads both tiers (see filter_order_history), and the sales summary
+rebuild aggregates both (see order.reporting.summarise). Reviews and status
+changes look an order up in both tiers too; changing an archived order's
+status first moves it back with ``restore_orders``, and a later run archives
+it again once it is finished.
+
+Batches of ``ORDER_ARCHIVE_BATCH`` orders are moved in short transactions of
+their own. Like the checkout reaper, rows another transaction holds locked
+are skipped where the database supports ``SKIP LOCKED``; on SQLite each
+batch holds the database write lock for its transaction instead.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from payment.models import Payment
+
+from .models import ArchivedOrder, ArchivedOrderLine, Order, OrderLine, Review
+
+FINAL_STATUSES = ("Fulfilled", "Cancel")
+
+
+def archivable_orders(cutoff):
+    return Order.objects.filter(status__in=FINAL_STATUSES, created_at__lt=cutoff)
+
+
+def _copies(source, target, rows):
+    # Field for field, by column attribute, so foreign keys are copied as ids; fields only the source has are left
+    target_names = {field.attname for field in target._meta.concrete_fields}
+    names = [field.attname for field in source._meta.concrete_fields if field.attname in target_names]
+    return [target(**dict(zip(names, row))) for row in rows.values_list(*names)]
+
+
+def _copy(source, target, rows):
+    return target.objects.bulk_create(_copies(source, target, rows))
+
+
+def archive_orders(max_age=None, batch_size=None):
+    """
+    Move finished orders older than ``max_age`` (a timedelta) to the archive in batches of ``batch_size``.
+
+    A generator yielding ``(orders, lines, seconds)`` after every batch.
+    """
+    if max_age is None:
+        max_age = timedelta(days=getattr(settings, "ORDER_ARCHIVE_AGE_DAYS", 90))
+    batch_size = batch_size or getattr(settings, "ORDER_ARCHIVE_BATCH", 500)
+    cutoff = timezone.now() - max_age
+    last_id = 0
+    while True:
+        started = time.perf_counter()
+        with transaction.atomic():
+            ids = list(
+                archivable_orders(cutoff)
+                .filter(id__gt=last_id)
+                .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                return
+            # The rows stay locked (the whole database, on SQLite) until commit, so nothing changes them while they move
+            orders = _copy(Order, ArchivedOrder, Order.objects.filter(id__in=ids))
+            lines = _copy(OrderLine, ArchivedOrderLine, OrderLine.objects.filter(order_id__in=ids))
+            for model in (Payment, Review):
+                model.objects.filter(order_id__in=ids).update(archived_order_id=F("order_id"), order=None)
+            OrderLine.objects.filter(order_id__in=ids).delete()
+            Order.objects.filter(id__in=ids).delete()
+        # Walk forward by id, so skipped rows are not picked again
+        last_id = ids[-1]
+        yield len(orders), len(lines), time.perf_counter() - started
+
+
+def restore_orders(ids):
+    """
+    Move the archived orders ``ids`` back to the live tables, with their lines, payments and reviews.
+
+    Run it in the transaction that goes on to change them. Returns the restored orders, which may be fewer
+    than ``ids`` when another request restored some first.
+    """
+    ids = list(ids)
+    if not ids:
+        return []
+    archived = ArchivedOrder.objects.filter(id__in=ids)
+    orders = _copies(ArchivedOrder, Order, archived)
+    placed = {order.id: order.created_at for order in orders}
+    Order.objects.bulk_create(orders)
+    # auto_now_add stamps created_at on insert, so put back when each order was placed
+    for order in orders:
+        order.created_at = placed[order.id]
+    Order.objects.bulk_update(orders, ["created_at"])
+    _copy(ArchivedOrderLine, OrderLine, ArchivedOrderLine.objects.filter(order_id__in=ids))
+    for model in (Payment, Review):
+        model.objects.filter(archived_order_id__in=ids).update(order_id=F("archived_order_id"), archived_order=None)
+    # Deleting the orders cascades to their archived lines
+    archived.delete()
+    return orders
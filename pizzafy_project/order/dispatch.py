@@ -0,0 +1,135 @@
+"""
+Delivery partner dispatch.
+
+A dispatcher picks a partner from the availability pool (delivery partners
+with ``is_available=True`` and spare capacity) and claims them with a
+conditional UPDATE. The UPDATE only matches if the partner's load is still
+what we read, so two workers racing for the same partner can never both win
+and a partner is never booked past ``DISPATCH_PARTNER_CAPACITY``.
+
+The strategy is chosen with the ``DISPATCH_STRATEGY`` setting, either one of
+the names in ``DISPATCH_STRATEGIES`` or a dotted path to a dispatcher class.
+"""
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.models import User as CustomUser
+
+
+class BaseDispatcher:
+    # Ordering applied to the availability pool, best candidate first
+    ordering = ()
+    # How many candidates to read per attempt, and how often to re-read the pool
+    candidate_batch = 5
+    max_attempts = 5
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or getattr(settings, "DISPATCH_PARTNER_CAPACITY", 3)
+
+    def pool(self):
+        return CustomUser.objects.filter(
+            role="DeliveryPartner", is_available=True, active_orders__lt=self.capacity
+        )
+
+    def assign(self):
+        """
+        Claim a delivery partner for a new order.
+
+        Returns the claimed partner, or None when nobody is available.
+        """
+        for _ in range(self.max_attempts):
+            candidates = list(
+                self.pool()
+                .order_by(*self.ordering)
+                .only("id", "username", "active_orders", "last_assigned_at")[: self.candidate_batch]
+            )
+            if not candidates:
+                return None
+            for partner in candidates:
+                if self.claim(partner):
+                    return partner
+        return None
+
+    def claim(self, partner):
+        # Compare-and-swap on the values we read: fails if anyone else got there first
+        now = timezone.now()
+        claimed = CustomUser.objects.filter(
+            id=partner.id,
+            is_available=True,
+            active_orders=partner.active_orders,
+            last_assigned_at=partner.last_assigned_at,
+        ).update(active_orders=F("active_orders") + 1, last_assigned_at=now)
+        if claimed:
+            partner.active_orders += 1
+            partner.last_assigned_at = now
+        return bool(claimed)
+
+    def release(self, partner_id):
+        """
+        Free one unit of capacity once an assigned order is fulfilled or cancelled.
+        """
+        CustomUser.objects.filter(id=partner_id, active_orders__gt=0).update(
+            active_orders=F("active_orders") - 1
+        )
+
+    def reclaim(self, partner_id):
+        """
+        Take one unit of capacity back when a closed order is reopened.
+        """
+        self.reclaim_many({partner_id: 1})
+
+    def release_many(self, counts):
+        """
+        Free capacity for several partners at once, ``counts`` being {partner_id: orders closed}.
+        """
+        counts = self._positive(counts)
+        if not counts:
+            return
+        CustomUser.objects.filter(id__in=counts, active_orders__gt=0).update(
+            active_orders=Greatest(F("active_orders") - self._per_partner(counts), 0)
+        )
+
+    def reclaim_many(self, counts):
+        """
+        Take capacity back for closed orders that were reopened, ``counts`` being {partner_id: orders reopened}.
+
+        A reopened order keeps its partner, so this may book them past capacity until something closes.
+        """
+        counts = self._positive(counts)
+        if not counts:
+            return
+        CustomUser.objects.filter(id__in=counts).update(active_orders=F("active_orders") + self._per_partner(counts))
+
+    def _positive(self, counts):
+        return {partner_id: count for partner_id, count in counts.items() if partner_id and count > 0}
+
+    def _per_partner(self, counts):
+        return Case(
+            *[When(id=partner_id, then=Value(count)) for partner_id, count in counts.items()],
+            output_field=IntegerField(),
+        )
+
+
+class LeastLoadedDispatcher(BaseDispatcher):
+    # Fewest open orders first; ties go to whoever has waited longest
+    ordering = ("active_orders", "last_assigned_at", "id")
+
+
+class RoundRobinDispatcher(BaseDispatcher):
+    # Whoever has waited longest since their last assignment, regardless of load
+    ordering = ("last_assigned_at", "id")
+
+
+DISPATCH_STRATEGIES = {
+    "least_loaded": LeastLoadedDispatcher,
+    "round_robin": RoundRobinDispatcher,
+}
+
+
+def get_dispatcher(strategy=None):
+    strategy = strategy or getattr(settings, "DISPATCH_STRATEGY", "least_loaded")
+    dispatcher_class = DISPATCH_STRATEGIES.get(strategy) or import_string(strategy)
+    return dispatcher_class()
@@ -0,0 +1,217 @@
+"""
+Live order events.
+
+Order status and delivery partner changes are published to a broker once
+the transaction that made them commits, addressed to the users who can see
+the order (its customer and its delivery partner). OrderEventStream relays
+them to subscribers as Server-Sent Events at ``ORDER_EVENTS_PATH``.
+
+The stream is a plain ASGI app mounted in front of Django (see
+pizzafy_project/asgi.py) rather than a Django view. Django's ASGI handler
+gives every in-flight request its own thread for sync signal receivers, so
+a view would hold one idle thread per open stream. Here each subscription is
+an asyncio queue owned by the connection's event loop, and publishers in any
+thread hand events over with ``call_soon_threadsafe``. An idle stream costs a
+queue and a suspended coroutine. Authentication runs once per connection on
+the shared default executor.
+
+InProcessBroker only reaches subscribers connected to the same process. A
+deployment with several workers can swap in its own broker (e.g. backed by
+Redis pub/sub) with the ``ORDER_EVENTS_BROKER`` setting, a dotted path to a
+class with the same ``subscribe``/``publish`` interface.
+"""
+import asyncio
+import io
+import itertools
+import json
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, transaction
+from django.utils.module_loading import import_string
+from rest_framework import exceptions
+from rest_framework.settings import api_settings
+
+ORDER_EVENTS_PATH = "/api/checkout/events/"
+
+
+class Subscription:
+    def __init__(self, broker, user_id, maxsize):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+
+    def put(self, event):
+        # Called from whichever thread published; the queue is only touched on its own loop
+        self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        if self.queue.full():
+            # A stalled client loses its oldest events rather than growing the queue without bound
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, user_id):
+        """
+        Open a subscription for one user; must be called from the event loop that will read it.
+        """
+        subscription = Subscription(self, user_id, getattr(settings, "ORDER_EVENTS_QUEUE_SIZE", 100))
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_ids, event):
+        event = {"id": next(self._ids), **event}
+        with self._lock:
+            subscriptions = [
+                subscription for user_id in set(user_ids) for subscription in self._subscriptions.get(user_id, ())
+            ]
+        for subscription in subscriptions:
+            try:
+                subscription.put(event)
+            except RuntimeError:
+                # The connection's event loop has shut down
+                self.unsubscribe(subscription)
+
+
+def format_event(event):
+    data = json.dumps(event["data"], separators=(",", ":"))
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n".encode()
+
+
+@lru_cache(maxsize=None)
+def _broker(path):
+    return import_string(path)()
+
+
+def get_broker():
+    return _broker(getattr(settings, "ORDER_EVENTS_BROKER", "order.events.InProcessBroker"))
+
+
+def publish_order_event(order):
+    """
+    Tell the order's customer and delivery partner about its current state once the transaction commits.
+    """
+    event = {
+        "type": "order",
+        "data": {"order_id": order.id, "status": order.status, "delivery_partner_id": order.delivery_partner_id},
+    }
+    recipients = [user_id for user_id in (order.user_id, order.delivery_partner_id) if user_id]
+    transaction.on_commit(lambda: get_broker().publish(recipients, event))
+
+
+def authenticate(request):
+    # Same authenticators as the API views; returns the user or raises AuthenticationFailed
+    try:
+        for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+            user_auth = authentication_class().authenticate(request)
+            if user_auth is not None:
+                return user_auth[0]
+        raise exceptions.NotAuthenticated()
+    finally:
+        close_old_connections()
+
+
+class OrderEventStream:
+    """
+    ASGI app streaming the authenticated user's order events.
+    """
+
+    def __init__(self, heartbeat=None):
+        self.heartbeat = heartbeat or getattr(settings, "ORDER_EVENTS_HEARTBEAT_SECONDS", 15)
+
+    async def __call__(self, scope, receive, send):
+        if scope["method"] != "GET":
+            return await self.send_error(send, 405, {"detail": f'Method "{scope["method"]}" not allowed.'})
+
+        request = ASGIRequest(scope, io.BytesIO())
+        try:
+            # Off the event loop but without a thread of its own, unlike a Django view
+            user = await sync_to_async(authenticate, thread_sensitive=False)(request)
+        except exceptions.APIException as exc:
+            authenticator = api_settings.DEFAULT_AUTHENTICATION_CLASSES[0]()
+            headers = [(b"www-authenticate", authenticator.authenticate_header(request).encode())]
+            return await self.send_error(send, 401, {"detail": str(exc.detail)}, headers)
+
+        subscription = get_broker().subscribe(user.id)
+        disconnected = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-cache"),
+                    (b"x-accel-buffering", b"no"),  # Stop proxies from buffering the stream
+                ],
+            })
+            await send({"type": "http.response.body", "body": b"retry: 3000\n\n", "more_body": True})
+            while True:
+                next_event = asyncio.ensure_future(subscription.get())
+                done, _ = await asyncio.wait(
+                    {next_event, disconnected}, timeout=self.heartbeat, return_when=asyncio.FIRST_COMPLETED
+                )
+                if next_event not in done:
+                    next_event.cancel()
+                if disconnected in done:
+                    break
+                # A comment line keeps idle connections open through proxies
+                body = format_event(next_event.result()) if next_event in done else b": keep-alive\n\n"
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+        finally:
+            subscription.close()
+            disconnected.cancel()
+
+    async def wait_for_disconnect(self, receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def send_error(self, send, status, data, headers=()):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), *headers],
+        })
+        await send({"type": "http.response.body", "body": json.dumps(data).encode()})
+
+
+def with_order_events(application):
+    """
+    Wrap the Django ASGI application so ORDER_EVENTS_PATH is served by OrderEventStream.
+    """
+    stream = OrderEventStream()
+
+    async def router(scope, receive, send):
+        path = scope.get("path", "")
+        root_path = scope.get("root_path", "")
+        if scope["type"] == "http" and path.removeprefix(root_path) == ORDER_EVENTS_PATH:
+            return await stream(scope, receive, send)
+        return await application(scope, receive, send)
+
+    return router
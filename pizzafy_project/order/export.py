@@ -0,0 +1,42 @@
+"""
+Order export for finance: every order with its lines (see core.export).
+
+Live orders come first, then archived ones, told apart by the ``archived``
+column, so an export covers an order wherever it currently lives.
+"""
+from core.export import Export, ExportSource
+
+from .models import ArchivedOrder, Order
+
+ORDER_FIELDS = {
+    "id": "id",
+    "user_id": "user_id",
+    "user": "user__username",
+    "status": "status",
+    "status_note": "status_note",
+    "total_price": "total_price",
+    "shipping_address": "shipping_address",
+    "billing_address": "billing_address",
+    "delivery_partner": "delivery_partner__username",
+    "created_at": "created_at",
+}
+LINE_FIELDS = {
+    "id": "id",
+    "pizza_id": "pizza_id",
+    "pizza_name": "pizza__name",
+    "size": "size",
+    "quantity": "quantity",
+    "price": "price",
+    "customizations": "customizations",
+}
+
+
+def order_export(filters):
+    """
+    Orders matching ``filters`` (a Q over order fields), in both tiers.
+    """
+    sources = [
+        ExportSource(model.objects.filter(filters), ORDER_FIELDS, "order_lines", LINE_FIELDS, {"archived": archived})
+        for model, archived in ((Order, False), (ArchivedOrder, True))
+    ]
+    return Export("orders", sources, children_key="lines", child_prefix="line")
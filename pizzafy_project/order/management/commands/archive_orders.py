@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from order.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = "Move Fulfilled and Cancelled orders older than --age-days to the archive tables, in short batched transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--age-days", type=float, default=getattr(settings, "ORDER_ARCHIVE_AGE_DAYS", 90),
+            help="Archive finished orders placed longer ago than this",
+        )
+        parser.add_argument("--batch-size", type=int, default=getattr(settings, "ORDER_ARCHIVE_BATCH", 500))
+        parser.add_argument("--every", type=float, help="Keep running, archiving again every this many seconds")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        while True:
+            self.archive(timedelta(days=options["age_days"]), options["batch_size"])
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
+
+    def archive(self, max_age, batch_size):
+        total_orders = total_lines = 0
+        started = time.perf_counter()
+        for number, (orders, lines, seconds) in enumerate(archive_orders(max_age, batch_size), 1):
+            total_orders += orders
+            total_lines += lines
+            self.stdout.write(f"Batch {number}: {orders} orders, {lines} lines in {seconds * 1000:.1f}ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {total_orders} orders and {total_lines} lines in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,76 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from order.reporting import GRANULARITIES, HISTORY_TIERS, date_chunks, replace_summaries, summarise
+
+
+def _init_worker():
+    # A no-op under fork; under spawn the worker starts without Django set up
+    django.setup()
+
+
+def _summarise_chunk(granularity, start, end):
+    return granularity, start, end, summarise(granularity, start, end)
+
+
+def _summarise_in_worker(granularity, start, end):
+    try:
+        return _summarise_chunk(granularity, start, end)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily and hourly sales summaries from order history, in date chunks spread over worker processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", type=date.fromisoformat, help="First local date to rebuild (default: first order)")
+        parser.add_argument("--end", type=date.fromisoformat, help="Last local date to rebuild (default: today)")
+        parser.add_argument("--granularity", choices=sorted(GRANULARITIES), action="append")
+        parser.add_argument("--chunk-days", type=int, default=7)
+        parser.add_argument("--workers", type=int, default=1, help="Processes to rebuild chunks in parallel")
+
+    def handle(self, *args, **options):
+        start, end = options["start"], options["end"]
+        if start is None or end is None:
+            # Orders placed long ago may all have moved to the archive, so the range spans both tiers
+            bounds = [
+                model.objects.aggregate(first=Min("created_at"), last=Max("created_at")) for model, _ in HISTORY_TIERS
+            ]
+            firsts = [tier["first"] for tier in bounds if tier["first"] is not None]
+            if not firsts:
+                self.stdout.write("No orders to summarise")
+                return
+            start = start or timezone.localdate(min(firsts))
+            lasts = [timezone.localdate(tier["last"]) for tier in bounds if tier["last"] is not None]
+            end = end or max(timezone.localdate(), *lasts)
+        if start > end:
+            raise CommandError("--start must not be after --end")
+
+        chunks = [
+            (granularity, chunk_start, chunk_end)
+            for granularity in options["granularity"] or sorted(GRANULARITIES)
+            for chunk_start, chunk_end in date_chunks(start, end + timedelta(days=1), options["chunk_days"])
+        ]
+
+        if options["workers"] > 1 and len(chunks) > 1:
+            # Connections cannot cross a fork; workers open their own
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options["workers"], initializer=_init_worker) as pool:
+                self.write(pool.map(_summarise_in_worker, *zip(*chunks)))
+        else:
+            self.write(_summarise_chunk(*chunk) for chunk in chunks)
+
+    def write(self, results):
+        # Workers only aggregate; writes stay in this process, since SQLite allows one writer at a time
+        total = 0
+        for granularity, start, end, rows in results:
+            total += replace_summaries(granularity, start, end, rows)
+            self.stdout.write(f"{granularity} {start} to {end - timedelta(days=1)}: {len(rows)} rows")
+        self.stdout.write(self.style.SUCCESS(f"Wrote {total} summary rows"))
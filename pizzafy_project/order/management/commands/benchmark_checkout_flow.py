@@ -0,0 +1,211 @@
+import asyncio
+import json
+import re
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.loadtest import HTTPConnection, percentile
+from pizza.models import Pizza
+
+STEPS = (
+    "register",
+    "login",
+    "create-checkout",
+    "update-checkout",
+    "payment-create",
+    "complete-checkout",
+    "my-orders",
+)
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+class FlowError(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive the full customer flow (register, login, create/update checkout, pay, complete, my-orders) "
+        "against a running server and report per-step throughput, latency percentiles and query counts. "
+        "Query counts come from the Server-Timing header, so the server must run core.middleware.metrics_middleware. "
+        "Fails if any request fails."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL of a running server")
+        parser.add_argument("--flows", type=int, default=200, help="Number of customer flows to run")
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument("--lines", type=int, default=3, help="Checkout lines per order")
+        parser.add_argument("--pizza-id", type=int, help="Pizza to order; by default one is created in the local database")
+        parser.add_argument("--save-baseline", metavar="PATH", help="Write the results to a JSON baseline")
+        parser.add_argument("--check", metavar="PATH", help="Fail if results regress against this baseline")
+        parser.add_argument("--latency-threshold", type=float, default=0.25, help="Allowed p95 slowdown, as a fraction")
+        parser.add_argument("--query-threshold", type=int, default=0, help="Allowed extra queries per step")
+
+    def handle(self, *args, **options):
+        # Each flow orders its lines, then the update adds one unit to the first line and one new line
+        pizza_id = options["pizza_id"] or self.seed_pizza(options["flows"] * (options["lines"] + 2))
+        results = asyncio.run(self.run(options, pizza_id))
+        self.report(results)
+
+        # Failed flows skip their later steps, so their timings would not be comparable with a clean run
+        errors = sum(stats["errors"] for stats in results["steps"].values())
+        if errors:
+            raise CommandError(f"{errors} requests failed (see the err column)")
+
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w") as handle:
+                json.dump(results, handle, indent=2, sort_keys=True)
+            self.stdout.write(f"Baseline written to {options['save_baseline']}")
+
+        if options["check"]:
+            self.check_regressions(results, options)
+
+    def seed_pizza(self, stock):
+        pizza = Pizza.objects.create(
+            name=f"Benchmark pizza {uuid.uuid4().hex[:8]}", description="Load test", price=10, stock=stock
+        )
+        return pizza.id
+
+    async def run(self, options, pizza_id):
+        samples = {step: {"latencies": [], "queries": [], "errors": 0} for step in STEPS}
+        run_id = uuid.uuid4().hex[:8]
+        semaphore = asyncio.Semaphore(options["concurrency"])
+
+        async def flow(index):
+            async with semaphore:
+                connection = HTTPConnection(options["url"])
+                try:
+                    await self.customer_flow(connection, samples, f"{run_id}-{index}", pizza_id, options["lines"])
+                except FlowError:
+                    pass  # Counted against the step that failed
+                finally:
+                    await connection.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(flow(index) for index in range(options["flows"])))
+        elapsed = time.perf_counter() - started
+
+        results = {"flows": options["flows"], "concurrency": options["concurrency"], "elapsed_s": elapsed, "steps": {}}
+        for step, sample in samples.items():
+            latencies = sample["latencies"]
+            results["steps"][step] = {
+                "requests": len(latencies),
+                "errors": sample["errors"],
+                "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+                "p50_ms": percentile(latencies, 0.50) * 1000,
+                "p95_ms": percentile(latencies, 0.95) * 1000,
+                "p99_ms": percentile(latencies, 0.99) * 1000,
+                "queries": statistics.median(sample["queries"]) if sample["queries"] else None,
+            }
+        return results
+
+    async def step(self, connection, samples, name, method, path, body=None, token=None, expect=(200, 201), pick=None):
+        """
+        Send one request and return its JSON body, or ``pick(body)``.
+
+        A failed request, an unexpected status or a body ``pick`` cannot read counts as an error of this step
+        and raises FlowError.
+        """
+        headers = {"Authorization": f"Bearer {token}"} if token else None
+        sample = samples[name]
+        try:
+            result = await connection.request(method, path, body, headers)
+        except (OSError, asyncio.IncompleteReadError) as exc:
+            sample["errors"] += 1
+            raise FlowError(f"{name} failed: {exc!r}") from exc
+        sample["latencies"].append(result.elapsed)
+        queries = SERVER_TIMING_QUERIES.search(result.headers.get("server-timing", ""))
+        if queries:
+            sample["queries"].append(int(queries.group(1)))
+        if result.status not in expect:
+            sample["errors"] += 1
+            raise FlowError(f"{name} returned {result.status}")
+        try:
+            data = result.json()
+            return pick(data) if pick else data
+        except (KeyError, IndexError, TypeError, ValueError) as exc:
+            sample["errors"] += 1
+            raise FlowError(f"{name} returned an unexpected body: {exc!r}") from exc
+
+    async def customer_flow(self, connection, samples, suffix, pizza_id, line_count):
+        email = f"bench-{suffix}@example.invalid"
+        password = f"pw-{suffix}"
+        await self.step(
+            connection, samples, "register", "POST", "/api/auth/register/",
+            {
+                "username": f"bench-{suffix}", "first_name": "Bench", "last_name": suffix,
+                "email": email, "password": password, "role": "Customer",
+            },
+        )
+        token = await self.step(
+            connection, samples, "login", "POST", "/api/auth/login/", {"email": email, "password": password},
+            pick=lambda data: data["access"],
+        )
+
+        line = {"pizza_id": pizza_id, "price": 10, "quantity": 1, "size": "Medium"}
+        checkout_id, first_line = await self.step(
+            connection, samples, "create-checkout", "POST", "/api/checkout/create-checkout/",
+            {"shipping_address": "1 Bench St", "billing_address": "1 Bench St", "checkout_lines": [line] * line_count},
+            token,
+            pick=lambda data: (data["checkout_data"]["id"], data["checkout_data"]["checkout_lines"][0]["id"]),
+        )
+
+        await self.step(
+            connection, samples, "update-checkout", "POST", f"/api/checkout/update-checkout/{checkout_id}/",
+            {"checkout_lines": [
+                {"checkout_line_id": first_line, "action": "update", "quantity": 2},
+                {**line, "action": "add"},
+            ]},
+            token,
+        )
+        await self.step(
+            connection, samples, "payment-create", "POST", "/api/checkout/payment/create/",
+            {"checkout_id": checkout_id, "payment_method": "COD"}, token,
+        )
+        await self.step(
+            connection, samples, "complete-checkout", "POST", "/api/checkout/complete-checkout/",
+            {"checkout_id": checkout_id}, token,
+        )
+        await self.step(connection, samples, "my-orders", "GET", "/api/checkout/my-orders/", token=token)
+
+    def report(self, results):
+        self.stdout.write(
+            f"{results['flows']} flows at concurrency {results['concurrency']} in {results['elapsed_s']:.2f}s"
+        )
+        self.stdout.write(
+            f"{'step':<18} {'req':>6} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}"
+        )
+        for step, stats in results["steps"].items():
+            queries = "-" if stats["queries"] is None else f"{stats['queries']:g}"
+            self.stdout.write(
+                f"{step:<18} {stats['requests']:>6} {stats['errors']:>5} {stats['throughput_rps']:>8.1f} "
+                f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f} {stats['p99_ms']:>8.1f} {queries:>8}"
+            )
+
+    def check_regressions(self, results, options):
+        with open(options["check"]) as handle:
+            baseline = json.load(handle)
+
+        failures = []
+        for step, stats in results["steps"].items():
+            base = baseline["steps"].get(step)
+            if not base:
+                continue
+            allowed_p95 = base["p95_ms"] * (1 + options["latency_threshold"])
+            if stats["p95_ms"] > allowed_p95:
+                failures.append(f"{step}: p95 {stats['p95_ms']:.1f}ms > {allowed_p95:.1f}ms allowed")
+            if (
+                stats["queries"] is not None
+                and base["queries"] is not None
+                and stats["queries"] > base["queries"] + options["query_threshold"]
+            ):
+                failures.append(f"{step}: {stats['queries']:g} queries > baseline {base['queries']:g}")
+
+        if failures:
+            raise CommandError("Regressions against baseline:\n  " + "\n  ".join(failures))
+        self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
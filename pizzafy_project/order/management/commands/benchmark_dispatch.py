@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import User as CustomUser
+from order.dispatch import DISPATCH_STRATEGIES, get_dispatcher
+
+
+class Command(BaseCommand):
+    help = "Measure delivery partner assignments per second against a synthetic partner pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--partners", type=int, default=10000)
+        parser.add_argument("--assignments", type=int, default=2000)
+        parser.add_argument("--strategy", choices=sorted(DISPATCH_STRATEGIES), action="append")
+
+    def handle(self, *args, **options):
+        for strategy in options["strategy"] or sorted(DISPATCH_STRATEGIES):
+            # Everything runs in a transaction that is rolled back, so no partners are left behind
+            with transaction.atomic():
+                CustomUser.objects.bulk_create(
+                    [
+                        CustomUser(
+                            email=f"bench-partner-{i}@example.invalid",
+                            username=f"bench-partner-{i}",
+                            password="!",
+                            role="DeliveryPartner",
+                        )
+                        for i in range(options["partners"])
+                    ],
+                    batch_size=1000,
+                )
+
+                dispatcher = get_dispatcher(strategy)
+                assigned = 0
+                started = time.perf_counter()
+                for _ in range(options["assignments"]):
+                    if dispatcher.assign():
+                        assigned += 1
+                elapsed = time.perf_counter() - started
+
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{strategy}: {assigned} assignments over {options['partners']} partners "
+                f"in {elapsed:.3f}s ({assigned / elapsed:.0f} assignments/s)"
+            )
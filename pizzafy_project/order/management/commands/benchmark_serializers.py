@@ -0,0 +1,115 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.models import User
+from core.renderers import FastJSONRenderer, TimedJSONRenderer
+from order.models import Checkout, CheckoutLine, Order, OrderLine
+from order.serializers import CheckoutSerializer, OrderSerializer, checkout_rows, order_rows
+from pizza.models import Pizza
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure rows per second serializing orders and checkouts with the DRF serializers and with the "
+        "read-only row serializers, and check that both produce the same JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=5000, help="Orders and checkouts to create")
+        parser.add_argument("--lines", type=int, default=3, help="Lines per order and checkout")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per path; the fastest is reported")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+
+        # Everything runs in a transaction that is rolled back, so no rows are left behind
+        with transaction.atomic():
+            self.seed(rng, options["rows"], options["lines"])
+            orders = Order.objects.filter(user__username="benchmark-serializers").order_by("-created_at", "-id")
+            checkouts = Checkout.objects.filter(user__username="benchmark-serializers").order_by("id")
+
+            for name, slow, fast in (
+                (
+                    "orders",
+                    lambda: TimedJSONRenderer().render(OrderSerializer(orders.with_lines(), many=True).data),
+                    lambda: FastJSONRenderer().render(order_rows.serialize(orders)),
+                ),
+                (
+                    "checkouts",
+                    lambda: TimedJSONRenderer().render(
+                        CheckoutSerializer(checkouts.prefetch_related("checkout_lines"), many=True).data
+                    ),
+                    lambda: FastJSONRenderer().render(checkout_rows.serialize(checkouts)),
+                ),
+            ):
+                slow_body, slow_seconds = self.time(slow, options["repeat"])
+                fast_body, fast_seconds = self.time(fast, options["repeat"])
+                if fast_body != slow_body:
+                    raise CommandError(f"{name}: row serializer output differs from the DRF serializer's")
+                rows = options["rows"]
+                self.stdout.write(
+                    f"{name}: DRF {rows / slow_seconds:,.0f} rows/s, rows {rows / fast_seconds:,.0f} rows/s "
+                    f"({slow_seconds / fast_seconds:.1f}x), {len(fast_body):,} identical bytes"
+                )
+
+            transaction.set_rollback(True)
+
+    def seed(self, rng, count, lines):
+        user = User.objects.create(email="benchmark-serializers@example.com", username="benchmark-serializers")
+        partner = User.objects.create(
+            email="benchmark-rider@example.com", username="benchmark-rider", role="DeliveryPartner"
+        )
+        pizzas = Pizza.objects.bulk_create(
+            Pizza(name=f"Benchmark pizza {i}", description="", price=Decimal(900 + i) / 100, stock=100)
+            for i in range(20)
+        )
+        orders = Order.objects.bulk_create(
+            [
+                Order(
+                    user=user, status=rng.choice(["Unfulfilled", "Fulfilled", "Cancel"]), total_price=30,
+                    shipping_address="1 Main St", billing_address="1 Main St",
+                    delivery_partner=rng.choice([partner, None]),
+                )
+                for _ in range(count)
+            ],
+            batch_size=2000,
+        )
+        checkouts = Checkout.objects.bulk_create(
+            [
+                Checkout(user=user, total_price=30, shipping_address="1 Main St", billing_address="1 Main St")
+                for _ in range(count)
+            ],
+            batch_size=2000,
+        )
+        OrderLine.objects.bulk_create(
+            [
+                OrderLine(order=order, pizza=pizza, quantity=rng.randint(1, 3), price=pizza.price, size="Medium")
+                for order in orders
+                for pizza in rng.sample(pizzas, lines)
+            ],
+            batch_size=2000,
+        )
+        CheckoutLine.objects.bulk_create(
+            [
+                CheckoutLine(
+                    checkout=checkout, pizza=pizza, quantity=rng.randint(1, 3), price=pizza.price, size="Medium",
+                    customizations=rng.choice(["", "Extra olives", "No onion"]),
+                )
+                for checkout in checkouts
+                for pizza in rng.sample(pizzas, lines)
+            ],
+            batch_size=2000,
+        )
+
+    def time(self, render, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = render()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return body, best
@@ -0,0 +1,109 @@
+import gzip
+import json
+import random
+import time
+from decimal import Decimal
+
+import msgpack
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+
+from core.compression import CODINGS, brotli
+from core.loadtest import percentile
+from core.models import User
+from core.serializers import RoleTokenObtainPairSerializer
+from order.models import Order, OrderLine
+from pizza.models import Pizza
+
+FORMATS = {"json": "application/json", "msgpack": "application/msgpack"}
+DECODERS = {"json": json.loads, "msgpack": msgpack.unpackb}
+NAMES = ["Margherita", "Farmhouse", "Peppy Paneer", "Chicken Dominator", "Veggie Paradise", "Pepper Barbecue"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure response size and latency of an order-history page in each wire format and content coding, "
+        "served through the full middleware stack, and estimate the time to fetch it over a slow link"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=100, help="Orders in the history; a page holds up to 100")
+        parser.add_argument("--lines", type=int, default=3, help="Lines per order")
+        parser.add_argument("--requests", type=int, default=50, help="Requests per format and coding")
+        parser.add_argument("--link-kbps", type=float, default=1600, help="Link speed for the transfer estimate")
+
+    def handle(self, *args, **options):
+        # Everything runs in a transaction that is rolled back, so no rows are left behind
+        with transaction.atomic():
+            user = self.seed(random.Random(0), options["orders"], options["lines"])
+            access = RoleTokenObtainPairSerializer.get_token(user).access_token
+            client = Client(HTTP_AUTHORIZATION=f"Bearer {access}")
+            url = reverse("customer-order-history") + f"?page_size={min(options['orders'], 100)}"
+
+            baseline, expected = None, None
+            for name, media_type in FORMATS.items():
+                for coding in ["identity", *CODINGS]:
+                    body, latencies = self.fetch(client, url, media_type, coding, options["requests"])
+                    data = DECODERS[name](self.decode(body, coding))
+                    if expected is None:
+                        expected = data
+                    elif data != expected:
+                        raise CommandError(f"{name} with {coding} decoded to different data")
+
+                    p50 = percentile(latencies, 0.5)
+                    # What a client on the slow link waits for: the server's time plus the transfer
+                    total = p50 + len(body) * 8 / (options["link_kbps"] * 1000)
+                    baseline = baseline or (len(body), total)
+                    self.stdout.write(
+                        f"{name} {coding}: {len(body):,} bytes ({1 - len(body) / baseline[0]:.0%} smaller), "
+                        f"server p50 {p50 * 1000:.2f}ms p95 {percentile(latencies, 0.95) * 1000:.2f}ms, "
+                        f"{total * 1000:.0f}ms at {options['link_kbps']:g} kbit/s "
+                        f"({1 - total / baseline[1]:.0%} faster)"
+                    )
+
+            transaction.set_rollback(True)
+
+    def seed(self, rng, count, lines):
+        user = User.objects.create(email="benchmark-wire@example.com", username="benchmark-wire")
+        partner = User.objects.create(
+            email="benchmark-wire-rider@example.com", username="Rider", role="DeliveryPartner"
+        )
+        pizzas = Pizza.objects.bulk_create(
+            Pizza(name=f"{name} {size}", description="", price=Decimal(rng.randint(600, 1800)) / 100, stock=100)
+            for name in NAMES
+            for size in ("Small", "Medium", "Large")
+        )
+        orders = Order.objects.bulk_create(
+            Order(
+                user=user, status=rng.choice(["Unfulfilled", "Fulfilled", "Cancel"]), total_price=30,
+                shipping_address="1 Main St", billing_address="1 Main St", delivery_partner=rng.choice([partner, None]),
+            )
+            for _ in range(count)
+        )
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, pizza=pizza, quantity=rng.randint(1, 3), price=pizza.price, size="Medium")
+            for order in orders
+            for pizza in rng.sample(pizzas, lines)
+        )
+        return user
+
+    def fetch(self, client, url, media_type, coding, requests):
+        latencies = []
+        for _ in range(requests + 1):
+            started = time.perf_counter()
+            response = client.get(url, HTTP_ACCEPT=media_type, HTTP_ACCEPT_ENCODING=coding)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise CommandError(f"{media_type} {coding}: HTTP {response.status_code}")
+            if response.get("Content-Encoding", "identity") != coding:
+                raise CommandError(f"{media_type} {coding}: not encoded; is the page below the compression threshold?")
+        return response.content, latencies[1:]  # The first request warms up
+
+    def decode(self, body, coding):
+        if coding == "gzip":
+            return gzip.decompress(body)
+        if coding == "br":
+            return brotli.decompress(body)
+        return body
@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from order.reaper import reap_abandoned_checkouts
+
+
+class Command(BaseCommand):
+    help = "Delete checkouts left untouched for longer than --max-age-hours, in short batched transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age-hours", type=float, default=getattr(settings, "CHECKOUT_REAPER_AGE_HOURS", 72),
+            help="Reap checkouts whose updated_at is older than this",
+        )
+        parser.add_argument("--batch-size", type=int, default=getattr(settings, "CHECKOUT_REAPER_BATCH", 500))
+        parser.add_argument("--every", type=float, help="Keep running, reaping again every this many seconds")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+        while True:
+            self.reap(timedelta(hours=options["max_age_hours"]), options["batch_size"])
+            if not options["every"]:
+                return
+            time.sleep(options["every"])
+
+    def reap(self, max_age, batch_size):
+        total_checkouts = total_lines = 0
+        started = time.perf_counter()
+        for number, (checkouts, lines, seconds) in enumerate(reap_abandoned_checkouts(max_age, batch_size), 1):
+            total_checkouts += checkouts
+            total_lines += lines
+            self.stdout.write(f"Batch {number}: {checkouts} checkouts, {lines} lines in {seconds * 1000:.1f}ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"Reaped {total_checkouts} checkouts and {total_lines} lines in {time.perf_counter() - started:.2f}s"
+        ))
@@ -2,6 +2,16 @@ from django.db import models
 from core.models import User as CustomUser
 from pizza.models import Pizza
 
+class OrderQuerySet(models.QuerySet):
+    def with_lines(self):
+        # Everything OrderSerializer touches, in a fixed number of queries
+        # Shared by Order and ArchivedOrder, so prefetch from whichever line model belongs to this one
+        line_model = self.model._meta.get_field("order_lines").related_model
+        return self.select_related("user", "delivery_partner").prefetch_related(
+            models.Prefetch("order_lines", queryset=line_model.objects.select_related("pizza"))
+        )
+
+
 # Order model: Represents the confirmed order after checkout
 class Order(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
@@ -18,10 +28,19 @@ class Order(models.Model):
         choices=[("Pending", "Pending"), ("Paid", "Paid"), ("Failed", "Failed")],
         default="Pending",
     )
+    status_note = models.TextField(blank=True, default="")  # Comment given with the latest status change
     delivery_date = models.DateTimeField(null=True, blank=True)  # Actual delivery date
     delivery_partner = models.ForeignKey(CustomUser, related_name="assigned_orders", null=True, blank=True, on_delete=models.SET_NULL)
     created_at = models.DateTimeField(auto_now_add=True)  # Order creation timestamp
 
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Order history keyset: a customer's orders newest first
+            models.Index(fields=["user", "-created_at", "-id"], name="order_user_history_idx"),
+        ]
+
     def __str__(self):
         return f"Order {self.id} for {self.user.username}"
 
@@ -62,11 +81,93 @@ class CheckoutLine(models.Model):
         return f"{self.quantity} x {self.pizza.name} ({self.size}) in Checkout {self.checkout.id}"
     
     
+# Archived orders: Fulfilled and Cancelled orders moved out of the live tables by order.archive.
+# Rows keep their original ids, so links to them still resolve.
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)  # The id the order had while live
+    user = models.ForeignKey(CustomUser, related_name="archived_orders", on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=Order._meta.get_field("status").choices)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    shipping_address = models.TextField()
+    billing_address = models.TextField()
+    status_note = models.TextField(blank=True, default="")
+    payment_status = models.CharField(max_length=20, choices=Order._meta.get_field("payment_status").choices)
+    delivery_date = models.DateTimeField(null=True, blank=True)
+    delivery_partner = models.ForeignKey(
+        CustomUser, related_name="archived_assigned_orders", null=True, blank=True, on_delete=models.SET_NULL
+    )
+    created_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Only the order history keyset; archived orders are not searched any other way
+            models.Index(fields=["user", "-created_at", "-id"], name="archived_order_history_idx"),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.id} for {self.user.username}"
+
+
+class ArchivedOrderLine(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, related_name="order_lines", on_delete=models.CASCADE)
+    pizza = models.ForeignKey(Pizza, on_delete=models.CASCADE)
+    quantity = models.IntegerField(default=1)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+    size = models.CharField(max_length=20, choices=OrderLine._meta.get_field("size").choices)
+    customizations = models.TextField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.pizza.name} ({self.size}) in archived order {self.order_id}"
+
+
 class Review(models.Model):
     order = models.OneToOneField(Order, null=True, on_delete=models.SET_NULL)
+    archived_order = models.OneToOneField(ArchivedOrder, null=True, blank=True, on_delete=models.SET_NULL)  # Set instead of order once archived
     rating = models.IntegerField(choices=[(1, 1), (2, 2), (3, 3), (4, 4), (5, 5)])  # Rating out of 5 stars
     comment = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Review for {self.delivery_partner.username} by {self.customer.username}"
\ No newline at end of file
+        return f"Review for {self.delivery_partner.username} by {self.customer.username}"
+
+    @property
+    def placed_order(self):
+        # The reviewed order, live or archived
+        return self.order or self.archived_order
+
+# Sales summaries: pre-aggregated revenue, orders and units, maintained by order.reporting
+class SalesSummary(models.Model):
+    # A row with no pizza and a blank size holds the totals for the whole bucket
+    pizza = models.ForeignKey(Pizza, null=True, blank=True, on_delete=models.CASCADE)
+    size = models.CharField(max_length=20, blank=True, default="")
+    orders = models.IntegerField(default=0)  # Orders placed, cancelled ones excluded
+    units = models.IntegerField(default=0)  # Pizzas sold, cancelled orders excluded
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    cancelled = models.IntegerField(default=0)  # Orders placed in the bucket and later cancelled
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesSummary):
+    bucket = models.DateField()  # Local date the orders were placed on
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bucket", "pizza", "size"], name="daily_sales_bucket_pizza_size"),
+            models.UniqueConstraint(fields=["bucket"], condition=models.Q(pizza__isnull=True), name="daily_sales_bucket_total"),
+        ]
+
+
+class HourlySales(SalesSummary):
+    bucket = models.DateTimeField()  # Start of the local hour the orders were placed in
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["bucket", "pizza", "size"], name="hourly_sales_bucket_pizza_size"),
+            models.UniqueConstraint(fields=["bucket"], condition=models.Q(pizza__isnull=True), name="hourly_sales_bucket_total"),
+        ]
@@ -0,0 +1,127 @@
+"""
+Keyset pagination for order history.
+
+Pages are ordered newest first on (created_at, id), the same columns as
+Order's order_user_history_idx, and the cursor holds the last seen
+(created_at, id) pair, so every page is an index range scan no matter how
+deep it is. The database work is isolated in ``tier_querysets`` so the sync
+and async history views share everything but the fetch.
+
+History can span several tiers, e.g. live orders then archived ones. They
+are read one after the other, each newest first, and a page that runs off
+the end of one tier is filled from the next. The cursor also records which
+tier its row came from.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class OrderHistoryPagination:
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    cursor_query_param = "cursor"
+
+    def __init__(self, request):
+        # Works with both a DRF Request and a plain Django HttpRequest
+        self.request = request
+        self.page_size = self.get_page_size()
+        self.cursor = self.decode_cursor(request.GET.get(self.cursor_query_param))
+
+    def get_page_size(self):
+        try:
+            page_size = int(self.request.GET[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(page_size, self.max_page_size) if page_size > 0 else self.page_size
+
+    def decode_cursor(self, encoded):
+        # Cursor is "<direction>|<created_at>|<id>[|<tier>]", direction "n" (older) or "p" (newer);
+        # the tier is left out for the first one
+        if not encoded:
+            return None
+        try:
+            parts = base64.urlsafe_b64decode(encoded.encode()).decode().split("|")
+            if len(parts) not in (3, 4):
+                raise ValueError(parts)
+            direction, created_at, pk = parts[:3]
+            tier = int(parts[3]) if len(parts) == 4 else 0
+            if direction not in ("n", "p") or tier < 0:
+                raise ValueError(direction)
+            return direction == "p", datetime.fromisoformat(created_at), int(pk), tier
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound("Invalid cursor")
+
+    def encode_cursor(self, reverse, tier, order):
+        raw = f"{'p' if reverse else 'n'}|{order.created_at.isoformat()}|{order.id}"
+        if tier:
+            raw += f"|{tier}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    def tier_querysets(self, tiers):
+        """
+        ``(tier, queryset)`` pairs in reading order, each sorted the way it is read; the caller slices them.
+        """
+        newest_first, oldest_first = ("-created_at", "-id"), ("created_at", "id")
+        if self.cursor is None:
+            return [(tier, queryset.order_by(*newest_first)) for tier, queryset in enumerate(tiers)]
+
+        reverse, created_at, pk, tier = self.cursor
+        if tier >= len(tiers):
+            raise NotFound("Invalid cursor")
+        if reverse:
+            first = tiers[tier].filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+            rest = range(tier - 1, -1, -1)
+            ordering = oldest_first
+        else:
+            first = tiers[tier].filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+            rest = range(tier + 1, len(tiers))
+            ordering = newest_first
+        return [(tier, first.order_by(*ordering))] + [(index, tiers[index].order_by(*ordering)) for index in rest]
+
+    def paginate(self, rows):
+        # rows are (tier, order) pairs, one more than a page at most, to tell whether another page follows.
+        # An order is a model instance or anything else with created_at and id, such as a named row
+        entries = rows[: self.page_size]
+        has_more = len(rows) > self.page_size
+        reverse = self.cursor is not None and self.cursor[0]
+        if reverse:
+            entries.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+        self.entries = entries
+        self.page = [order for _, order in entries]
+        return self.page
+
+    def paginate_queryset(self, *tiers):
+        rows = []
+        for tier, queryset in self.tier_querysets(tiers):
+            rows += [(tier, order) for order in queryset[: self.page_size + 1 - len(rows)]]
+            if len(rows) > self.page_size:
+                break
+        return self.paginate(rows)
+
+    async def apaginate_queryset(self, *tiers):
+        rows = []
+        for tier, queryset in self.tier_querysets(tiers):
+            rows += [(tier, order) async for order in queryset[: self.page_size + 1 - len(rows)]]
+            if len(rows) > self.page_size:
+                break
+        return self.paginate(rows)
+
+    def get_link(self, reverse, entry):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(reverse, *entry))
+
+    def get_paginated_data(self, data):
+        next_link = self.get_link(False, self.entries[-1]) if self.has_next and self.entries else None
+        previous_link = self.get_link(True, self.entries[0]) if self.has_previous and self.entries else None
+        if self.has_previous and not self.entries:
+            # Walked past the end; send the client back to the first page
+            previous_link = remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return {"next": next_link, "previous": previous_link, "results": data}
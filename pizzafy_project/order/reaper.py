@@ -0,0 +1,78 @@
+"""
+Abandoned checkout cleanup.
+
+Checkouts are only deleted when they become orders, so carts that are never
+completed stay forever and slow down every checkout lookup. The reaper
+deletes checkouts whose ``updated_at`` is older than a cutoff. It never
+touches a checkout with a pending or completed Payment, since that payment
+may still be settling or may become an order; a checkout whose payment
+failed and was never retried is abandoned like any other.
+
+Work is split into batches of ``CHECKOUT_REAPER_BATCH`` checkouts, each deleted
+with its lines in a short transaction of its own, so a live checkout is never
+blocked for longer than one batch takes. On databases that support
+``SKIP LOCKED`` (PostgreSQL, MySQL 8, Oracle), rows that another transaction
+holds locked (e.g. a checkout being edited) are skipped rather than waited
+on. SQLite has no row locks: each batch's IMMEDIATE transaction takes the
+database write lock instead, so writers queue behind it for that batch.
+Either way the delete checks the conditions again, so a checkout edited or
+paid for after it was picked is kept.
+
+Run it with the reap_abandoned_checkouts command, either once from cron or
+another scheduler, or with ``--every`` as a single long-lived job. Nothing
+starts it in the web processes.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from payment.models import Payment
+
+from .models import Checkout, CheckoutLine
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def abandoned_checkouts(cutoff):
+    return Checkout.objects.filter(updated_at__lt=cutoff).exclude(
+        Exists(Payment.objects.filter(checkout=OuterRef("pk")).exclude(status="Failed"))
+    )
+
+
+def reap_abandoned_checkouts(max_age=None, batch_size=None):
+    """
+    Delete checkouts untouched for ``max_age`` (a timedelta) in batches of ``batch_size``.
+
+    A generator yielding ``(checkouts, lines, seconds)`` after every batch.
+    """
+    if max_age is None:
+        max_age = timedelta(hours=_setting("CHECKOUT_REAPER_AGE_HOURS", 72))
+    batch_size = batch_size or _setting("CHECKOUT_REAPER_BATCH", 500)
+    cutoff = timezone.now() - max_age
+    last_id = 0
+    while True:
+        started = time.perf_counter()
+        with transaction.atomic():
+            ids = list(
+                abandoned_checkouts(cutoff)
+                .filter(id__gt=last_id)
+                .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                return
+            # Conditions are checked again, in case a checkout was edited or paid for since it was picked
+            _, deleted = abandoned_checkouts(cutoff).filter(id__in=ids).delete()
+        checkouts = deleted.get(Checkout._meta.label, 0)
+        lines = deleted.get(CheckoutLine._meta.label, 0)
+        # Walk forward by id, so skipped rows are not picked again
+        last_id = ids[-1]
+        yield checkouts, lines, time.perf_counter() - started
+
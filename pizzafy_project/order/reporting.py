@@ -0,0 +1,234 @@
+"""
+Sales summaries.
+
+DailySales and HourlySales hold revenue, order count, units and
+cancellations per local day/hour, one row per (pizza, size) plus a totals
+row with no pizza. Reports read these instead of aggregating the order tables.
+
+The rows are kept current incrementally, inside the transaction that
+changes the order: ``record_order`` when a checkout becomes an order and
+``record_cancellation`` when one is cancelled. Each is one insert of any
+missing rows plus one conditional UPDATE per table, however many lines the
+order has; batches of orders share those statements (``record_orders``). ``rebuild`` recomputes a date range from the order history; the
+backfill_sales_summaries command runs its read side (``summarise``) in
+several processes and its write side (``replace_summaries``) in one.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import TruncDate, TruncHour
+from django.utils import timezone
+
+from .models import ArchivedOrder, ArchivedOrderLine, DailySales, HourlySales, Order, OrderLine
+
+GRANULARITIES = {"daily": DailySales, "hourly": HourlySales}
+
+# The bucket total row's key
+TOTAL = (None, "")
+
+# Summary rows shifted per UPDATE statement
+SALES_UPDATE_BATCH = 200
+
+# Where order history lives: live orders, then archived ones (see order.archive)
+HISTORY_TIERS = ((Order, OrderLine), (ArchivedOrder, ArchivedOrderLine))
+
+
+def bucket_for(model, moment):
+    local = timezone.localtime(moment)
+    if model is DailySales:
+        return local.date()
+    return local.replace(minute=0, second=0, microsecond=0)
+
+
+def order_deltas(order, lines, sign=1, cancelled=0):
+    """
+    Per-key changes ({(pizza_id, size): [orders, units, revenue, cancelled]}) one order makes to its bucket.
+    """
+    deltas = defaultdict(lambda: [0, 0, Decimal(0), 0])
+    for line in lines:
+        delta = deltas[(line.pizza_id, line.size)]
+        delta[1] += sign * line.quantity
+        delta[2] += sign * line.price * line.quantity
+    for key, delta in deltas.items():
+        # An order counts once per pizza and size, however many lines it spreads them over
+        delta[0], delta[3] = sign, cancelled
+    deltas[TOTAL] = [
+        sign,
+        sum(delta[1] for delta in deltas.values()),
+        sign * order.total_price,
+        cancelled,
+    ]
+    return deltas
+
+
+def _key_filter(key):
+    bucket, pizza_id, size = key
+    if pizza_id is None:
+        return Q(bucket=bucket, pizza__isnull=True)
+    return Q(bucket=bucket, pizza_id=pizza_id, size=size)
+
+
+def _per_key(deltas, index, output_field):
+    return Case(
+        *[When(_key_filter(key), then=Value(delta[index])) for key, delta in deltas.items()],
+        default=Value(0),
+        output_field=output_field,
+    )
+
+
+def apply_deltas(model, deltas):
+    """
+    Add ``deltas`` ({(bucket, pizza_id, size): [orders, units, revenue, cancelled]}) to ``model``'s rows.
+
+    Missing rows are created first, then every row is shifted by a conditional
+    UPDATE, one per ``SALES_UPDATE_BATCH`` keys to stay under query parameter limits.
+    """
+    model.objects.bulk_create(
+        [model(bucket=bucket, pizza_id=pizza_id, size=size) for bucket, pizza_id, size in deltas],
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+    revenue_field = DecimalField(max_digits=12, decimal_places=2)
+    keys = list(deltas)
+    for start in range(0, len(keys), SALES_UPDATE_BATCH):
+        batch = {key: deltas[key] for key in keys[start : start + SALES_UPDATE_BATCH]}
+        model.objects.filter(reduce(or_, map(_key_filter, batch))).update(
+            orders=F("orders") + _per_key(batch, 0, IntegerField()),
+            units=F("units") + _per_key(batch, 1, IntegerField()),
+            revenue=F("revenue") + _per_key(batch, 2, revenue_field),
+            cancelled=F("cancelled") + _per_key(batch, 3, IntegerField()),
+        )
+
+
+def record_orders(orders, sign=1, cancelled=0):
+    """
+    Apply many ``(order, lines)`` pairs to both tables at once, merging orders that share a bucket.
+    """
+    orders = [(order, order_deltas(order, lines, sign, cancelled)) for order, lines in orders]
+    for model in GRANULARITIES.values():
+        merged = defaultdict(lambda: [0, 0, Decimal(0), 0])
+        for order, deltas in orders:
+            bucket = bucket_for(model, order.created_at)
+            for (pizza_id, size), delta in deltas.items():
+                total = merged[(bucket, pizza_id, size)]
+                merged[(bucket, pizza_id, size)] = [value + change for value, change in zip(total, delta)]
+        if merged:
+            apply_deltas(model, merged)
+
+
+def record_order(order, lines):
+    """
+    Add a new order to the summaries. Call inside the transaction that creates it.
+    """
+    record_orders([(order, lines)])
+
+
+def record_cancellation(order, lines):
+    """
+    Move a cancelled order out of the sales figures and into the cancellation count.
+    """
+    record_cancellations([(order, lines)])
+
+
+def record_cancellations(orders):
+    """
+    record_cancellation for many ``(order, lines)`` pairs at once.
+    """
+    record_orders(orders, sign=-1, cancelled=1)
+
+
+def local_day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _add(figures, row):
+    for name in figures:
+        figures[name] += row[name] or 0
+
+
+def summarise(granularity, start, end):
+    """
+    Aggregate the order history, live and archived, for local dates ``start`` up to, not including, ``end``.
+
+    Read-only, so chunks can be summarised in parallel. Returns plain dicts,
+    one per summary row, for ``replace_summaries``.
+    """
+    model = GRANULARITIES[granularity]
+    start_at, end_at = local_day_start(start), local_day_start(end)
+    trunc = TruncDate if model is DailySales else TruncHour
+    tzinfo = timezone.get_current_timezone()
+    kept, cancel = ~Q(status="Cancel"), Q(status="Cancel")
+    line_kept, line_cancel = ~Q(order__status="Cancel"), Q(order__status="Cancel")
+
+    # An order lives in exactly one tier, so each tier's figures simply add up
+    summaries = defaultdict(lambda: {"orders": 0, "units": 0, "revenue": 0, "cancelled": 0})
+    for order_model, line_model in HISTORY_TIERS:
+        orders = (
+            order_model.objects.filter(created_at__gte=start_at, created_at__lt=end_at)
+            .annotate(bucket=trunc("created_at", tzinfo=tzinfo))
+            .values("bucket")
+            .annotate(
+                orders=Count("id", filter=kept),
+                revenue=Sum("total_price", filter=kept),
+                cancelled=Count("id", filter=cancel),
+            )
+        )
+        lines = (
+            line_model.objects.filter(order__created_at__gte=start_at, order__created_at__lt=end_at)
+            .annotate(bucket=trunc("order__created_at", tzinfo=tzinfo))
+        )
+        per_pizza = lines.values("bucket", "pizza", "size").annotate(
+            orders=Count("order", distinct=True, filter=line_kept),
+            units=Sum("quantity", filter=line_kept),
+            revenue=Sum(F("price") * F("quantity"), filter=line_kept, output_field=DecimalField()),
+            cancelled=Count("order", distinct=True, filter=line_cancel),
+        )
+        units = dict(
+            lines.values("bucket").annotate(units=Sum("quantity", filter=line_kept)).values_list("bucket", "units")
+        )
+
+        for row in per_pizza:
+            _add(summaries[(row["bucket"], row["pizza"], row["size"])], row)
+        for row in orders:
+            _add(summaries[(row["bucket"], *TOTAL)], dict(row, units=units.get(row["bucket"])))
+
+    return [
+        {"bucket": bucket, "pizza_id": pizza_id, "size": size, **figures}
+        for (bucket, pizza_id, size), figures in summaries.items()
+    ]
+
+
+def replace_summaries(granularity, start, end, rows):
+    """
+    Swap the summaries for local dates [start, end) for ``rows`` in one transaction.
+    """
+    model = GRANULARITIES[granularity]
+    bounds = (start, end) if model is DailySales else (local_day_start(start), local_day_start(end))
+    with transaction.atomic():
+        model.objects.filter(bucket__gte=bounds[0], bucket__lt=bounds[1]).delete()
+        model.objects.bulk_create([model(**row) for row in rows], batch_size=1000)
+    return len(rows)
+
+
+def rebuild(granularity, start, end):
+    """
+    Recompute the summaries for local dates [start, end) from the order history.
+
+    Returns the number of summary rows written.
+    """
+    return replace_summaries(granularity, start, end, summarise(granularity, start, end))
+
+
+def date_chunks(start, end, days):
+    """
+    Split local dates [start, end) into consecutive ranges of at most ``days`` days.
+    """
+    while start < end:
+        chunk_end = min(start + timedelta(days=days), end)
+        yield start, chunk_end
+        start = chunk_end
@@ -1,17 +1,62 @@
 from rest_framework import serializers
-from .models import Order, OrderLine, Checkout, CheckoutLine
+from core.rows import RowSerializer
+from core.serializers import TimedSerializerMixin
+from .models import Order, OrderLine, Checkout, CheckoutLine, DailySales, HourlySales
 
 class CheckoutLineSerializer(serializers.ModelSerializer):
     class Meta:
         model = CheckoutLine
         fields = ['id', 'pizza', 'quantity', 'price', 'size', 'customizations']
 
-class CheckoutSerializer(serializers.ModelSerializer):
-    checkout_lines = CheckoutLineSerializer(many=True)  # Nested serializer for checkout lines
+class CheckoutLineEditSerializer(serializers.Serializer):
+    """
+    One entry of an update-checkout payload; prices are always set server-side
+    """
+
+    checkout_line_id = serializers.IntegerField(required=False, allow_null=True)  # None or missing adds a line
+    action = serializers.ChoiceField(["add", "update", "remove"], default="update")
+    pizza_id = serializers.IntegerField(required=False)
+    quantity = serializers.IntegerField(required=False, min_value=1)
+    size = serializers.CharField(required=False, allow_blank=True)
+    customizations = serializers.CharField(required=False, allow_blank=True, default="")
+
+    def validate(self, data):
+        # An add, or an update without a line id, creates a line, which needs everything a line has
+        if data["action"] == "add" or (data["action"] == "update" and not data.get("checkout_line_id")):
+            missing = {
+                field: "This field is required when adding a line."
+                for field in ("pizza_id", "quantity", "size")
+                if not data.get(field)
+            }
+            if missing:
+                raise serializers.ValidationError(missing)
+        return data
+
+class CheckoutLineCreateSerializer(serializers.Serializer):
+    """
+    One line of a create-checkout payload; prices are always set server-side
+    """
+
+    pizza_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+    size = serializers.ChoiceField(CheckoutLine._meta.get_field("size").choices)
+    customizations = serializers.CharField(required=False, allow_blank=True, default="")
+
+class CheckoutSummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """
+    A checkout without its lines, for views that already hold them
+    """
 
     class Meta:
         model = Checkout
-        fields = ['id', 'user', 'shipping_address', 'billing_address', 'total_price', 'checkout_lines']
+        fields = ['id', 'user', 'shipping_address', 'billing_address', 'total_price']
+
+
+class CheckoutSerializer(CheckoutSummarySerializer):
+    checkout_lines = CheckoutLineSerializer(many=True)  # Nested serializer for checkout lines
+
+    class Meta(CheckoutSummarySerializer.Meta):
+        fields = CheckoutSummarySerializer.Meta.fields + ['checkout_lines']
         
         
 class OrderLineSerializer(serializers.ModelSerializer):
@@ -22,11 +67,28 @@ class OrderLineSerializer(serializers.ModelSerializer):
         fields = ['id', 'pizza', 'pizza_name', 'quantity']
         
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     order_lines = OrderLineSerializer(many=True, read_only=True)
     user = serializers.StringRelatedField(read_only=True)
     delivery_partner = serializers.StringRelatedField(read_only=True)
 
     class Meta:
         model = Order
-        fields = ['id', 'user', 'status', 'created_at', 'delivery_partner', 'order_lines']
\ No newline at end of file
+        fields = ['id', 'user', 'status', 'created_at', 'delivery_partner', 'order_lines']
+
+
+# Read-only fast paths with the same output as the serializers above (see core/rows.py)
+checkout_rows = RowSerializer(CheckoutSerializer)
+order_rows = RowSerializer(
+    OrderSerializer, paths={'user': 'user__username', 'delivery_partner': 'delivery_partner__username'}
+)
+
+class DailySalesSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta:
+        model = DailySales
+        fields = ['bucket', 'pizza', 'size', 'orders', 'units', 'revenue', 'cancelled']
+
+
+class HourlySalesSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    class Meta(DailySalesSerializer.Meta):
+        model = HourlySales
@@ -1,3 +1,1340 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.loadtest import HTTPResult
+from core.models import User as CustomUser
+from core.renderers import FastJSONRenderer
+from core.rows import RowSerializer
+from core.serializers import RoleTokenObtainPairSerializer
+from pizza.models import Pizza
+from payment.gateway import record_result
+from payment.models import Payment, Transaction
+from .management.commands.benchmark_checkout_flow import Command as BenchmarkCheckoutFlow, FlowError
+from .dispatch import LeastLoadedDispatcher, RoundRobinDispatcher
+from .events import InProcessBroker, OrderEventStream, get_broker
+from .archive import archive_orders
+from .models import (
+    ArchivedOrder, ArchivedOrderLine, Checkout, CheckoutLine, DailySales, HourlySales, Order, OrderLine, Review,
+)
+from .reaper import reap_abandoned_checkouts
+from .serializers import OrderSerializer, order_rows
+from .views import AsyncCheckoutView, AsyncCustomerOrderHistoryView, CheckoutView, CustomerOrderHistoryView
+
+
+class CreateCheckoutViewTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="customer@example.com", username="customer", password="secret"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.pizzas = [
+            Pizza.objects.create(name=f"Pizza {i}", description="", price=10, stock=100)
+            for i in range(5)
+        ]
+
+    def _payload(self, line_count):
+        return {
+            "shipping_address": "1 Main St",
+            "billing_address": "1 Main St",
+            "checkout_lines": [
+                {
+                    "pizza_id": self.pizzas[i % len(self.pizzas)].id,
+                    "price": 10,
+                    "quantity": 2,
+                    "size": "Medium",
+                }
+                for i in range(line_count)
+            ],
+        }
+
+    def _count_queries(self, line_count):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse("create-checkout"), self._payload(line_count), format="json")
+        self.assertEqual(response.status_code, 201)
+        return len(ctx.captured_queries)
+
+    def test_creates_lines_and_total(self):
+        response = self.client.post(reverse("create-checkout"), self._payload(3), format="json")
+
+        self.assertEqual(response.status_code, 201)
+        checkout = Checkout.objects.get(id=response.data["checkout_data"]["id"])
+        self.assertEqual(checkout.total_price, 60)
+        self.assertEqual(checkout.checkout_lines.count(), 3)
+        self.assertEqual(len(response.data["checkout_data"]["checkout_lines"]), 3)
+
+    def test_query_count_does_not_grow_with_line_count(self):
+        self.assertEqual(self._count_queries(1), self._count_queries(30))
+
+    def test_unknown_pizza_leaves_nothing_behind(self):
+        payload = self._payload(3)
+        payload["checkout_lines"][1]["pizza_id"] = 999999
+        payload["checkout_lines"][2]["pizza_id"] = "1000000"
+
+        response = self.client.post(reverse("create-checkout"), payload, format="json")
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data["pizza_ids"], [999999, 1000000])
+        self.assertFalse(Checkout.objects.exists())
+        self.assertFalse(CheckoutLine.objects.exists())
+
+    def test_malformed_lines_are_a_bad_request(self):
+        for field, value in [("quantity", -3), ("quantity", 0), ("quantity", "two"), ("pizza_id", "abc"), ("size", "Huge")]:
+            payload = self._payload(2)
+            payload["checkout_lines"][1][field] = value
+
+            response = self.client.post(reverse("create-checkout"), payload, format="json")
+
+            self.assertEqual(response.status_code, 400, (field, value))
+            self.assertIn(field, response.data[1])
+        self.assertFalse(Checkout.objects.exists())
+
+
+class UpdateCheckoutViewTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="customer@example.com", username="customer", password="secret"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=100)
+        # Stale on purpose: the view must recompute it from the lines
+        self.checkout = Checkout.objects.create(
+            user=self.user, total_price=999, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        CheckoutLine.objects.bulk_create(
+            CheckoutLine(checkout=self.checkout, pizza=self.pizza, quantity=1, price=10, size="Small")
+            for _ in range(40)
+        )
+        self.line_ids = list(self.checkout.checkout_lines.order_by("id").values_list("id", flat=True))
+
+    def _edits(self, count):
+        # A third each of updates, removals and additions
+        edits = []
+        for i in range(count):
+            if i % 3 == 0:
+                edits.append({"checkout_line_id": self.line_ids[i], "action": "update", "quantity": 3})
+            elif i % 3 == 1:
+                edits.append({"checkout_line_id": self.line_ids[i], "action": "remove"})
+            else:
+                edits.append({"action": "add", "pizza_id": self.pizza.id, "price": 12.5, "quantity": 2, "size": "Large"})
+        return edits
+
+    def _post(self, edits, **data):
+        return self.client.post(
+            reverse("update-checkout", args=[self.checkout.id]), {"checkout_lines": edits, **data}, format="json"
+        )
+
+    def test_applies_edits_and_recomputes_total(self):
+        response = self._post(self._edits(6), shipping_address="2 Side St")
+
+        self.assertEqual(response.status_code, 200)
+        self.checkout.refresh_from_db()
+        lines = list(self.checkout.checkout_lines.order_by("id"))
+        self.assertEqual(len(lines), 40 - 2 + 2)
+        self.assertEqual(self.checkout.total_price, sum(line.price * line.quantity for line in lines))
+        self.assertEqual(self.checkout.shipping_address, "2 Side St")
+        self.assertEqual(CheckoutLine.objects.get(id=self.line_ids[0]).quantity, 3)
+        self.assertFalse(CheckoutLine.objects.filter(id=self.line_ids[1]).exists())
+        self.assertEqual(
+            [line["id"] for line in response.data["checkout_data"]["checkout_lines"]], [line.id for line in lines]
+        )
+        self.assertEqual(response.data["checkout_data"]["total_price"], f"{self.checkout.total_price:.2f}")
+
+    def test_query_count_does_not_grow_with_edit_count(self):
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self._post(self._edits(3)).status_code, 200)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self._post(self._edits(30)[3:]).status_code, 200)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+    def test_malformed_line_id_is_a_bad_request(self):
+        edits = self._edits(3) + [{"checkout_line_id": "abc", "action": "update", "quantity": 5}]
+
+        response = self._post(edits)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("checkout_line_id", response.data[3])
+        self.assertEqual(CheckoutLine.objects.filter(checkout=self.checkout).count(), 40)
+
+    def test_quantities_must_be_positive_and_given_for_new_lines(self):
+        for edit in [
+            {"checkout_line_id": self.line_ids[0], "action": "update", "quantity": 0},
+            {"checkout_line_id": self.line_ids[0], "action": "update", "quantity": None},
+            {"action": "add", "pizza_id": self.pizza.id, "size": "Large"},
+        ]:
+            response = self._post([edit])
+
+            self.assertEqual(response.status_code, 400, edit)
+            self.assertIn("quantity", response.data[0])
+        self.assertEqual(CheckoutLine.objects.get(id=self.line_ids[0]).quantity, 1)
+        self.assertEqual(CheckoutLine.objects.filter(checkout=self.checkout).count(), 40)
+
+    def test_unknown_line_changes_nothing(self):
+        edits = self._edits(3) + [{"checkout_line_id": 999999, "action": "update", "quantity": 5}]
+
+        response = self._post(edits)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(CheckoutLine.objects.filter(checkout=self.checkout).count(), 40)
+        self.assertEqual(CheckoutLine.objects.get(id=self.line_ids[0]).quantity, 1)
+
+
+class CompleteCheckoutViewTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="customer@example.com", username="customer", password="secret"
+        )
+        self.partner = CustomUser.objects.create_user(
+            email="partner@example.com", username="partner", password="secret", role="DeliveryPartner"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.pizzas = [
+            Pizza.objects.create(name=f"Pizza {i}", description="", price=10, stock=100)
+            for i in range(5)
+        ]
+
+    def _checkout(self, line_count):
+        checkout = Checkout.objects.create(
+            user=self.user, total_price=10 * line_count, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        CheckoutLine.objects.bulk_create(
+            CheckoutLine(checkout=checkout, pizza=self.pizzas[i % len(self.pizzas)], quantity=1, price=10, size="Small")
+            for i in range(line_count)
+        )
+        Payment.objects.create(checkout=checkout, payment_method="COD", amount=checkout.total_price, status="Completed")
+        return checkout
+
+    def _count_queries(self, line_count):
+        checkout = self._checkout(line_count)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_converts_checkout_into_order(self):
+        checkout = self._checkout(3)
+
+        response = self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(id=response.data["order_data"]["id"])
+        self.assertEqual(order.delivery_partner, self.partner)
+        self.assertEqual(order.total_price, 30)
+        self.assertEqual(OrderLine.objects.filter(order=order).count(), 3)
+        self.assertEqual(Payment.objects.get().order, order)
+        self.assertEqual(order.payment_status, "Paid")
+        self.assertFalse(Checkout.objects.exists())
+        self.assertFalse(CheckoutLine.objects.exists())
+        self.assertEqual(len(response.data["order_data"]["order_lines"]), 3)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        self.assertEqual(self._count_queries(1), self._count_queries(30))
+
+    def test_unpaid_checkout_is_refused(self):
+        checkout = self._checkout(2)
+        Payment.objects.filter(checkout=checkout).update(payment_method="Online", status="Pending")
+
+        response = self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+
+        self.assertEqual((response.status_code, response.data["payment_status"]), (402, "Pending"))
+        Payment.objects.filter(checkout=checkout).delete()
+        response = self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+        self.assertEqual((response.status_code, response.data["payment_status"]), (402, None))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Pizza.objects.get(id=self.pizzas[0].id).stock, 100)
+
+    def test_failed_payment_can_be_retried(self):
+        checkout = self._checkout(2)
+        Payment.objects.filter(checkout=checkout).delete()
+        with self.captureOnCommitCallbacks():
+            self.client.post(reverse("create-payment"), {"checkout_id": checkout.id, "payment_method": "Online"}, format="json")
+        record_result(Transaction.objects.get(), False, "declined")
+        response = self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+        self.assertEqual((response.status_code, response.data["payment_status"]), (402, "Failed"))
+
+        with self.captureOnCommitCallbacks():
+            response = self.client.post(
+                reverse("create-payment"), {"checkout_id": checkout.id, "payment_method": "Online"}, format="json"
+            )
+        self.assertEqual((response.status_code, response.data["payment_status"]), (201, "Pending"))
+        record_result(Transaction.objects.get(transaction_status="Pending"), True, "approved")
+        response = self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+
+        self.assertEqual(response.status_code, 200)
+        payment = Payment.objects.get()
+        self.assertEqual((payment.status, payment.order_id), ("Completed", response.data["order_data"]["id"]))
+        self.assertEqual(
+            sorted(payment.transactions.values_list("transaction_status", flat=True)), ["Failed", "Success"]
+        )
+
+    def test_reserves_stock(self):
+        checkout = self._checkout(7)
+
+        self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+
+        self.assertEqual([pizza.stock for pizza in Pizza.objects.order_by("id")], [98, 98, 99, 99, 99])
+
+    def test_short_stock_fails_cleanly(self):
+        checkout = self._checkout(3)
+        Pizza.objects.filter(id=self.pizzas[1].id).update(stock=0)
+
+        response = self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data["pizza_ids"], [self.pizzas[1].id])
+        self.assertFalse(Order.objects.exists())
+        self.assertTrue(Checkout.objects.filter(id=checkout.id).exists())
+        self.assertEqual(Pizza.objects.get(id=self.pizzas[0].id).stock, 100)
+        self.assertEqual(CustomUser.objects.get(id=self.partner.id).active_orders, 0)
+
+    def test_cancel_releases_stock(self):
+        checkout = self._checkout(2)
+        response = self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+        order_id = response.data["order_data"]["id"]
+
+        response = self.client.patch(
+            reverse("update-order-status", args=[order_id]), {"status": "Cancel", "comment": "Changed my mind"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Pizza.objects.get(id=self.pizzas[0].id).stock, 100)
+        self.assertEqual(CustomUser.objects.get(id=self.partner.id).active_orders, 0)
+
+    def test_reopening_an_order_takes_capacity_back(self):
+        order_ids = [
+            self.client.post(reverse("complete-checkout"), {"checkout_id": self._checkout(1).id}, format="json")
+            .data["order_data"]["id"]
+            for _ in range(2)
+        ]
+        admin = CustomUser.objects.create_user(email="admin@example.com", username="admin", password="!", role="Admin")
+        self.client.force_authenticate(user=admin)
+        loads = []
+
+        for new_status in ("Fulfilled", "Unfulfilled", "Fulfilled", "Fulfilled"):
+            self.client.patch(
+                reverse("update-order-status", args=[order_ids[0]]), {"status": new_status, "comment": "x"}, format="json"
+            )
+            loads.append(CustomUser.objects.get(id=self.partner.id).active_orders)
+        for new_status in ("Fulfilled", "Unfulfilled", "Fulfilled"):
+            self.client.post(
+                reverse("bulk-update-order-status"), {"order_ids": order_ids, "status": new_status, "comment": "x"},
+                format="json",
+            )
+            loads.append(CustomUser.objects.get(id=self.partner.id).active_orders)
+
+        self.assertEqual(loads, [1, 2, 1, 1, 0, 2, 0])
+
+
+class DispatcherTests(TestCase):
+    def setUp(self):
+        self.partners = [
+            CustomUser.objects.create(
+                email=f"partner{i}@example.com", username=f"partner{i}", password="!", role="DeliveryPartner"
+            )
+            for i in range(3)
+        ]
+
+    def test_round_robin_cycles_through_partners(self):
+        dispatcher = RoundRobinDispatcher(capacity=10)
+
+        assigned = [dispatcher.assign().id for _ in range(6)]
+
+        ids = [partner.id for partner in self.partners]
+        self.assertEqual(assigned, ids + ids)
+
+    def test_least_loaded_prefers_partner_with_fewest_orders(self):
+        CustomUser.objects.filter(id__in=[self.partners[0].id, self.partners[2].id]).update(active_orders=2)
+
+        self.assertEqual(LeastLoadedDispatcher(capacity=10).assign().id, self.partners[1].id)
+
+    def test_capacity_is_never_exceeded(self):
+        dispatcher = LeastLoadedDispatcher(capacity=2)
+
+        assigned = [dispatcher.assign() for _ in range(7)]
+
+        self.assertEqual(len([partner for partner in assigned if partner]), 6)
+        self.assertIsNone(assigned[-1])
+        self.assertEqual(
+            set(CustomUser.objects.filter(role="DeliveryPartner").values_list("active_orders", flat=True)), {2}
+        )
+
+    def test_stale_claim_is_rejected(self):
+        dispatcher = LeastLoadedDispatcher()
+        stale = CustomUser.objects.get(id=self.partners[0].id)
+        competitor = CustomUser.objects.get(id=self.partners[0].id)
+
+        self.assertTrue(dispatcher.claim(competitor))
+        self.assertFalse(dispatcher.claim(stale))
+        self.assertEqual(CustomUser.objects.get(id=self.partners[0].id).active_orders, 1)
+
+    def test_release_frees_capacity(self):
+        dispatcher = LeastLoadedDispatcher(capacity=1)
+        partner = dispatcher.assign()
+
+        dispatcher.release(partner.id)
+
+        self.assertEqual(CustomUser.objects.get(id=partner.id).active_orders, 0)
+
+
+class CustomerOrderHistoryViewTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.partner = CustomUser.objects.create(
+            email="partner@example.com", username="partner", password="!", role="DeliveryPartner"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=100)
+
+    def _orders(self, count, **fields):
+        orders = []
+        for _ in range(count):
+            order = Order.objects.create(
+                user=self.user, total_price=20, shipping_address="1 Main St", billing_address="1 Main St",
+                delivery_partner=self.partner, **fields
+            )
+            OrderLine.objects.bulk_create(
+                OrderLine(order=order, pizza=self.pizza, quantity=1, price=10, size="Small") for _ in range(2)
+            )
+            orders.append(order)
+        return orders
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("customer-order-history"), {"page_size": 50})
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_query_count_is_fixed_per_page(self):
+        self._orders(2)
+        small = self._count_queries()
+        self._orders(20)
+        self.assertEqual(small, self._count_queries())
+
+    def test_cursor_walks_every_order_newest_first(self):
+        orders = self._orders(5)
+
+        seen = []
+        url = reverse("customer-order-history") + "?page_size=2"
+        while url:
+            response = self.client.get(url)
+            seen.extend(order["id"] for order in response.data["results"])
+            url = response.data["next"]
+
+        self.assertEqual(seen, [order.id for order in reversed(orders)])
+
+    def test_filters_by_status_and_date(self):
+        self._orders(2)
+        cancelled = self._orders(1, status="Cancel")
+
+        response = self.client.get(reverse("customer-order-history"), {"status": "Cancel", "created_after": "2000-01-01"})
+        self.assertEqual([order["id"] for order in response.data["results"]], [cancelled[0].id])
+
+        response = self.client.get(reverse("customer-order-history"), {"created_before": "2000-01-01"})
+        self.assertEqual(response.data["results"], [])
+
+        response = self.client.get(reverse("customer-order-history"), {"created_before": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=100)
+        for _ in range(3):
+            order = Order.objects.create(
+                user=self.user, total_price=10, shipping_address="1 Main St", billing_address="1 Main St"
+            )
+            OrderLine.objects.create(order=order, pizza=self.pizza, quantity=1, price=10, size="Small")
+        self.checkout = Checkout.objects.create(
+            user=self.user, total_price=10, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        CheckoutLine.objects.create(checkout=self.checkout, pizza=self.pizza, quantity=1, price=10, size="Small")
+        access = RoleTokenObtainPairSerializer.get_token(self.user).access_token
+        self.factory = APIRequestFactory(HTTP_AUTHORIZATION=f"Bearer {access}")
+
+    def _responses(self, sync_view, async_view, path, **kwargs):
+        sync_response = sync_view.as_view()(self.factory.get(path), **kwargs)
+        sync_response.render()
+        async_response = async_to_sync(async_view.as_view())(self.factory.get(path), **kwargs)
+        return sync_response, async_response
+
+    def test_order_history_matches_sync_view(self):
+        sync_response, async_response = self._responses(
+            CustomerOrderHistoryView, AsyncCustomerOrderHistoryView, "/api/checkout/my-orders/?page_size=2"
+        )
+
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.content, sync_response.content)
+
+    def test_checkouts_match_sync_view(self):
+        for path, kwargs in (
+            ("/api/checkout/checkouts/", {}),
+            (f"/api/checkout/checkouts/{self.checkout.id}/", {"checkout_id": self.checkout.id}),
+            ("/api/checkout/checkouts/0/", {"checkout_id": 999999}),
+        ):
+            sync_response, async_response = self._responses(CheckoutView, AsyncCheckoutView, path, **kwargs)
+
+            self.assertEqual(async_response.status_code, sync_response.status_code)
+            self.assertEqual(async_response.content, sync_response.content)
+
+    def test_rejects_missing_credentials(self):
+        response = async_to_sync(AsyncCheckoutView.as_view())(APIRequestFactory().get("/api/checkout/checkouts/"))
+
+        self.assertEqual(response.status_code, 401)
+
+
+class RecordingBroker:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, user_ids, event):
+        self.published.append((sorted(user_ids), event["data"]))
+
+
+@override_settings(ORDER_EVENTS_BROKER="order.tests.RecordingBroker")
+class OrderEventPublishingTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.partner = CustomUser.objects.create(
+            email="partner@example.com", username="partner", password="!", role="DeliveryPartner"
+        )
+        self.client = APIClient()
+        self.pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=100)
+        self.broker = get_broker()
+        self.broker.published.clear()
+
+    def test_complete_checkout_publishes_new_order(self):
+        checkout = Checkout.objects.create(
+            user=self.user, total_price=10, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        CheckoutLine.objects.create(checkout=checkout, pizza=self.pizza, quantity=1, price=10, size="Small")
+        Payment.objects.create(checkout=checkout, payment_method="COD", amount=10, status="Completed")
+        self.client.force_authenticate(user=self.user)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+
+        order_id = response.data["order_data"]["id"]
+        self.assertEqual(
+            self.broker.published,
+            [
+                (
+                    sorted([self.user.id, self.partner.id]),
+                    {"order_id": order_id, "status": "Unfulfilled", "delivery_partner_id": self.partner.id},
+                )
+            ],
+        )
+
+    def test_status_change_publishes_after_commit(self):
+        order = Order.objects.create(
+            user=self.user, total_price=10, shipping_address="1 Main St", billing_address="1 Main St",
+            delivery_partner=self.partner,
+        )
+        self.client.force_authenticate(user=self.partner)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.client.patch(
+                reverse("update-order-status", args=[order.id]), {"status": "Fulfilled", "comment": "Delivered"},
+                format="json",
+            )
+        self.assertEqual(self.broker.published, [])
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.broker.published[0][1]["status"], "Fulfilled")
+
+
+class OrderEventStreamTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.access = str(RoleTokenObtainPairSerializer.get_token(self.user).access_token)
+
+    def test_broker_delivers_across_threads_to_subscribed_users_only(self):
+        broker = InProcessBroker()
+
+        async def receive():
+            subscription = broker.subscribe(self.user.id)
+            other = broker.subscribe(self.user.id + 1)
+            publisher = threading.Thread(target=broker.publish, args=([self.user.id], {"type": "order", "data": {}}))
+            publisher.start()
+            event = await asyncio.wait_for(subscription.get(), 5)
+            publisher.join()
+            subscription.close()
+            other.close()
+            return event, other.queue.empty()
+
+        event, other_empty = async_to_sync(receive)()
+
+        self.assertEqual(event, {"id": 1, "type": "order", "data": {}})
+        self.assertTrue(other_empty)
+        self.assertEqual(dict(broker._subscriptions), {})
+
+    def _scope(self, **headers):
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": "/api/checkout/events/",
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(name.encode(), value.encode()) for name, value in headers.items()],
+        }
+
+    def test_stream_relays_events_for_the_user(self):
+        broker = get_broker()
+
+        async def read_stream():
+            messages, incoming = asyncio.Queue(), asyncio.Queue()
+            app = OrderEventStream()
+            task = asyncio.ensure_future(
+                app(self._scope(authorization=f"Bearer {self.access}"), incoming.get, messages.put)
+            )
+            start = await asyncio.wait_for(messages.get(), 5)
+            chunks = [(await messages.get())["body"]]
+            broker.publish([self.user.id + 1], {"type": "order", "data": {"order_id": 1}})
+            broker.publish([self.user.id], {"type": "order", "data": {"order_id": 2}})
+            chunks.append((await asyncio.wait_for(messages.get(), 5))["body"])
+            await incoming.put({"type": "http.disconnect"})
+            await asyncio.wait_for(task, 5)
+            return start, chunks
+
+        start, chunks = async_to_sync(read_stream)()
+
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), start["headers"])
+        self.assertEqual(chunks[0], b"retry: 3000\n\n")
+        event_id, event_type, data, _, _ = chunks[1].decode().split("\n")
+        self.assertEqual(event_type, "event: order")
+        self.assertEqual(json.loads(data.removeprefix("data: ")), {"order_id": 2})
+        self.assertNotIn(self.user.id, broker._subscriptions)
+
+    def test_stream_rejects_missing_credentials(self):
+        async def request():
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            await OrderEventStream()(self._scope(), asyncio.Queue().get, send)
+            return messages
+
+        start, body = async_to_sync(request)()
+
+        self.assertEqual(start["status"], 401)
+        self.assertIn(b"www-authenticate", dict(start["headers"]))
+
+
+class SalesSummaryTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.admin = CustomUser.objects.create(email="admin@example.com", username="admin", password="!", role="Admin")
+        self.client = APIClient()
+        self.pizzas = [
+            Pizza.objects.create(name=f"Pizza {i}", description="", price=10, stock=100) for i in range(2)
+        ]
+
+    def _order(self, *lines):
+        checkout = Checkout.objects.create(
+            user=self.user, total_price=sum(quantity * 10 for _, _, quantity in lines),
+            shipping_address="1 Main St", billing_address="1 Main St",
+        )
+        CheckoutLine.objects.bulk_create(
+            CheckoutLine(checkout=checkout, pizza=pizza, size=size, quantity=quantity, price=10)
+            for pizza, size, quantity in lines
+        )
+        Payment.objects.create(checkout=checkout, payment_method="COD", amount=checkout.total_price, status="Completed")
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post(reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json")
+        self.assertEqual(response.status_code, 200)
+        return Order.objects.get(id=response.data["order_data"]["id"])
+
+    def _summaries(self):
+        fields = ("bucket", "pizza_id", "size", "orders", "units", "revenue", "cancelled")
+        return {
+            model.__name__: sorted(model.objects.values_list(*fields), key=str)
+            for model in (DailySales, HourlySales)
+        }
+
+    def test_orders_and_cancellations_update_summaries(self):
+        first, second = self.pizzas
+        self._order((first, "Small", 2), (first, "Small", 1), (second, "Large", 1))
+        cancelled = self._order((first, "Small", 4))
+
+        self.client.force_authenticate(user=self.user)
+        self.client.patch(
+            reverse("update-order-status", args=[cancelled.id]), {"status": "Cancel", "comment": "Changed my mind"},
+            format="json",
+        )
+
+        total = DailySales.objects.get(pizza=None)
+        self.assertEqual((total.orders, total.units, total.revenue, total.cancelled), (1, 4, 40, 1))
+        small = HourlySales.objects.get(pizza=first, size="Small")
+        self.assertEqual((small.orders, small.units, small.revenue, small.cancelled), (1, 3, 30, 1))
+
+    def test_order_query_count_does_not_grow_with_cart_size(self):
+        def count(line_count):
+            with CaptureQueriesContext(connection) as ctx:
+                self._order(*[(self.pizzas[i % 2], "Small", 1) for i in range(line_count)])
+            return len(ctx.captured_queries)
+
+        self.assertEqual(count(2), count(20))
+
+    def test_backfill_matches_incremental_summaries(self):
+        first, second = self.pizzas
+        self._order((first, "Small", 2), (second, "Large", 1))
+        cancelled = self._order((second, "Medium", 3))
+        self.client.patch(
+            reverse("update-order-status", args=[cancelled.id]), {"status": "Cancel", "comment": "Changed my mind"},
+            format="json",
+        )
+        incremental = self._summaries()
+
+        DailySales.objects.all().delete()
+        HourlySales.objects.all().delete()
+        call_command("backfill_sales_summaries", chunk_days=1, stdout=io.StringIO())
+
+        self.assertEqual(self._summaries(), incremental)
+
+    def test_backfill_includes_archived_orders(self):
+        first, second = self.pizzas
+        fulfilled = self._order((first, "Small", 2), (second, "Large", 1))
+        Order.objects.filter(id=fulfilled.id).update(status="Fulfilled")
+        self._order((second, "Medium", 3))
+        incremental = self._summaries()
+
+        list(archive_orders(timedelta(0)))
+        call_command("backfill_sales_summaries", chunk_days=1, stdout=io.StringIO())
+
+        self.assertTrue(ArchivedOrder.objects.filter(id=fulfilled.id).exists())
+        self.assertEqual(self._summaries(), incremental)
+
+    def test_backfill_finds_its_range_in_the_archive(self):
+        fulfilled = self._order((self.pizzas[0], "Small", 2))
+        Order.objects.filter(id=fulfilled.id).update(status="Fulfilled")
+        incremental = self._summaries()
+
+        list(archive_orders(timedelta(0)))
+        DailySales.objects.all().delete()
+        HourlySales.objects.all().delete()
+        call_command("backfill_sales_summaries", chunk_days=1, stdout=io.StringIO())
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(self._summaries(), incremental)
+
+    def test_report_is_admin_only(self):
+        self._order((self.pizzas[0], "Small", 2))
+
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get(reverse("sales-report")).status_code, 403)
+
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(reverse("sales-report"), {"granularity": "hourly", "breakdown": "pizza"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row["pizza"], row["size"], row["units"], row["revenue"]) for row in response.data["results"]],
+            [(self.pizzas[0].id, "Small", 2, "20.00")],
+        )
+
+
+class BulkUpdateOrderStatusViewTests(TestCase):
+    def setUp(self):
+        self.customer = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.partner = CustomUser.objects.create(
+            email="partner@example.com", username="partner", password="!", role="DeliveryPartner", active_orders=3
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.partner)
+        self.pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=0)
+
+    def _orders(self, count, **fields):
+        orders = Order.objects.bulk_create(
+            Order(
+                user=self.customer, total_price=20, shipping_address="1 Main St", billing_address="1 Main St",
+                delivery_partner=self.partner, **fields
+            )
+            for _ in range(count)
+        )
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, pizza=self.pizza, quantity=2, price=10, size="Small") for order in orders
+        )
+        return orders
+
+    def _post(self, order_ids, new_status="Fulfilled"):
+        return self.client.post(
+            reverse("bulk-update-order-status"),
+            {"order_ids": order_ids, "status": new_status, "comment": "End of shift"},
+            format="json",
+        )
+
+    def test_reports_result_per_order(self):
+        open_order, cancelled = self._orders(1)[0], self._orders(1, status="Cancel")[0]
+
+        response = self._post([open_order.id, cancelled.id, 999999, open_order.id])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["updated"], 1)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {"order_id": open_order.id, "result": "updated"},
+                {"order_id": cancelled.id, "result": "already_cancelled"},
+                {"order_id": 999999, "result": "not_found"},
+            ],
+        )
+        notes = dict(Order.objects.values_list("id", "status_note"))
+        self.assertEqual(Order.objects.get(id=open_order.id).status, "Fulfilled")
+        self.assertEqual(Order.objects.get(id=cancelled.id).status, "Cancel")
+        self.assertEqual((notes[open_order.id], notes[cancelled.id]), ("End of shift", ""))
+        self.assertEqual(CustomUser.objects.get(id=self.partner.id).active_orders, 2)
+
+    def test_query_count_does_not_grow_with_order_count(self):
+        few, many = self._orders(3), self._orders(1000)
+
+        with CaptureQueriesContext(connection) as small:
+            self._post([order.id for order in few])
+        with CaptureQueriesContext(connection) as large:
+            response = self._post([order.id for order in many])
+
+        self.assertEqual(response.data["updated"], 1000)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(CustomUser.objects.get(id=self.partner.id).active_orders, 0)
+
+    def test_cancel_releases_stock_in_one_pass(self):
+        orders = self._orders(5)
+        self.client.force_authenticate(user=self.customer)
+
+        response = self._post([order.id for order in orders], "Cancel")
+
+        self.assertEqual(response.data["updated"], 5)
+        self.assertEqual(Pizza.objects.get(id=self.pizza.id).stock, 10)
+        self.assertEqual(DailySales.objects.get(pizza=None).cancelled, 5)
+
+    def test_applies_role_rules(self):
+        order = self._orders(1)[0]
+        self.client.force_authenticate(user=self.customer)
+
+        response = self._post([order.id])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {"error": "Customers can only cancel orders"})
+        self.assertEqual(Order.objects.get(id=order.id).status, "Unfulfilled")
+
+    @override_settings(ORDER_STATUS_BULK_LIMIT=3)
+    def test_order_ids_must_be_a_short_list_of_ids(self):
+        order = self._orders(1)[0]
+
+        for order_ids in [str(order.id), {str(order.id): 1}, [], [order.id, "abc"], [order.id] * 4, None]:
+            response = self._post(order_ids)
+
+            self.assertEqual(response.status_code, 400, order_ids)
+            self.assertIn("order_ids", response.data)
+        self.assertEqual(Order.objects.get(id=order.id).status, "Unfulfilled")
+
+
+class IdempotentCompleteCheckoutTests(TransactionTestCase):
+    # Each thread uses its own connection, so the data must be committed
+    def test_concurrent_duplicates_wait_for_the_first(self):
+        user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=10)
+        checkout = Checkout.objects.create(
+            user=user, total_price=10, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        CheckoutLine.objects.create(checkout=checkout, pizza=pizza, quantity=1, price=10, size="Small")
+        Payment.objects.create(checkout=checkout, payment_method="COD", amount=10, status="Completed")
+
+        responses = []
+        barrier = threading.Barrier(4)
+
+        def complete():
+            client = APIClient()
+            client.force_authenticate(user=user)
+            barrier.wait()
+            try:
+                responses.append(
+                    client.post(
+                        reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json",
+                        HTTP_IDEMPOTENCY_KEY="complete-1",
+                    )
+                )
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=complete) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([response.status_code for response in responses], [200] * 4)
+        self.assertEqual(len({json.loads(response.content)["order_data"]["id"] for response in responses}), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Pizza.objects.get(id=pizza.id).stock, 9)
+
+    def test_retryable_answers_are_not_replayed(self):
+        user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=10)
+        checkout = Checkout.objects.create(
+            user=user, total_price=10, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        CheckoutLine.objects.create(checkout=checkout, pizza=pizza, quantity=1, price=10, size="Small")
+        payment = Payment.objects.create(checkout=checkout, payment_method="Online", amount=10, status="Pending")
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        def complete():
+            return client.post(
+                reverse("complete-checkout"), {"checkout_id": checkout.id}, format="json",
+                HTTP_IDEMPOTENCY_KEY="complete-1",
+            )
+
+        self.assertEqual(complete().status_code, 402)
+        Payment.objects.filter(id=payment.id).update(status="Completed")
+        Pizza.objects.filter(id=pizza.id).update(stock=0)
+        self.assertEqual(complete().status_code, 409)
+        Pizza.objects.filter(id=pizza.id).update(stock=10)
+        response = complete()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", response)
+        self.assertEqual(complete()["Idempotent-Replayed"], "true")
+
+
+class CheckoutReaperTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=10)
+
+    def _checkout(self, age_hours):
+        checkout = Checkout.objects.create(
+            user=self.user, total_price=10, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        CheckoutLine.objects.create(checkout=checkout, pizza=self.pizza, quantity=1, price=10, size="Small")
+        # auto_now would overwrite updated_at on save, so age the row with an update
+        Checkout.objects.filter(id=checkout.id).update(updated_at=timezone.now() - timedelta(hours=age_hours))
+        return checkout
+
+    def test_deletes_stale_checkouts_in_batches(self):
+        stale = [self._checkout(100) for _ in range(5)]
+        fresh = self._checkout(1)
+
+        batches = list(reap_abandoned_checkouts(timedelta(hours=72), batch_size=2))
+
+        self.assertEqual([(checkouts, lines) for checkouts, lines, _ in batches], [(2, 2), (2, 2), (1, 1)])
+        self.assertEqual(list(Checkout.objects.values_list("id", flat=True)), [fresh.id])
+        self.assertFalse(CheckoutLine.objects.filter(checkout__in=stale).exists())
+
+    def test_keeps_checkouts_with_a_payment(self):
+        paid = self._checkout(100)
+        Payment.objects.create(checkout=paid, payment_method="Online", amount=10)
+        failed = self._checkout(100)
+        Payment.objects.create(checkout=failed, payment_method="Online", amount=10, status="Failed")
+
+        list(reap_abandoned_checkouts(timedelta(hours=72)))
+
+        self.assertEqual(list(Checkout.objects.values_list("id", flat=True)), [paid.id])
+        self.assertEqual(CheckoutLine.objects.filter(checkout=paid).count(), 1)
+
+    def test_command_reports_each_batch(self):
+        for _ in range(3):
+            self._checkout(100)
+        out = io.StringIO()
+
+        call_command("reap_abandoned_checkouts", max_age_hours=72, batch_size=2, stdout=out)
+
+        self.assertIn("Batch 1: 2 checkouts, 2 lines", out.getvalue())
+        self.assertIn("Batch 2: 1 checkouts, 1 lines", out.getvalue())
+        self.assertIn("Reaped 3 checkouts and 3 lines", out.getvalue())
+        self.assertFalse(Checkout.objects.exists())
+
+
+class OrderArchiveTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+        self.pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=10)
+
+    def _order(self, status, age_days):
+        order = Order.objects.create(
+            user=self.user, status=status, total_price=20, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, pizza=self.pizza, quantity=1, price=10, size="Small") for _ in range(2)
+        )
+        # auto_now_add ignores a value passed on create, so age the row with an update
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=age_days))
+        return order
+
+    def test_moves_old_finished_orders_with_their_lines(self):
+        old = [self._order("Fulfilled", 100), self._order("Cancel", 100), self._order("Fulfilled", 100)]
+        open_order = self._order("Unfulfilled", 100)
+        recent = self._order("Fulfilled", 1)
+
+        batches = list(archive_orders(timedelta(days=90), batch_size=2))
+
+        self.assertEqual([(orders, lines) for orders, lines, _ in batches], [(2, 4), (1, 2)])
+        self.assertEqual(set(Order.objects.values_list("id", flat=True)), {open_order.id, recent.id})
+        self.assertEqual(set(ArchivedOrder.objects.values_list("id", flat=True)), {order.id for order in old})
+        self.assertEqual(ArchivedOrderLine.objects.filter(order_id=old[1].id).count(), 2)
+        self.assertEqual(ArchivedOrder.objects.get(id=old[1].id).status, "Cancel")
+
+    def test_payment_and_review_links_still_resolve(self):
+        order = self._order("Fulfilled", 100)
+        payment = Payment.objects.create(order=order, payment_method="COD", amount=20, status="Completed")
+        review = Review.objects.create(order=order, rating=5, comment="Hot and on time")
+
+        list(archive_orders(timedelta(days=90)))
+
+        payment.refresh_from_db()
+        review.refresh_from_db()
+        self.assertEqual((payment.order, payment.placed_order.id), (None, order.id))
+        self.assertEqual((review.order, review.placed_order.id), (None, order.id))
+        self.assertIsInstance(payment.placed_order, ArchivedOrder)
+
+    def test_history_serves_live_orders_then_archived_ones(self):
+        archived = [self._order("Fulfilled", 100 + days) for days in range(3)]
+        live = [self._order("Unfulfilled", 200), self._order("Fulfilled", 1)]
+        list(archive_orders(timedelta(days=90)))
+
+        pages = []
+        url = reverse("customer-order-history") + "?page_size=2"
+        while url:
+            response = self.client.get(url)
+            pages.append([order["id"] for order in response.data["results"]])
+            url = response.data["next"]
+
+        # Newest first within each tier, live tier before the archive
+        self.assertEqual(pages, [[live[1].id, live[0].id], [archived[0].id, archived[1].id], [archived[2].id]])
+        self.assertEqual(len(response.data["results"][0]["order_lines"]), 2)
+
+        previous = self.client.get(response.data["previous"])
+        self.assertEqual([order["id"] for order in previous.data["results"]], pages[1])
+        self.assertEqual(
+            [order["id"] for order in self.client.get(previous.data["previous"]).data["results"]], pages[0]
+        )
+
+    def test_command_reports_each_batch(self):
+        for _ in range(3):
+            self._order("Fulfilled", 100)
+        out = io.StringIO()
+
+        call_command("archive_orders", age_days=90, batch_size=2, stdout=out)
+
+        self.assertIn("Batch 1: 2 orders, 4 lines", out.getvalue())
+        self.assertIn("Archived 3 orders and 6 lines", out.getvalue())
+
+    def test_archived_order_can_be_reviewed(self):
+        partner = CustomUser.objects.create(
+            email="rider@example.com", username="rider", password="!", role="DeliveryPartner"
+        )
+        order = self._order("Fulfilled", 100)
+        Order.objects.filter(id=order.id).update(delivery_partner=partner)
+        list(archive_orders(timedelta(days=90)))
+
+        response = self.client.post(
+            reverse("create-review", args=[order.id]), {"rating": 5, "comment": "Still warm"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Review.objects.get().placed_order.id, order.id)
+        self.assertIsInstance(Review.objects.get().placed_order, ArchivedOrder)
+
+    def test_cancelling_an_archived_order_moves_it_back(self):
+        order = self._order("Fulfilled", 100)
+        payment = Payment.objects.create(order=order, payment_method="COD", amount=20, status="Completed")
+        placed_at = Order.objects.get(id=order.id).created_at
+        list(archive_orders(timedelta(days=90)))
+
+        response = self.client.patch(
+            reverse("update-order-status", args=[order.id]), {"status": "Cancel", "comment": "Never arrived"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        restored = Order.objects.get(id=order.id)
+        self.assertEqual((restored.status, restored.created_at), ("Cancel", placed_at))
+        self.assertEqual(restored.status_note, "Never arrived")
+        self.assertEqual(restored.order_lines.count(), 2)
+        self.assertFalse(ArchivedOrder.objects.filter(id=order.id).exists())
+        payment.refresh_from_db()
+        self.assertEqual((payment.order_id, payment.archived_order_id), (order.id, None))
+        self.assertEqual(Pizza.objects.get(id=self.pizza.id).stock, 12)
+
+    def test_bulk_update_reaches_archived_orders(self):
+        fulfilled, cancelled = self._order("Fulfilled", 100), self._order("Cancel", 100)
+        list(archive_orders(timedelta(days=90)))
+
+        response = self.client.post(
+            reverse("bulk-update-order-status"),
+            {"status": "Cancel", "comment": "Refunded", "order_ids": [fulfilled.id, cancelled.id, cancelled.id + 1]},
+            format="json",
+        )
+
+        self.assertEqual(
+            [result["result"] for result in response.data["results"]], ["updated", "already_cancelled", "not_found"]
+        )
+        self.assertEqual(Order.objects.get(id=fulfilled.id).status, "Cancel")
+        self.assertTrue(ArchivedOrder.objects.filter(id=cancelled.id).exists())
+
+
+class RowSerializerTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email="customer@example.com", username="Zoë \u2028 \"Z\"", password="!")
+        self.partner = CustomUser.objects.create(
+            email="partner@example.com", username="Rider 🛵", password="!", role="DeliveryPartner"
+        )
+        access = RoleTokenObtainPairSerializer.get_token(self.user).access_token
+        self.factory = APIRequestFactory(HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.pizzas = [
+            Pizza.objects.create(name="Margherita", description="", price=10, stock=100),
+            Pizza.objects.create(name="Pâneer Tikka \u2029", description="", price="12.50", stock=100),
+        ]
+        for age_days, status, partner in ((200, "Fulfilled", self.partner), (100, "Cancel", None), (1, "Unfulfilled", None)):
+            order = Order.objects.create(
+                user=self.user, status=status, total_price=20, shipping_address="1 Main St", billing_address="1 Main St",
+                delivery_partner=partner,
+            )
+            OrderLine.objects.bulk_create(
+                OrderLine(order=order, pizza=pizza, quantity=2, price=pizza.price, size="Small") for pizza in self.pizzas
+            )
+            Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=age_days))
+        list(archive_orders(timedelta(days=90)))
+        Order.objects.create(user=self.user, total_price=0, shipping_address="", billing_address="")  # No lines
+        for address in ("1 Main St", "Flat 2, Rue de l'Église"):
+            checkout = Checkout.objects.create(
+                user=self.user, total_price="31.25", shipping_address=address, billing_address=address
+            )
+            CheckoutLine.objects.create(
+                checkout=checkout, pizza=self.pizzas[1], quantity=2, price="12.50", size="Large",
+                customizations="Extra jalapeño \u2028 \"well done\"",
+            )
+        Checkout.objects.create(user=self.user, total_price=0, shipping_address="", billing_address="")
+
+    def _both(self, view, path, **kwargs):
+        # The same request through the row serializer and the ModelSerializer, both rendered as JSON
+        fast = view.as_view()(self.factory.get(path), **kwargs)
+        slow = view.as_view(row_serializer=None, renderer_classes=[JSONRenderer])(self.factory.get(path), **kwargs)
+        return fast.render(), slow.render()
+
+    def test_order_history_is_byte_identical(self):
+        for path in ("/api/checkout/my-orders/", "/api/checkout/my-orders/?page_size=2"):
+            fast, slow = self._both(CustomerOrderHistoryView, path)
+
+            self.assertEqual(fast.status_code, 200)
+            self.assertEqual(fast.content, slow.content)
+            results = json.loads(fast.content)["results"]
+            self.assertTrue(results)
+
+        fast, slow = self._both(CustomerOrderHistoryView, "/api/checkout/my-orders/?page_size=50")
+        self.assertEqual(fast.content, slow.content)
+        # Both tiers, the partner-less orders and the one without lines are all covered
+        self.assertEqual(len(json.loads(fast.content)["results"]), 4)
+        self.assertIn(b"\\u2028", fast.content)
+
+    def test_checkouts_are_byte_identical(self):
+        checkout = Checkout.objects.filter(user=self.user).first()
+        for path, kwargs in (
+            ("/api/checkout/checkouts/", {}),
+            (f"/api/checkout/checkouts/{checkout.id}/", {"checkout_id": checkout.id}),
+            ("/api/checkout/checkouts/0/", {"checkout_id": 999999}),
+        ):
+            fast, slow = self._both(CheckoutView, path, **kwargs)
+
+            self.assertEqual(fast.status_code, slow.status_code)
+            self.assertEqual(fast.content, slow.content)
+
+    def test_history_query_count_is_fixed(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = CustomerOrderHistoryView.as_view()(self.factory.get("/api/checkout/my-orders/?page_size=50"))
+        self.assertEqual(response.status_code, 200)
+
+        # Authentication, then rows and lines for each tier
+        history = [query for query in ctx.captured_queries if "order_" in query["sql"]]
+        self.assertEqual(len(history), 4)
+
+    def test_matches_serializer_for_given_rows(self):
+        orders = Order.objects.order_by("id")
+
+        self.assertEqual(order_rows.serialize(orders), OrderSerializer(orders, many=True).data)
+
+    def test_fields_without_a_column_need_a_path(self):
+        with self.assertRaises(ImproperlyConfigured):
+            RowSerializer(OrderSerializer).serialize(Order.objects.all())
+
+        class TotalSerializer(serializers.ModelSerializer):
+            doubled = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Order
+                fields = ["id", "doubled"]
+
+        with self.assertRaises(ImproperlyConfigured):
+            RowSerializer(TotalSerializer).serialize(Order.objects.all())
+
+    def test_renderer_falls_back_where_orjson_cannot_match(self):
+        data = {"big": 2**70, "text": "\u2028\u2029", "price": Decimal("1.50"), "at": timezone.now()}
+
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, renderer_context={"indent": 2}),
+            JSONRenderer().render(data, renderer_context={"indent": 2}),
+        )
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create(email="admin@example.com", username="admin", password="!", role="Admin")
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+        self.pizza = Pizza.objects.create(name="Margherita", description="", price="10.50", stock=100)
+
+    def _order(self, age_days, lines=2, status="Fulfilled", address="1 Main St"):
+        order = Order.objects.create(
+            user=self.user, status=status, total_price="21.00", shipping_address=address, billing_address=address
+        )
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, pizza=self.pizza, quantity=1, price="10.50", size="Small") for _ in range(lines)
+        )
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=age_days))
+        return order
+
+    def _export(self, **params):
+        response = self.client.get(reverse("export-orders"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content).decode(), response
+
+    def test_ndjson_nests_lines_and_spans_the_archive(self):
+        archived = self._order(100)
+        list(archive_orders(timedelta(days=90)))
+        live = self._order(1, lines=0, status="Unfulfilled")
+
+        body, response = self._export()
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertIn('filename="orders.ndjson"', response["Content-Disposition"])
+        records = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([(record["id"], record["archived"]) for record in records], [(live.id, False), (archived.id, True)])
+        self.assertEqual(records[0]["lines"], [])
+        self.assertEqual(records[1]["total_price"], "21.00")
+        self.assertEqual(
+            [(line["pizza_name"], line["price"], line["quantity"]) for line in records[1]["lines"]],
+            [("Margherita", "10.50", 1)] * 2,
+        )
+
+    def test_csv_has_a_row_per_line(self):
+        with_lines = self._order(2, address="=HYPERLINK(\"http://example.com\")")
+        without_lines = self._order(1, lines=0)
+
+        body, response = self._export(export_format="csv")
+
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        rows = list(csv.DictReader(io.StringIO(body)))
+        self.assertEqual([row["id"] for row in rows], [str(with_lines.id)] * 2 + [str(without_lines.id)])
+        self.assertEqual(rows[0]["line_price"], "10.50")
+        self.assertEqual(rows[2]["line_id"], "")
+        # Spreadsheets must not run a customer's address as a formula
+        self.assertTrue(rows[0]["shipping_address"].startswith("'="))
+
+    def test_filters_by_date_range_and_status(self):
+        old = self._order(10)
+        recent = self._order(2)
+        self._order(1, status="Cancel")
+        after = (timezone.now() - timedelta(days=5)).date().isoformat()
+
+        body, _ = self._export(created_after=after, status="Fulfilled")
+        self.assertEqual([json.loads(line)["id"] for line in body.splitlines()], [recent.id])
+
+        body, _ = self._export(created_before=after, export_format="csv")
+        self.assertEqual({row["id"] for row in csv.DictReader(io.StringIO(body))}, {str(old.id)})
+
+        body, _ = self._export(created_after="2999-01-01", export_format="csv")
+        self.assertEqual(body.splitlines()[0].split(",")[:2], ["id", "user_id"])
+        self.assertEqual(len(body.splitlines()), 1)
+
+        self.assertEqual(self.client.get(reverse("export-orders"), {"created_after": "soon"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("export-orders"), {"export_format": "xlsx"}).status_code, 400)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_reads_in_chunks_of_fixed_size(self):
+        orders = [self._order(1) for _ in range(5)]
+
+        with CaptureQueriesContext(connection) as ctx:
+            body, _ = self._export()
+
+        self.assertEqual([json.loads(line)["id"] for line in body.splitlines()], [order.id for order in orders])
+        # Three chunks of orders, plus the empty read that ends each tier
+        limited = [query for query in ctx.captured_queries if "LIMIT 2" in query["sql"]]
+        self.assertEqual(len(limited), 3 + 2)
+
+    def test_admin_only(self):
+        self.client.force_authenticate(user=self.user)
+
+        self.assertEqual(self.client.get(reverse("export-orders")).status_code, 403)
+
+
+class BenchmarkCheckoutFlowTests(LiveServerTestCase):
+    # A smoke test: the command drives a real server over HTTP, so it needs the live server thread
+    def test_runs_every_step_and_reads_query_counts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, "baseline.json")
+            call_command(
+                "benchmark_checkout_flow", url=self.live_server_url, flows=2, concurrency=1, lines=1,
+                save_baseline=baseline, stdout=io.StringIO(),
+            )
+            with open(baseline) as handle:
+                results = json.load(handle)
+
+        for step, stats in results["steps"].items():
+            self.assertEqual((stats["requests"], stats["errors"]), (2, 0), step)
+            # Parsed from the Server-Timing header
+            self.assertGreater(stats["queries"], 0, step)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_failed_requests_fail_the_run(self):
+        out = io.StringIO()
+        with self.assertRaisesMessage(CommandError, "2 requests failed"):
+            call_command(
+                "benchmark_checkout_flow", url=self.live_server_url, flows=2, concurrency=1, lines=1, pizza_id=999999,
+                stdout=out,
+            )
+        self.assertIn("create-checkout", out.getvalue())
+
+    def test_unreadable_bodies_count_as_errors(self):
+        class Connection:
+            async def request(self, method, path, body=None, headers=None):
+                return HTTPResult(200, {}, b'{"refresh": "token"}', 0.01)
+
+        samples = {"login": {"latencies": [], "queries": [], "errors": 0}}
+        with self.assertRaises(FlowError):
+            async_to_sync(BenchmarkCheckoutFlow().step)(
+                Connection(), samples, "login", "POST", "/api/auth/login/", pick=lambda data: data["access"]
+            )
+
+        self.assertEqual((len(samples["login"]["latencies"]), samples["login"]["errors"]), (1, 1))
@@ -1,14 +1,22 @@
+from django.conf import settings
 from django.urls import path, include
 from . import views
 
+# Async variants of the read-heavy views for ASGI deployments
+CheckoutView = views.AsyncCheckoutView if settings.USE_ASYNC_VIEWS else views.CheckoutView
+CustomerOrderHistoryView = views.AsyncCustomerOrderHistoryView if settings.USE_ASYNC_VIEWS else views.CustomerOrderHistoryView
+
 urlpatterns = [
-    path('checkouts/', views.CheckoutView.as_view(), name='checkouts'),
-    path('checkouts/<int:checkout_id>/', views.CheckoutView.as_view(), name='checkout-detail'),
+    path('checkouts/', CheckoutView.as_view(), name='checkouts'),
+    path('checkouts/<int:checkout_id>/', CheckoutView.as_view(), name='checkout-detail'),
     path('create-checkout/', views.CreateCheckoutView.as_view(), name='create-checkout'),
     path('update-checkout/<int:checkout_id>/', views.UpdateCheckoutView.as_view(), name='update-checkout'),
     path('payment/', include('payment.urls')),
     path('complete-checkout/', views.CompleteCheckoutView.as_view(), name='complete-checkout'),
     path('update-order-status/<int:order_id>/', views.UpdateOrderStatusView.as_view(), name='update-order-status'),
-    path('my-orders/', views.CustomerOrderHistoryView.as_view(), name='customer-order-history'),
+    path('update-order-status/bulk/', views.BulkUpdateOrderStatusView.as_view(), name='bulk-update-order-status'),
+    path('my-orders/', CustomerOrderHistoryView.as_view(), name='customer-order-history'),
     path('reviews/<int:order_id>/', views.CreateReviewView.as_view(), name='create-review'),
+    path('reports/sales/', views.SalesReportView.as_view(), name='sales-report'),
+    path('export/orders/', views.OrderExportView.as_view(), name='export-orders'),
 ]
\ No newline at end of file
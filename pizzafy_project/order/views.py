@@ -1,88 +1,375 @@
-import logging
+from collections import Counter, defaultdict
+from datetime import datetime, time, timedelta
+from itertools import groupby
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework.views import APIView
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
-from rest_framework import status
-from .models import Order, OrderLine, Checkout, CheckoutLine, Review
+from rest_framework import serializers, status
+from rest_framework.fields import empty
+from .models import ArchivedOrder, Order, OrderLine, Checkout, CheckoutLine, Review
 from payment.models import Payment
-from core.models import User as CustomUser
 from pizza.models import Pizza
-from .serializers import OrderSerializer, CheckoutSerializer
+from pizza.pricing import UnknownSize, price_lines
+from pizza.stock import InsufficientStock, count_quantities, release_stock, reserve_stock
+from .serializers import (
+    OrderSerializer, CheckoutSerializer, CheckoutSummarySerializer, CheckoutLineSerializer,
+    CheckoutLineCreateSerializer, CheckoutLineEditSerializer, DailySalesSerializer, HourlySalesSerializer,
+    checkout_rows, order_rows,
+)
+from .archive import restore_orders
+from .dispatch import get_dispatcher
+from .events import publish_order_event
+from .export import order_export
+from .reporting import GRANULARITIES, record_cancellation, record_cancellations, record_order
+from .pagination import OrderHistoryPagination
+from core.async_views import AsyncAPIView
+from core.export import EXPORT_FORMATS
+from core.idempotency import idempotent
 from core.permissions import IsAdmin, IsCustomer
+from core.renderers import FastJSONRenderer, MessagePackRenderer
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.exceptions import ValidationError
 
-log = logging.getLogger(__name__)
+
+def check_status_change(user, new_status, comment):
+    """
+    Check a requested status change against the comment, role and status rules.
+
+    Returns ``(error, http_status)`` for the first rule broken, or None.
+    """
+    # Validate comment
+    if not comment:
+        return "Comment is required to update the status", status.HTTP_400_BAD_REQUEST
+
+    # Role-based validation
+    if user.role == "Customer" and new_status != "Cancel":
+        return "Customers can only cancel orders", status.HTTP_400_BAD_REQUEST
+
+    if user.role not in ["Admin", "DeliveryPartner"] and new_status not in ["Cancel"]:
+        return "You do not have permission to update the status", status.HTTP_403_FORBIDDEN
+
+    # Validate new status
+    if new_status not in ["Unfulfilled", "Fulfilled", "Cancel"]:
+        return "Invalid status", status.HTTP_400_BAD_REQUEST
+    return None
+
+
+def find_order(order_id):
+    """
+    The order with ``order_id`` from the live tables, else from the archive, or None.
+    """
+    return Order.objects.filter(id=order_id).first() or ArchivedOrder.objects.filter(id=order_id).first()
 
 
 class UpdateOrderStatusView(APIView):
     permission_classes = [IsAuthenticated]
 
     def patch(self, request, order_id):
-        user = request.user
         new_status = request.data.get("status")
-        comment = request.data.get("comment")
 
-        # Validate comment
-        if not comment:
-            return Response({"error": "Comment is required to update the status"}, status=status.HTTP_400_BAD_REQUEST)
+        # Comment, role and status rules, shared with the bulk endpoint
+        error = check_status_change(request.user, new_status, request.data.get("comment"))
+        if error:
+            return Response({"error": error[0]}, status=error[1])
 
-        # Fetch the order
-        try:
-            order = Order.objects.get(id=order_id)
-        except Order.DoesNotExist:
+        # Fetch the order, live or archived
+        order = find_order(order_id)
+        if order is None:
             return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
 
         # Prevent status change if already canceled
         if order.status == "Cancel":
             return Response({"error": "Order is already canceled and cannot be changed"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Role-based validation
-        if user.role == "Customer" and new_status != "Cancel":
-            return Response({"error": "Customers can only cancel orders"}, status=status.HTTP_400_BAD_REQUEST)
+        # Update the order status; the status condition stops two concurrent cancels from both releasing stock
+        with transaction.atomic():
+            if isinstance(order, ArchivedOrder):
+                # An archived order changes in the live tables
+                restored = restore_orders([order.id])
+                if not restored:
+                    return Response({"error": "Order status changed concurrently, please retry"}, status=status.HTTP_409_CONFLICT)
+                order = restored[0]
+            updated = Order.objects.filter(id=order.id, status=order.status).update(
+                status=new_status, status_note=request.data.get("comment")
+            )
+            if not updated:
+                return Response({"error": "Order status changed concurrently, please retry"}, status=status.HTTP_409_CONFLICT)
 
-        if user.role not in ["Admin", "DeliveryPartner"] and new_status not in ["Cancel"]:
-            return Response({"error": "You do not have permission to update the status"}, status=status.HTTP_403_FORBIDDEN)
+            # Put the pizzas back on the shelf and take the order out of the sales figures when it is cancelled
+            if new_status == "Cancel":
+                order_lines = list(order.order_lines.all())
+                release_stock(count_quantities(order_lines))
+                record_cancellation(order, order_lines)
 
-        # Validate new status
-        valid_statuses = ["Unfulfilled", "Fulfilled", "Cancel"]
-        if new_status not in valid_statuses:
-            return Response({"error": "Invalid status"}, status=status.HTTP_400_BAD_REQUEST)
+            # The delivery partner's capacity follows the order: freed when it closes, taken again if it reopens
+            if order.delivery_partner_id:
+                if order.status == "Unfulfilled" and new_status != "Unfulfilled":
+                    get_dispatcher().release(order.delivery_partner_id)
+                elif order.status != "Unfulfilled" and new_status == "Unfulfilled":
+                    get_dispatcher().reclaim(order.delivery_partner_id)
 
-        # Update the order status and save the comment
-        order.status = new_status
-        order.comment = comment
-        order.save()
+            order.status = new_status
+            publish_order_event(order)
 
         return Response({"status": "Order status updated"}, status=status.HTTP_200_OK)
 
 
+class BulkUpdateOrderStatusView(APIView):
+    """
+    Move many orders to one status with set-based UPDATEs, reporting the outcome per order ID
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        new_status = request.data.get("status")
+        comment = request.data.get("comment")
+        error = check_status_change(request.user, new_status, comment)
+        if error:
+            return Response({"error": error[0]}, status=error[1])
+
+        order_ids_field = serializers.ListField(
+            child=serializers.IntegerField(), min_length=1, max_length=getattr(settings, "ORDER_STATUS_BULK_LIMIT", 1000)
+        )
+        try:
+            order_ids = order_ids_field.run_validation(request.data.get("order_ids", empty))
+        except ValidationError as exc:
+            return Response({"order_ids": exc.detail}, status=status.HTTP_400_BAD_REQUEST)
+        # Keep the caller's order, without repeats
+        order_ids = list(dict.fromkeys(order_ids))
+
+        with transaction.atomic():
+            # Lock the rows so the conditional UPDATE below matches exactly the orders read here
+            orders = {
+                order.id: order
+                for order in Order.objects.select_for_update()
+                .filter(id__in=order_ids)
+                .only("id", "user_id", "status", "delivery_partner_id", "total_price", "created_at")
+            }
+
+            # Archived orders change in the live tables, so move back those that can still change
+            missing_ids = [order_id for order_id in order_ids if order_id not in orders]
+            archived = {}
+            if missing_ids:
+                archived = dict(ArchivedOrder.objects.filter(id__in=missing_ids).values_list("id", "status"))
+                restored = restore_orders(
+                    order_id for order_id, order_status in archived.items() if order_status != "Cancel"
+                )
+                orders.update((order.id, order) for order in restored)
+            results = {}
+            for order_id in order_ids:
+                order = orders.get(order_id)
+                if order is None:
+                    results[order_id] = "already_cancelled" if archived.get(order_id) == "Cancel" else "not_found"
+                elif order.status == "Cancel":
+                    # Prevent status change if already canceled
+                    results[order_id] = "already_cancelled"
+                else:
+                    results[order_id] = "updated"
+            changed = [orders[order_id] for order_id, result in results.items() if result == "updated"]
+
+            if changed:
+                Order.objects.filter(id__in=[order.id for order in changed]).exclude(status="Cancel").update(
+                    status=new_status, status_note=comment
+                )
+
+            # Put the pizzas back and take the orders out of the sales figures in one pass
+            if new_status == "Cancel" and changed:
+                lines_by_order = defaultdict(list)
+                for line in OrderLine.objects.filter(order__in=changed).only("order_id", "pizza_id", "size", "quantity", "price"):
+                    lines_by_order[line.order_id].append(line)
+                release_stock(count_quantities(line for lines in lines_by_order.values() for line in lines))
+                record_cancellations((order, lines_by_order[order.id]) for order in changed)
+
+            # Give delivery partners their capacity back for every order closed, and take it again for every one reopened
+            if new_status == "Unfulfilled":
+                get_dispatcher().reclaim_many(
+                    Counter(order.delivery_partner_id for order in changed if order.status != "Unfulfilled")
+                )
+            else:
+                get_dispatcher().release_many(
+                    Counter(order.delivery_partner_id for order in changed if order.status == "Unfulfilled")
+                )
+
+            for order in changed:
+                order.status = new_status
+                publish_order_event(order)
+
+        return Response(
+            {
+                "updated": len(changed),
+                "results": [{"order_id": order_id, "result": result} for order_id, result in results.items()],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+def serialize_checkouts(row_serializer, checkouts):
+    # Read-only fast path when the view has one, the same JSON either way
+    if row_serializer is not None:
+        return row_serializer.serialize(checkouts)
+    return CheckoutSerializer(checkouts.prefetch_related("checkout_lines"), many=True).data
+
+
 class CheckoutView(APIView):
     permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, MessagePackRenderer, BrowsableAPIRenderer]
+    row_serializer = checkout_rows  # None serializes with CheckoutSerializer
 
     def get(self, request, checkout_id=None):
+        checkouts = Checkout.objects.filter(user=request.user)
+
         # If checkout_id is provided, return the specific checkout
         if checkout_id:
-            try:
-                checkout = Checkout.objects.get(id=checkout_id, user=request.user)
-            except Checkout.DoesNotExist:
+            data = serialize_checkouts(self.row_serializer, checkouts.filter(id=checkout_id))
+            if not data:
                 return Response({"error": "Checkout not found or does not belong to user"}, status=status.HTTP_404_NOT_FOUND)
-            serializer = CheckoutSerializer(checkout)
-            return Response({"checkout": serializer.data}, status=status.HTTP_200_OK)
+            return Response({"checkout": data[0]}, status=status.HTTP_200_OK)
 
         # If no checkout_id is provided, return all checkouts for the user
-        checkouts = Checkout.objects.filter(user=request.user)
-        serializer = CheckoutSerializer(checkouts, many=True)
-        return Response({"checkouts": serializer.data}, status=status.HTTP_200_OK)
+        return Response({"checkouts": serialize_checkouts(self.row_serializer, checkouts)}, status=status.HTTP_200_OK)
+
+
+class AsyncCheckoutView(AsyncAPIView):
+    """
+    Async version of CheckoutView, used when USE_ASYNC_VIEWS is on
+    """
+
+    renderer_classes = [FastJSONRenderer, MessagePackRenderer]
+    row_serializer = checkout_rows
+
+    async def get(self, request, checkout_id=None):
+        checkouts = Checkout.objects.filter(user_id=request.user.id)
+        if checkout_id:
+            checkouts = checkouts.filter(id=checkout_id)
+        if self.row_serializer is None:
+            data = await sync_to_async(serialize_checkouts)(None, checkouts)
+        else:
+            # Fetch the rows on the event loop, like the order history; only the lines query runs in a thread
+            rows = [row async for row in self.row_serializer.rows(checkouts)]
+            data = await sync_to_async(self.row_serializer.to_representation)(Checkout, rows) if rows else []
+
+        if checkout_id:
+            if not data:
+                return self.render({"error": "Checkout not found or does not belong to user"}, status=status.HTTP_404_NOT_FOUND)
+            return self.render({"checkout": data[0]})
+        return self.render({"checkouts": data})
+
+
+def parse_history_bound(value):
+    # Accept either a date or a datetime; naive values are read in the current timezone
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            parsed_date = parse_date(value)
+            if parsed_date is None:
+                return None
+            parsed = datetime.combine(parsed_date, time.min)
+    except ValueError:
+        return None
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def filter_date_range(params, field):
+    """
+    ``field`` narrowed by the optional created_after (inclusive) and created_before (exclusive) params.
+
+    Returns (filters, error); error is a message for a 400 response.
+    """
+    filters = Q()
+    for param, lookup in (("created_after", "gte"), ("created_before", "lt")):
+        value = params.get(param)
+        if not value:
+            continue
+        parsed = parse_history_bound(value)
+        if parsed is None:
+            return None, f"{param} must be an ISO date or datetime"
+        filters &= Q(**{f"{field}__{lookup}": parsed})
+    return filters, None
+
+
+def filter_order_history(user, params):
+    """
+    A user's orders narrowed by the optional history filters, as one queryset per tier: live orders, then archived ones.
+
+    Returns (querysets, error); error is a message for a 400 response.
+    """
+    filters = Q(user_id=user.id)
+
+    # Optional filters, all served by each tier's (user, created_at, id) index
+    order_status = params.get("status")
+    if order_status:
+        filters &= Q(status=order_status)
+
+    date_range, error = filter_date_range(params, "created_at")
+    if error:
+        return None, error
+    filters &= date_range
+
+    return [model.objects.filter(filters).with_lines() for model in (Order, ArchivedOrder)], None
+
+
+def history_rows(row_serializer, tiers):
+    # What the history views paginate: the tier querysets, or their rows for the fast path
+    if row_serializer is None:
+        return tiers
+    return [row_serializer.rows(tier, named=True) for tier in tiers]
+
+
+def serialize_history(row_serializer, paginator, tiers):
+    if row_serializer is None:
+        return OrderSerializer(paginator.page, many=True).data
+    # Each tier's rows are contiguous on a page and come from its own tables
+    data = []
+    for tier, entries in groupby(paginator.entries, key=lambda entry: entry[0]):
+        data += row_serializer.to_representation(tiers[tier].model, [row for _, row in entries])
+    return data
 
 
 class CustomerOrderHistoryView(APIView):
     permission_classes = [IsAuthenticated]
-    
+    renderer_classes = [FastJSONRenderer, MessagePackRenderer, BrowsableAPIRenderer]
+    pagination_class = OrderHistoryPagination
+    row_serializer = order_rows  # None serializes with OrderSerializer
+
     def get(self, request):
-        user = request.user
-        orders = Order.objects.filter(user=user).order_by("-created_at")
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        tiers, error = filter_order_history(request.user, request.query_params)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Live orders come first; the archive is only read once they run out
+        paginator = self.pagination_class(request)
+        paginator.paginate_queryset(*history_rows(self.row_serializer, tiers))
+        data = serialize_history(self.row_serializer, paginator, tiers)
+        return Response(paginator.get_paginated_data(data), status=status.HTTP_200_OK)
+
+
+class AsyncCustomerOrderHistoryView(AsyncAPIView):
+    """
+    Async version of CustomerOrderHistoryView, used when USE_ASYNC_VIEWS is on
+    """
+
+    renderer_classes = [FastJSONRenderer, MessagePackRenderer]
+    pagination_class = OrderHistoryPagination
+    row_serializer = order_rows
+
+    async def get(self, request):
+        tiers, error = filter_order_history(request.user, request.GET)
+        if error:
+            return self.render({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = self.pagination_class(request)
+        await paginator.apaginate_queryset(*history_rows(self.row_serializer, tiers))
+        data = await sync_to_async(serialize_history)(self.row_serializer, paginator, tiers)
+        return self.render(paginator.get_paginated_data(data))
 
 
 class CreateCheckoutView(APIView):
@@ -93,7 +380,7 @@ class CreateCheckoutView(APIView):
         user = request.user
         shipping_address = request.data.get("shipping_address")
         billing_address = request.data.get("billing_address")
-        checkout_lines_data = request.data.get("checkout_lines")
+        checkout_lines_data = request.data.get("checkout_lines") or []
 
         # # Basic validation for the addresses
         if not shipping_address or not billing_address:
@@ -101,38 +388,46 @@ class CreateCheckoutView(APIView):
                 "Both shipping_address and billing_address are required."
             )
 
-        # # Create the checkout object
-        checkout = Checkout.objects.create(
-            user=user,
-            total_price=0,  # Will calculate total price later
-            shipping_address=shipping_address,
-            billing_address=billing_address,
-        )
+        lines_serializer = CheckoutLineCreateSerializer(data=checkout_lines_data, many=True)
+        lines_serializer.is_valid(raise_exception=True)
+        checkout_lines_data = lines_serializer.validated_data
 
-        total_price = 0
-        # # Add checkout lines
-        for line_data in checkout_lines_data:
-            pizza = Pizza.objects.get(id=line_data["pizza_id"])
-            price = line_data["price"]
-            quantity = line_data["quantity"]
-            size = line_data["size"]
-
-            # Calculate total price
-            total_price += price * quantity
-
-            # Create CheckoutLine
-            CheckoutLine.objects.create(
-                checkout=checkout,
-                pizza=pizza,
-                quantity=quantity,
-                price=price,
-                size=size,
-                customizations=line_data.get("customizations", ""),
+        # Resolve every pizza in one query instead of one lookup per line
+        pizza_ids = {line_data["pizza_id"] for line_data in checkout_lines_data}
+        pizzas = Pizza.objects.in_bulk(pizza_ids)
+        missing_ids = pizza_ids - set(pizzas)
+        if missing_ids:
+            return Response(
+                {"message": "Pizzas not found", "pizza_ids": sorted(missing_ids)},
+                status=status.HTTP_404_NOT_FOUND,
             )
 
-        # # Update the total price of the checkout
-        checkout.total_price = total_price
-        checkout.save()
+        # Build the lines in memory and price them server-side before anything is written
+        checkout_lines = [
+            CheckoutLine(
+                pizza=pizzas[line_data["pizza_id"]],
+                quantity=line_data["quantity"],
+                size=line_data["size"],
+                customizations=line_data["customizations"],
+            )
+            for line_data in checkout_lines_data
+        ]
+        try:
+            total_price = price_lines(checkout_lines)
+        except UnknownSize as exc:
+            return Response({"message": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Create the checkout with its final total and insert all lines in one statement
+        with transaction.atomic():
+            checkout = Checkout.objects.create(
+                user=user,
+                total_price=total_price,
+                shipping_address=shipping_address,
+                billing_address=billing_address,
+            )
+            for checkout_line in checkout_lines:
+                checkout_line.checkout = checkout
+            CheckoutLine.objects.bulk_create(checkout_lines)
 
         serializer = CheckoutSerializer(checkout)
 
@@ -143,6 +438,77 @@ class CreateCheckoutView(APIView):
         )
 
 
+LINE_EDIT_FIELDS = ["quantity", "price", "size", "customizations"]
+
+
+def diff_checkout_lines(lines, edits):
+    """
+    Work out what an edit payload does to a checkout's current lines.
+
+    ``edits`` are validated CheckoutLineEditSerializer data. They are applied in
+    order to an in-memory copy, so a later edit sees the result of earlier ones.
+    Returns ``((to_create, to_update, to_delete, final_lines), error)``
+    where ``error`` is a 404 message and nothing else is set.
+    """
+    current = {line.id: line for line in lines}
+    to_create, updated_ids, deleted_ids = [], set(), set()
+
+    # Resolve every pizza the edits add in one query
+    new_line_edits = [
+        line_data for line_data in edits
+        if line_data.get("action", "update") in ("add", "update")
+        and (line_data.get("action", "update") == "add" or not line_data.get("checkout_line_id"))
+    ]
+    pizza_ids = {str(line_data.get("pizza_id")) for line_data in new_line_edits}
+    pizzas = {str(pk): pizza for pk, pizza in Pizza.objects.in_bulk(pizza_ids).items()} if pizza_ids else {}
+
+    for line_data in edits:
+        checkout_line_id = line_data.get("checkout_line_id")
+        action = line_data.get("action", "update")  # Default action is 'update'
+        quantity = line_data.get("quantity")
+        size = line_data.get("size")
+        customizations = line_data.get("customizations", "")
+
+        if action == "remove" and checkout_line_id:
+            line = current.pop(checkout_line_id, None)
+            if line is None:
+                return None, f"Checkout line {checkout_line_id} not found"
+            deleted_ids.add(line.pk)
+            updated_ids.discard(line.pk)
+
+        elif action == "add" or (action == "update" and not checkout_line_id):
+            # If the line doesn't exist, create a new one
+            pizza = pizzas.get(str(line_data.get("pizza_id")))
+            if pizza is None:
+                return None, f"Pizza with ID {line_data.get('pizza_id')} not found"
+            to_create.append(
+                CheckoutLine(
+                    pizza=pizza,
+                    quantity=quantity,
+                    size=size,
+                    customizations=customizations,
+                )
+            )
+
+        elif action == "update":
+            line = current.get(checkout_line_id)
+            if line is None:
+                return None, f"Checkout line {checkout_line_id} not found"
+
+            # Update only the provided values (keep old values if not provided)
+            if quantity is not None:
+                line.quantity = quantity
+            if size:
+                line.size = size
+            if customizations:
+                line.customizations = customizations
+            updated_ids.add(line.pk)
+
+    to_update = [current[pk] for pk in sorted(updated_ids)]
+    final_lines = sorted(current.values(), key=lambda line: line.pk) + to_create
+    return (to_create, to_update, deleted_ids, final_lines), None
+
+
 class UpdateCheckoutView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -152,112 +518,62 @@ class UpdateCheckoutView(APIView):
         if not checkout_id:
             raise ValidationError("checkout_id is required")
 
-        # Get the checkout object
-        try:
-            checkout = Checkout.objects.get(id=checkout_id)
-        except Checkout.DoesNotExist:
-            return Response(
-                {"message": "Checkout not found"}, status=status.HTTP_404_NOT_FOUND
-            )
-
-        # Update shipping and billing addresses if provided
-        shipping_address = request.data.get("shipping_address")
-        billing_address = request.data.get("billing_address")
-
-        if shipping_address:
-            checkout.shipping_address = shipping_address
-        if billing_address:
-            checkout.billing_address = billing_address
-
-        checkout.save()
-
-        # Handle checkout line updates (adding, removing, or updating)
-        checkout_lines_data = request.data.get("checkout_lines", [])
-        total_price = checkout.total_price
-
-        for line_data in checkout_lines_data:
-            checkout_line_id = line_data.get("checkout_line_id")
-            action = line_data.get("action", "update")  # Default action is 'update'
-            pizza_id = line_data.get("pizza_id")
-            quantity = line_data.get("quantity")
-            size = line_data.get("size")
-            price = line_data.get("price")
-            customizations = line_data.get("customizations", "")
-
-            if action == "remove" and checkout_line_id:
-                try:
-                    checkout_line = CheckoutLine.objects.get(
-                        id=checkout_line_id, checkout=checkout
-                    )
-                    total_price -= checkout_line.price * checkout_line.quantity
-                    checkout_line.delete()
-                except CheckoutLine.DoesNotExist:
-                    return Response(
-                        {"message": f"Checkout line {checkout_line_id} not found"},
-                        status=status.HTTP_404_NOT_FOUND,
-                    )
-
-            elif action == "add" or action == "update":
-                if action == "add" or not checkout_line_id:
-                    # If the line doesn't exist, create a new one
-                    try:
-                        pizza = Pizza.objects.get(id=pizza_id)
-                    except Pizza.DoesNotExist:
-                        return Response(
-                            {"message": f"Pizza with ID {pizza_id} not found"},
-                            status=status.HTTP_404_NOT_FOUND,
-                        )
-
-                    # Create new checkout line
-                    checkout_line = CheckoutLine.objects.create(
-                        checkout=checkout,
-                        pizza=pizza,
-                        quantity=quantity,
-                        price=price,
-                        size=size,
-                        customizations=customizations,
-                    )
+        # Line ids and quantities must be integers before anything is looked up
+        edits = CheckoutLineEditSerializer(data=request.data.get("checkout_lines") or [], many=True)
+        edits.is_valid(raise_exception=True)
 
-                    total_price += price * quantity
-                elif action == "update" and checkout_line_id:
-                    try:
-                        checkout_line = CheckoutLine.objects.get(
-                            id=checkout_line_id, checkout=checkout
-                        )
-                    except CheckoutLine.DoesNotExist:
-                        return Response(
-                            {"message": f"Checkout line {checkout_line_id} not found"},
-                            status=status.HTTP_404_NOT_FOUND,
-                        )
-
-                    # Update existing checkout line
-                    total_price -= (
-                        checkout_line.price * checkout_line.quantity
-                    )  # Remove old price
-
-                    # Update only the provided values (keep old values if not provided)
-                    if quantity is not None:
-                        checkout_line.quantity = quantity
-                    if price is not None:
-                        checkout_line.price = price
-                    if size:
-                        checkout_line.size = size
-                    if customizations:
-                        checkout_line.customizations = customizations
-
-                    checkout_line.save()
-                    total_price += (
-                        checkout_line.price * checkout_line.quantity
-                    )  # Add new price
-
-            # Update the total price of the checkout
-            checkout.total_price = total_price
+        with transaction.atomic():
+            # Get the checkout object, locked so concurrent edits apply one after the other
+            try:
+                checkout = Checkout.objects.select_for_update().get(id=checkout_id)
+            except Checkout.DoesNotExist:
+                return Response(
+                    {"message": "Checkout not found"}, status=status.HTTP_404_NOT_FOUND
+                )
+
+            # Update shipping and billing addresses if provided
+            shipping_address = request.data.get("shipping_address")
+            billing_address = request.data.get("billing_address")
+
+            if shipping_address:
+                checkout.shipping_address = shipping_address
+            if billing_address:
+                checkout.billing_address = billing_address
+
+            # Handle checkout line updates (adding, removing, or updating) as one diff
+            lines = list(checkout.checkout_lines.order_by("id"))
+            diff, error = diff_checkout_lines(lines, edits.validated_data)
+            if error:
+                return Response({"message": error}, status=status.HTTP_404_NOT_FOUND)
+            to_create, to_update, to_delete, final_lines = diff
+
+            # Added and edited lines are priced server-side, all in one pass
+            try:
+                price_lines(to_create + to_update)
+            except UnknownSize as exc:
+                return Response({"message": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+            if to_delete:
+                CheckoutLine.objects.filter(checkout=checkout, id__in=to_delete).delete()
+            if to_update:
+                CheckoutLine.objects.bulk_update(to_update, LINE_EDIT_FIELDS)
+            if to_create:
+                for checkout_line in to_create:
+                    checkout_line.checkout = checkout
+                CheckoutLine.objects.bulk_create(to_create)
+
+            # The total always comes from the lines the checkout ends up with
+            checkout.total_price = sum(line.price * line.quantity for line in final_lines)
             checkout.save()
 
-        serializer = CheckoutSerializer(checkout)
+        # Every line the checkout ends up with is in memory, in id order; serialize those rather than read them back
+        checkout_data = {
+            **CheckoutSummarySerializer(checkout).data,
+            "checkout_lines": CheckoutLineSerializer(final_lines, many=True).data,
+        }
 
         return Response(
-            {"message": "Checkout updated", "checkout_data": serializer.data},
+            {"message": "Checkout updated", "checkout_data": checkout_data},
             status=status.HTTP_200_OK,
         )
 
@@ -265,56 +581,83 @@ class UpdateCheckoutView(APIView):
 class CompleteCheckoutView(APIView):
     permission_classes = [IsAuthenticated]
 
+    @idempotent
     def post(self, request):
         # Extract the checkout_id from the request
         checkout_id = request.data.get("checkout_id")
         if not checkout_id:
             raise ValidationError("checkout_id is required")
 
-        # Get the checkout object
-        try:
-            checkout = Checkout.objects.get(id=checkout_id)
-        except Checkout.DoesNotExist:
-            return Response(
-                {"message": "Checkout not found"}, status=status.HTTP_404_NOT_FOUND
-            )
+        with transaction.atomic():
+            # Get the checkout object
+            try:
+                checkout = Checkout.objects.select_for_update().get(id=checkout_id)
+            except Checkout.DoesNotExist:
+                return Response(
+                    {"message": "Checkout not found"}, status=status.HTTP_404_NOT_FOUND
+                )
 
-        # Create Order object
-        order = Order.objects.create(
-            user=checkout.user,
-            total_price=checkout.total_price,
-            shipping_address=checkout.shipping_address,
-            billing_address=checkout.billing_address,
-            status="Unfulfilled",  # Initially the order is unfulfilled
-        )
+            # Only a paid checkout becomes an order; an online payment must have settled first
+            payment = Payment.objects.filter(checkout=checkout).only("id", "status").first()
+            if payment is None or payment.status != "Completed":
+                return Response(
+                    {"message": "Checkout has not been paid", "payment_status": payment and payment.status},
+                    status=status.HTTP_402_PAYMENT_REQUIRED,
+                )
 
-        # Create OrderLine objects from CheckoutLine
-        for checkout_line in checkout.checkout_lines.all():
-            OrderLine.objects.create(
-                order=order,
-                pizza=checkout_line.pizza,
-                quantity=checkout_line.quantity,
-                price=checkout_line.price,
-                size=checkout_line.size,
-                customizations=checkout_line.customizations,
+            checkout_lines = list(checkout.checkout_lines.all())
+
+            # Reserve stock for every line in one conditional UPDATE before writing anything
+            try:
+                reserve_stock(count_quantities(checkout_lines))
+            except InsufficientStock as exc:
+                return Response(
+                    {"message": "Not enough stock", "pizza_ids": exc.pizza_ids},
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+            # Assign Delivery Partner through the configured dispatch strategy
+            # Resolved up front so the order row is written once, partner included
+            delivery_partner = get_dispatcher().assign()
+
+            # Create Order object
+            order = Order.objects.create(
+                user_id=checkout.user_id,
+                total_price=checkout.total_price,
+                shipping_address=checkout.shipping_address,
+                billing_address=checkout.billing_address,
+                status="Unfulfilled",  # Initially the order is unfulfilled
+                payment_status="Paid",
+                delivery_partner=delivery_partner,
             )
 
-        
-        # Assign Delivery Partner (Dummy Setup: first available DeliveryPartner)
-        delivery_partner = CustomUser.objects.filter(role="DeliveryPartner", is_available=True).first()
-        if delivery_partner:
-            order.delivery_partner = delivery_partner
-            order.save()
-            
-        # Update Payment object with the associated order ID
-        payment = Payment.objects.filter(checkout=checkout).first()
-        if payment:
-            payment.order = order
-            payment.save()
-
-        # Delete the Checkout and its associated CheckoutLines
-        checkout.checkout_lines.all().delete()  # Delete checkout lines first to avoid foreign key issues
-        checkout.delete()  # Delete the checkout after processing
+            # Copy every CheckoutLine into an OrderLine with a single insert
+            order_lines = OrderLine.objects.bulk_create(
+                [
+                    OrderLine(
+                        order=order,
+                        pizza_id=checkout_line.pizza_id,
+                        quantity=checkout_line.quantity,
+                        price=checkout_line.price,
+                        size=checkout_line.size,
+                        customizations=checkout_line.customizations,
+                    )
+                    for checkout_line in checkout_lines
+                ]
+            )
+
+            record_order(order, order_lines)
+
+            # Link the Payment object to the order
+            Payment.objects.filter(id=payment.id).update(order=order)
+
+            # Delete the Checkout; its CheckoutLines go with it in one cascaded delete
+            checkout.delete()
+
+            publish_order_event(order)
+
+        # Reload with related rows so serialisation does not query per line
+        order = Order.objects.with_lines().get(id=order.id)
 
         serializer = OrderSerializer(order)
         # Return the response with the order ID
@@ -324,6 +667,52 @@ class CompleteCheckoutView(APIView):
         )
 
 
+class SalesReportView(APIView):
+    """
+    Sales figures from the pre-aggregated summary tables (see order.reporting)
+    """
+
+    permission_classes = [IsAuthenticated, IsAdmin]
+    serializer_classes = {"daily": DailySalesSerializer, "hourly": HourlySalesSerializer}
+
+    def get(self, request):
+        granularity = request.query_params.get("granularity", "daily")
+        if granularity not in GRANULARITIES:
+            return Response({"error": "granularity must be 'daily' or 'hourly'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Inclusive local date range, the last 7 days by default
+        today = timezone.localdate()
+        try:
+            end = parse_date(request.query_params.get("end", "")) or today
+            start = parse_date(request.query_params.get("start", "")) or end - timedelta(days=6)
+        except ValueError:
+            return Response({"error": "start and end must be dates (YYYY-MM-DD)"}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({"error": "start must not be after end"}, status=status.HTTP_400_BAD_REQUEST)
+
+        model = GRANULARITIES[granularity]
+        rows = model.objects.order_by("bucket", "pizza_id", "size")
+        if granularity == "daily":
+            rows = rows.filter(bucket__gte=start, bucket__lte=end)
+        else:
+            rows = rows.filter(
+                bucket__gte=timezone.make_aware(datetime.combine(start, time.min)),
+                bucket__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)),
+            )
+
+        # Bucket totals unless a per pizza and size breakdown is asked for
+        if request.query_params.get("breakdown") == "pizza":
+            rows = rows.filter(pizza__isnull=False)
+        else:
+            rows = rows.filter(pizza__isnull=True)
+
+        serializer = self.serializer_classes[granularity](rows, many=True)
+        return Response(
+            {"granularity": granularity, "start": start, "end": end, "results": serializer.data},
+            status=status.HTTP_200_OK,
+        )
+
+
 class CreateReviewView(APIView):
     permission_classes = [IsAuthenticated]
     
@@ -346,10 +735,9 @@ class CreateReviewView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Retrieve the order, and check conditions
-        try:
-            order = Order.objects.get(id=order_id)
-        except Order.DoesNotExist:
+        # Retrieve the order, live or archived, and check conditions
+        order = find_order(order_id)
+        if order is None:
             return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
 
         # Ensure the order is fulfilled and belongs to the user
@@ -372,9 +760,9 @@ class CreateReviewView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        # Create the review for the delivery partner
+        # Create the review for the delivery partner, linked to whichever tier holds the order
         Review.objects.create(
-            order=order,
+            **{"archived_order" if isinstance(order, ArchivedOrder) else "order": order},
             rating=rating,
             comment=comment,
         )
@@ -382,4 +770,27 @@ class CreateReviewView(APIView):
         return Response(
             {"message": "Review submitted successfully"}, 
             status=status.HTTP_201_CREATED
-        )
\ No newline at end of file
+        )
+
+
+class OrderExportView(APIView):
+    """
+    Orders with their lines as a streamed NDJSON or CSV download, for finance (see core.export)
+    """
+
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        # Not "format", which DRF reads for content negotiation
+        export_format = request.query_params.get("export_format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": "export_format must be 'ndjson' or 'csv'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        filters, error = filter_date_range(request.query_params, "created_at")
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        order_status = request.query_params.get("status")
+        if order_status:
+            filters &= Q(status=order_status)
+
+        return order_export(filters).response(export_format)
@@ -0,0 +1,36 @@
+"""
+Payment export for finance: every payment with its gateway transactions (see core.export).
+"""
+from django.db.models.functions import Coalesce
+
+from core.export import Export, ExportSource
+
+from .models import Payment
+
+PAYMENT_FIELDS = {
+    "id": "id",
+    "order_id": "placed_order_id",
+    "checkout_id": "checkout_id",
+    "payment_method": "payment_method",
+    "amount": "amount",
+    "status": "status",
+    "payment_date": "payment_date",
+}
+TRANSACTION_FIELDS = {
+    "id": "id",
+    "transaction_id": "transaction_id",
+    "transaction_date": "transaction_date",
+    "amount": "amount",
+    "transaction_status": "transaction_status",
+    "gateway_response": "gateway_response",
+}
+
+
+def payment_export(filters):
+    """
+    Payments matching ``filters`` (a Q over payment fields).
+    """
+    # Payments point at a live or an archived order, never both
+    payments = Payment.objects.filter(filters).annotate(placed_order_id=Coalesce("order_id", "archived_order_id"))
+    source = ExportSource(payments, PAYMENT_FIELDS, "transactions", TRANSACTION_FIELDS)
+    return Export("payments", [source], children_key="transactions", child_prefix="transaction")
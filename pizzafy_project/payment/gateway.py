@@ -0,0 +1,129 @@
+"""
+Payment gateways and background processing.
+
+Online payments are created Pending and handed to a gateway from a worker
+pool once the creating transaction commits, so gateway latency never sits
+inside the request. A gateway reports the outcome by calling
+``record_result``. The stub calls it from the worker; a real gateway might
+call it later from its webhook. Clients follow progress on the payment
+status endpoint, and complete the checkout once the payment has succeeded.
+
+Queued charges live only in this process's memory, so a restart loses them
+and leaves their transactions Pending. The resubmit_pending_payments command
+charges those again once they are older than
+``PAYMENT_RESUBMIT_AFTER_MINUTES``. The transaction id goes to the gateway
+with every attempt, so a real gateway can use it as its idempotency key and
+never charge twice.
+
+The gateway is chosen with the ``PAYMENT_GATEWAY`` setting, either one of
+the names in ``PAYMENT_GATEWAYS`` or a dotted path to a gateway class.
+"""
+import json
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction as db_transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from order.models import Order
+
+from .models import Payment, Transaction
+
+# Order.payment_status for each settled Payment.status
+ORDER_PAYMENT_STATUSES = {"Completed": "Paid", "Failed": "Failed"}
+
+
+class BaseGateway:
+    def charge(self, transaction, on_result):
+        """
+        Start charging ``transaction.amount``; call ``on_result(transaction, success, response)`` when settled.
+        """
+        raise NotImplementedError
+
+
+class StubGateway(BaseGateway):
+    """
+    Local stand-in for a card gateway, with configurable latency and failure rate
+    """
+
+    def __init__(self, latency=None, failure_rate=None):
+        self.latency = getattr(settings, "PAYMENT_STUB_LATENCY_SECONDS", 0.5) if latency is None else latency
+        self.failure_rate = getattr(settings, "PAYMENT_STUB_FAILURE_RATE", 0.0) if failure_rate is None else failure_rate
+
+    def charge(self, transaction, on_result):
+        time.sleep(self.latency)
+        success = random.random() >= self.failure_rate
+        response = {
+            "gateway": "stub",
+            "reference": uuid.uuid4().hex,
+            "amount": str(transaction.amount),
+            "outcome": "approved" if success else "declined",
+        }
+        on_result(transaction, success, json.dumps(response))
+
+
+PAYMENT_GATEWAYS = {
+    "stub": StubGateway,
+}
+
+
+def get_gateway(name=None):
+    name = name or getattr(settings, "PAYMENT_GATEWAY", "stub")
+    gateway_class = PAYMENT_GATEWAYS.get(name) or import_string(name)
+    return gateway_class()
+
+
+payment_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "PAYMENT_WORKERS", 8), thread_name_prefix="payment"
+)
+
+
+def record_result(transaction, success, response):
+    """
+    Settle a Pending transaction, its payment and the order it paid for, if placed already.
+
+    Later results for the same transaction are ignored.
+    """
+    payment_status = "Completed" if success else "Failed"
+    with db_transaction.atomic():
+        settled = Transaction.objects.filter(id=transaction.id, transaction_status="Pending").update(
+            transaction_status="Success" if success else "Failed", gateway_response=response
+        )
+        if settled:
+            Payment.objects.filter(id=transaction.payment_id).update(status=payment_status)
+            Order.objects.filter(payment__id=transaction.payment_id).update(
+                payment_status=ORDER_PAYMENT_STATUSES[payment_status]
+            )
+
+
+def process_transaction(transaction_id):
+    # Pool threads sit outside Django's request cycle, so manage their connections here
+    close_old_connections()
+    try:
+        transaction = Transaction.objects.get(id=transaction_id)
+        try:
+            get_gateway().charge(transaction, record_result)
+        except Exception as exc:
+            record_result(transaction, False, json.dumps({"error": str(exc)}))
+    finally:
+        close_old_connections()
+
+
+def submit_transaction(transaction):
+    """
+    Queue a Pending transaction for the gateway once the current database transaction commits.
+    """
+    db_transaction.on_commit(lambda: payment_executor.submit(process_transaction, transaction.id))
+
+
+def stuck_transactions(max_age):
+    """
+    Online transactions still Pending ``max_age`` (a timedelta) after they were created.
+    """
+    return Transaction.objects.filter(
+        transaction_status="Pending", payment__payment_method="Online", transaction_date__lt=timezone.now() - max_age
+    )
@@ -0,0 +1,34 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payment.gateway import payment_executor, process_transaction, stuck_transactions
+from payment.models import Transaction
+
+
+class Command(BaseCommand):
+    help = (
+        "Charge again online payments whose transaction has been Pending longer than --older-than-minutes, "
+        "e.g. because a restart lost the worker pool's queue. Run it from a scheduler"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-minutes", type=float, default=getattr(settings, "PAYMENT_RESUBMIT_AFTER_MINUTES", 15),
+            help="Resubmit transactions created longer ago than this",
+        )
+
+    def handle(self, *args, **options):
+        ids = list(
+            stuck_transactions(timedelta(minutes=options["older_than_minutes"])).values_list("id", flat=True)
+        )
+        # Charged on the payment workers, as when first submitted; map() waits for all of them
+        list(payment_executor.map(process_transaction, ids))
+
+        outcomes = Counter(Transaction.objects.filter(id__in=ids).values_list("transaction_status", flat=True))
+        self.stdout.write(self.style.SUCCESS(
+            f"Resubmitted {len(ids)} transactions: {outcomes['Success']} succeeded, {outcomes['Failed']} failed, "
+            f"{outcomes['Pending']} still pending"
+        ))
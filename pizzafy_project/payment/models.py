@@ -1,18 +1,24 @@
 from django.db import models
-from order.models import Order, Checkout
+from order.models import ArchivedOrder, Order, Checkout
 
 # Create your models here.
 class Payment(models.Model):
     order = models.OneToOneField(Order, null=True, on_delete=models.CASCADE)
     checkout = models.OneToOneField(Checkout, null=True, on_delete=models.SET_NULL)
+    archived_order = models.OneToOneField(ArchivedOrder, null=True, blank=True, on_delete=models.CASCADE)  # Set instead of order once archived
     payment_method = models.CharField(max_length=50, choices=[('COD', 'Cash on Delivery'), ('Online', 'Online')])
     amount = models.DecimalField(max_digits=6, decimal_places=2)
-    status = models.CharField(max_length=50, choices=[('Pending', 'Pending'), ('Completed', 'Completed')], default='Pending')
+    status = models.CharField(max_length=50, choices=[('Pending', 'Pending'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Pending')
     payment_date = models.DateTimeField(auto_now_add=True)  # Date of the payment
     
     def __str__(self):
         return f"Payment for Order {self.order.id} via {self.payment_method}"
 
+    @property
+    def placed_order(self):
+        # The order this payment is for, live or archived
+        return self.order or self.archived_order
+
 class Transaction(models.Model):
     payment = models.ForeignKey(Payment, related_name='transactions', on_delete=models.CASCADE)
     transaction_id = models.CharField(max_length=100, unique=True)  # Unique ID for the transaction
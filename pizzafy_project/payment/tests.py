@@ -1,3 +1,316 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import time
 
-# Create your tests here.
+import msgpack
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.models import User as CustomUser
+from core.serializers import RoleTokenObtainPairSerializer
+from order.archive import archive_orders
+from order.models import Checkout, Order
+from .gateway import StubGateway, record_result
+from .models import Payment, Transaction
+from .views import AsyncCreatePaymentView
+
+
+class AsyncCreatePaymentViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.checkout = Checkout.objects.create(
+            user=self.user, total_price=25, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        access = RoleTokenObtainPairSerializer.get_token(self.user).access_token
+        self.factory = APIRequestFactory(HTTP_AUTHORIZATION=f"Bearer {access}")
+
+    def _post(self, data):
+        request = self.factory.post("/api/checkout/payment/create/", data, format="json")
+        return async_to_sync(AsyncCreatePaymentView.as_view())(request)
+
+    def test_creates_payment_and_transaction(self):
+        response = self._post({"checkout_id": self.checkout.id, "payment_method": "COD"})
+
+        self.assertEqual(response.status_code, 201)
+        payment = Payment.objects.get(checkout=self.checkout)
+        self.assertEqual(payment.transactions.count(), 1)
+
+    def test_validates_payment_method(self):
+        response = self._post({"checkout_id": self.checkout.id, "payment_method": "Cheque"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+
+
+class IdempotentPaymentTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.checkout = Checkout.objects.create(
+            user=self.user, total_price=25, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _post(self, key, payment_method="COD"):
+        return self.client.post(
+            reverse("create-payment"),
+            {"checkout_id": self.checkout.id, "payment_method": payment_method},
+            format="json",
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_first_response(self):
+        first = self._post("retry-1")
+
+        with CaptureQueriesContext(connection) as ctx:
+            retry = self._post("retry-1")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual((retry.status_code, retry.content), (first.status_code, first.content))
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertFalse([query for query in ctx.captured_queries if "payment_" in query["sql"] or "order_" in query["sql"]])
+
+    def test_replay_keeps_the_negotiated_format(self):
+        first = self.client.post(
+            reverse("create-payment"), {"checkout_id": self.checkout.id, "payment_method": "COD"}, format="json",
+            HTTP_IDEMPOTENCY_KEY="retry-msgpack", HTTP_ACCEPT="application/msgpack",
+        )
+        retry = self.client.post(
+            reverse("create-payment"), {"checkout_id": self.checkout.id, "payment_method": "COD"}, format="json",
+            HTTP_IDEMPOTENCY_KEY="retry-msgpack", HTTP_ACCEPT="application/msgpack",
+        )
+
+        self.assertEqual(first["Content-Type"], "application/msgpack")
+        self.assertEqual(retry["Content-Type"], "application/msgpack")
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(msgpack.unpackb(retry.content), msgpack.unpackb(first.content))
+
+    def test_key_reused_for_different_request_is_rejected(self):
+        self._post("retry-2")
+
+        response = self._post("retry-2", payment_method="Online")
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_requests_without_key_are_not_recorded(self):
+        response = self.client.post(
+            reverse("create-payment"), {"checkout_id": self.checkout.id, "payment_method": "COD"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(self.user.idempotencykey_set.exists())
+
+
+
+class PaymentGatewayTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.checkout = Checkout.objects.create(
+            user=self.user, total_price=25, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def _post(self, payment_method):
+        return self.client.post(
+            reverse("create-payment"),
+            {"checkout_id": self.checkout.id, "payment_method": payment_method},
+            format="json",
+        )
+
+    def test_online_payment_is_pending_until_the_gateway_answers(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self._post("Online")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data["payment_status"], response.data["transaction_status"]), ("Pending", "Pending"))
+        self.assertEqual(len(callbacks), 1)
+
+    def test_cash_on_delivery_skips_the_gateway(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self._post("COD")
+
+        self.assertEqual((response.data["payment_status"], response.data["transaction_status"]), ("Completed", "Success"))
+        self.assertFalse(callbacks)
+
+    def test_stub_failures_mark_payment_failed(self):
+        with self.captureOnCommitCallbacks():
+            self._post("Online")
+        transaction = Transaction.objects.get()
+
+        StubGateway(latency=0, failure_rate=1).charge(transaction, record_result)
+
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.transaction_status, "Failed")
+        self.assertIn("declined", transaction.gateway_response)
+        self.assertEqual(transaction.payment.status, "Failed")
+
+    def test_second_payment_conflicts_unless_the_first_failed(self):
+        with self.captureOnCommitCallbacks():
+            self._post("Online")
+
+        response = self._post("COD")
+        self.assertEqual((response.status_code, response.data["payment_status"]), (409, "Pending"))
+        record_result(Transaction.objects.get(), False, "declined")
+        response = self._post("COD")
+
+        self.assertEqual((response.status_code, response.data["payment_status"]), (201, "Completed"))
+        self.assertEqual(Payment.objects.get().payment_method, "COD")
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_only_the_first_result_counts(self):
+        with self.captureOnCommitCallbacks():
+            self._post("Online")
+        transaction = Transaction.objects.get()
+
+        record_result(transaction, True, "first")
+        record_result(transaction, False, "late")
+
+        transaction.refresh_from_db()
+        self.assertEqual((transaction.transaction_status, transaction.gateway_response), ("Success", "first"))
+        self.assertEqual(transaction.payment.status, "Completed")
+
+    def test_result_reaches_the_placed_order(self):
+        with self.captureOnCommitCallbacks():
+            self._post("Online")
+        transaction = Transaction.objects.get()
+        order = Order.objects.create(
+            user=self.user, total_price=25, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        Payment.objects.update(order=order)
+
+        record_result(transaction, False, "declined")
+
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, "Failed")
+
+    def test_status_is_only_visible_to_the_owner(self):
+        with self.captureOnCommitCallbacks():
+            payment_id = self._post("Online").data["payment_id"]
+        other = CustomUser.objects.create(email="other@example.com", username="other", password="!")
+
+        own = self.client.get(reverse("payment-status", args=[payment_id]))
+        self.client.force_authenticate(user=other)
+        foreign = self.client.get(reverse("payment-status", args=[payment_id]))
+
+        self.assertEqual((own.status_code, own.data["payment_status"]), (200, "Pending"))
+        self.assertEqual(foreign.status_code, 404)
+
+
+@override_settings(PAYMENT_STUB_LATENCY_SECONDS=0, PAYMENT_STUB_FAILURE_RATE=0)
+class BackgroundPaymentTests(TransactionTestCase):
+    def test_worker_pool_settles_online_payment(self):
+        user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        checkout = Checkout.objects.create(
+            user=user, total_price=25, shipping_address="1 Main St", billing_address="1 Main St"
+        )
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        payment_id = client.post(
+            reverse("create-payment"), {"checkout_id": checkout.id, "payment_method": "Online"}, format="json"
+        ).data["payment_id"]
+        # Poll the way a client would
+        deadline = time.monotonic() + 5
+        while True:
+            response = client.get(reverse("payment-status", args=[payment_id]))
+            if response.data["payment_status"] != "Pending" or time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+        self.assertEqual((response.data["payment_status"], response.data["transaction_status"]), ("Completed", "Success"))
+        self.assertIn("approved", response.data["gateway_response"])
+
+    def test_stuck_payments_are_charged_again(self):
+        user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        transactions = []
+        for age_minutes in (60, 1):
+            checkout = Checkout.objects.create(
+                user=user, total_price=25, shipping_address="1 Main St", billing_address="1 Main St"
+            )
+            payment = Payment.objects.create(checkout=checkout, payment_method="Online", amount=25)
+            # As if queued on a worker pool that was lost in a restart
+            transaction = Transaction.objects.create(
+                payment=payment, transaction_id=f"lost-{age_minutes}", amount=25, transaction_status="Pending"
+            )
+            Transaction.objects.filter(id=transaction.id).update(
+                transaction_date=timezone.now() - timedelta(minutes=age_minutes)
+            )
+            transactions.append(transaction)
+        out = io.StringIO()
+
+        call_command("resubmit_pending_payments", older_than_minutes=15, stdout=out)
+
+        stale, fresh = [Transaction.objects.get(id=transaction.id) for transaction in transactions]
+        self.assertEqual((stale.transaction_status, stale.payment.status), ("Success", "Completed"))
+        self.assertEqual(fresh.transaction_status, "Pending")
+        self.assertIn("Resubmitted 1 transactions: 1 succeeded, 0 failed, 0 still pending", out.getvalue())
+
+
+class PaymentExportTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create(email="admin@example.com", username="admin", password="!", role="Admin")
+        self.user = CustomUser.objects.create(email="customer@example.com", username="customer", password="!")
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def _payment(self, age_days, status="Completed"):
+        order = Order.objects.create(
+            user=self.user, status="Fulfilled", total_price="25.00", shipping_address="1 Main St",
+            billing_address="1 Main St",
+        )
+        payment = Payment.objects.create(order=order, payment_method="Online", amount="25.00", status=status)
+        for attempt, result in enumerate(["Failed", "Success"]):
+            Transaction.objects.create(
+                payment=payment, transaction_id=f"txn-{payment.id}-{attempt}", amount="25.00",
+                transaction_status=result, gateway_response="-1 declined" if result == "Failed" else "ok",
+            )
+        Payment.objects.filter(id=payment.id).update(payment_date=timezone.now() - timedelta(days=age_days))
+        Order.objects.filter(id=order.id).update(created_at=timezone.now() - timedelta(days=age_days))
+        return payment
+
+    def _export(self, **params):
+        response = self.client.get(reverse("export-payments"), params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_ndjson_nests_transactions_and_resolves_archived_orders(self):
+        archived = self._payment(100)
+        live = self._payment(1)
+        list(archive_orders(timedelta(days=90)))
+
+        records = [json.loads(line) for line in self._export().splitlines()]
+
+        self.assertEqual([record["id"] for record in records], [archived.id, live.id])
+        self.assertEqual(records[0]["order_id"], Payment.objects.get(id=archived.id).archived_order_id)
+        self.assertEqual(records[1]["amount"], "25.00")
+        self.assertEqual([txn["transaction_status"] for txn in records[1]["transactions"]], ["Failed", "Success"])
+
+    def test_csv_filtered_by_date_range(self):
+        self._payment(10)
+        recent = self._payment(1, status="Pending")
+        after = (timezone.now() - timedelta(days=5)).isoformat()
+
+        rows = list(csv.DictReader(io.StringIO(self._export(export_format="csv", created_after=after))))
+
+        self.assertEqual([row["id"] for row in rows], [str(recent.id)] * 2)
+        self.assertEqual([row["transaction_gateway_response"] for row in rows], ["'-1 declined", "ok"])
+        self.assertEqual(rows[0]["status"], "Pending")
+
+    def test_admin_only(self):
+        self.client.force_authenticate(user=self.user)
+
+        self.assertEqual(self.client.get(reverse("export-payments")).status_code, 403)
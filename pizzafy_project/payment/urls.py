@@ -1,6 +1,11 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+CreatePaymentView = views.AsyncCreatePaymentView if settings.USE_ASYNC_VIEWS else views.CreatePaymentView
+
 urlpatterns = [
-    path('create/', views.CreatePaymentView.as_view(), name='create-payment'),
+    path('create/', CreatePaymentView.as_view(), name='create-payment'),
+    path('<int:payment_id>/status/', views.PaymentStatusView.as_view(), name='payment-status'),
+    path('export/', views.PaymentExportView.as_view(), name='export-payments'),
 ]
\ No newline at end of file
@@ -1,16 +1,95 @@
 import uuid
+from asgiref.sync import sync_to_async
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Q
+from .export import payment_export
+from .gateway import submit_transaction
 from .models import Payment, Transaction
 from order.models import Checkout
+from order.views import filter_date_range
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
+from core.async_views import AsyncAPIView
+from core.export import EXPORT_FORMATS
+from core.permissions import IsAdmin
+from core.idempotency import idempotent
+
+
+class PaymentExists(Exception):
+    """
+    The checkout already has a payment that is pending or completed
+    """
+
+    def __init__(self, payment_status):
+        super().__init__(f"Checkout already has a {payment_status} payment")
+        self.payment_status = payment_status
+
+
+def create_payment(checkout, payment_method):
+    """
+    Pay for ``checkout``, or try again after its payment failed. Raises PaymentExists otherwise.
+    """
+    # Payment and its Transaction are written together or not at all
+    online = payment_method == "Online"
+    fields = {
+        "payment_method": payment_method,
+        "amount": checkout.total_price,  # The amount is the total price of the checkout
+        "status": "Pending" if online else "Completed",  # Online payments stay Pending until the gateway settles them
+    }
+    try:
+        with db_transaction.atomic():
+            payment = Payment.objects.select_for_update().filter(checkout=checkout).first()
+            if payment is None:
+                payment = Payment.objects.create(checkout=checkout, **fields)
+            elif payment.status == "Failed":
+                # A failed payment is retried on the same row, with a new transaction; the failed one stays as history
+                for name, value in fields.items():
+                    setattr(payment, name, value)
+                payment.save(update_fields=list(fields))
+            else:
+                raise PaymentExists(payment.status)
+            transaction = create_transaction(payment, online)
+    except IntegrityError:
+        # A concurrent request created the payment first
+        raise PaymentExists("Pending")
+    return payment, transaction
+
+
+def create_transaction(payment, online):
+    # Create a Transaction object for the payment
+    transaction = Transaction.objects.create(
+        payment=payment,
+        transaction_id=str(uuid.uuid4()),  # Generate a unique transaction ID
+        amount=payment.amount,
+        transaction_status="Pending" if online else "Success",
+        gateway_response="",  # Filled in by payment.gateway.record_result
+    )
+
+    # Charge in the background so the gateway's latency stays out of the request
+    if online:
+        submit_transaction(transaction)
+    return transaction
+
+
+def payment_response_data(payment, transaction):
+    return {
+        "message": "Payment created successfully",
+        "payment_id": payment.id,
+        "transaction_id": transaction.transaction_id,
+        "amount": payment.amount,
+        "payment_status": payment.status,
+        "transaction_status": transaction.transaction_status,
+    }
+
 
 # Create your views here.
 class CreatePaymentView(APIView):
     permission_classes = [IsAuthenticated]
-    
+
+    @idempotent
     def post(self, request):
         # Extract data from request
         checkout_id = request.data.get("checkout_id")
@@ -29,32 +108,99 @@ class CreatePaymentView(APIView):
         if payment_method not in ["COD", "Online"]:
             raise ValidationError("Invalid payment method. Choose 'COD' or 'Online'.")
         
-        # Create Payment object
-        payment = Payment.objects.create(
-            checkout=checkout,
-            payment_method=payment_method,
-            amount=checkout.total_price,  # The amount is the total price of the checkout
-            status="Completed",  # Set initial status to Pending
-        )
-
-        # Create a Transaction object for the payment
-        transaction = Transaction.objects.create(
-            payment=payment,
-            transaction_id=str(uuid.uuid4()),  # Generate a unique transaction ID
-            amount=payment.amount,
-            transaction_status="Success",  # Set initial status to Pending
-            gateway_response="",  # Can be updated with real gateway response
-        )
+        try:
+            payment, transaction = create_payment(checkout, payment_method)
+        except PaymentExists as exc:
+            return Response(
+                {"message": str(exc), "payment_status": exc.payment_status}, status=status.HTTP_409_CONFLICT
+            )
 
         # Return response with payment and transaction details
+        return Response(payment_response_data(payment, transaction), status=status.HTTP_201_CREATED)
+
+
+class AsyncCreatePaymentView(AsyncAPIView):
+    """
+    Async version of CreatePaymentView, used when USE_ASYNC_VIEWS is on
+    """
+
+    @idempotent
+    async def post(self, request):
+        data = self.get_data(request)
+        checkout_id = data.get("checkout_id")
+        payment_method = data.get("payment_method")
+
+        if not checkout_id or not payment_method:
+            raise ValidationError("Both checkout_id and payment_method are required.")
+
+        try:
+            checkout = await Checkout.objects.aget(id=checkout_id)
+        except Checkout.DoesNotExist:
+            return self.render({"message": "Checkout not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        if payment_method not in ["COD", "Online"]:
+            raise ValidationError("Invalid payment method. Choose 'COD' or 'Online'.")
+
+        # Transactions are not supported by the async ORM, so the writes run as one sync unit
+        try:
+            payment, transaction = await sync_to_async(create_payment)(checkout, payment_method)
+        except PaymentExists as exc:
+            return self.render(
+                {"message": str(exc), "payment_status": exc.payment_status}, status=status.HTTP_409_CONFLICT
+            )
+
+        return self.render(payment_response_data(payment, transaction), status=status.HTTP_201_CREATED)
+
+
+class PaymentStatusView(APIView):
+    """
+    Progress of a payment while the gateway processes it in the background
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, payment_id):
+        payments = Payment.objects.all()
+        if not request.user.is_admin_user():
+            # The checkout link is cleared once the order is placed, and the order link once it is archived
+            payments = payments.filter(
+                Q(checkout__user=request.user) | Q(order__user=request.user) | Q(archived_order__user=request.user)
+            )
+        try:
+            payment = payments.get(id=payment_id)
+        except Payment.DoesNotExist:
+            return Response({"message": "Payment not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        transaction = payment.transactions.order_by("-id").first()
         return Response(
             {
-                "message": "Payment created successfully",
                 "payment_id": payment.id,
-                "transaction_id": transaction.transaction_id,
-                "amount": payment.amount,
                 "payment_status": payment.status,
-                "transaction_status": transaction.transaction_status,
+                "transaction_id": transaction and transaction.transaction_id,
+                "transaction_status": transaction and transaction.transaction_status,
+                "gateway_response": transaction and transaction.gateway_response,
             },
-            status=status.HTTP_201_CREATED,
-        )
\ No newline at end of file
+            status=status.HTTP_200_OK,
+        )
+
+
+class PaymentExportView(APIView):
+    """
+    Payments with their transactions as a streamed NDJSON or CSV download, for finance (see core.export)
+    """
+
+    permission_classes = [IsAuthenticated, IsAdmin]
+
+    def get(self, request):
+        export_format = request.query_params.get("export_format", "ndjson")
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": "export_format must be 'ndjson' or 'csv'"}, status=status.HTTP_400_BAD_REQUEST)
+
+        filters, error = filter_date_range(request.query_params, "payment_date")
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        payment_status = request.query_params.get("status")
+        if payment_status:
+            filters &= Q(status=payment_status)
+
+        return payment_export(filters).response(export_format)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PizzaConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "pizza"
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import check_search_cache
+
+        check_search_cache()
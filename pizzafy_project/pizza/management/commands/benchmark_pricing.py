@@ -0,0 +1,66 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from order.models import CheckoutLine
+from pizza.models import Pizza
+from pizza.pricing import PriceMatrix, price_lines
+
+CUSTOMIZATIONS = ["", "", "olives", "extra cheese, jalapenos", "no onions, extra basil, chilli oil"]
+
+
+class Command(BaseCommand):
+    help = "Measure server-side cart pricing cost against a synthetic menu"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pizzas", type=int, default=200)
+        parser.add_argument("--lines", type=int, default=100, help="Lines per cart")
+        parser.add_argument("--carts", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        # Everything runs in a transaction that is rolled back, so no pizzas are left behind
+        with transaction.atomic():
+            pizzas = Pizza.objects.bulk_create(
+                [
+                    Pizza(name=f"Bench pizza {i}", description="", price=Decimal(800 + i) / 100, stock=100)
+                    for i in range(options["pizzas"])
+                ],
+                batch_size=1000,
+            )
+
+            started = time.perf_counter()
+            PriceMatrix.build()
+            build_elapsed = time.perf_counter() - started
+
+            rng = random.Random(0)
+            carts = [
+                [
+                    CheckoutLine(
+                        pizza=rng.choice(pizzas),
+                        size=rng.choice(["Small", "Medium", "Large"]),
+                        quantity=rng.randint(1, 5),
+                        customizations=rng.choice(CUSTOMIZATIONS),
+                    )
+                    for _ in range(options["lines"])
+                ]
+                for _ in range(options["carts"])
+            ]
+
+            # The first call builds the table; time steady-state pricing only
+            price_lines(carts[0])
+            started = time.perf_counter()
+            for cart in carts:
+                price_lines(cart)
+            elapsed = time.perf_counter() - started
+
+            transaction.set_rollback(True)
+
+        per_cart = elapsed / options["carts"]
+        self.stdout.write(f"Price matrix for {options['pizzas']} pizzas built in {build_elapsed * 1000:.2f}ms")
+        self.stdout.write(
+            f"{options['carts']} carts of {options['lines']} lines in {elapsed:.3f}s "
+            f"({per_cart * 1e6:.0f}us per cart, {per_cart / options['lines'] * 1e6:.2f}us per line)"
+        )
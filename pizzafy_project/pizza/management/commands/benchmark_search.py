@@ -0,0 +1,95 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from core.loadtest import percentile
+from pizza.models import Pizza
+from pizza.search import SEARCH_BACKENDS, Fts5SearchIndex, tokenize
+
+STYLES = ["Spicy", "Smoky", "Classic", "Garden", "Farmhouse", "Fiery", "Creamy", "Tandoori", "Rustic", "Golden"]
+INGREDIENTS = [
+    "paneer", "chicken", "mushroom", "olives", "jalapeno", "pepperoni", "onion", "capsicum", "corn", "tomato",
+    "basil", "pineapple", "bacon", "spinach", "feta", "mozzarella", "sausage", "garlic", "chilli", "artichoke",
+]
+WORDS = ["hand", "tossed", "crust", "wood", "fired", "oven", "baked", "fresh", "house", "sauce", "with", "and"]
+QUERIES = ["spicy paneer", "chicken", "olive", "smoky bac", "garden spinach feta", "pineapple", "fiery jalap"]
+
+
+class Command(BaseCommand):
+    help = "Measure pizza search index build time and query latency against a synthetic catalogue"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=100_000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--backend", choices=sorted(SEARCH_BACKENDS), action="append")
+        parser.add_argument("--baseline", action="store_true", help="Also time an icontains scan of the table")
+
+    def handle(self, *args, **options):
+        backends = options["backend"] or [
+            name for name in sorted(SEARCH_BACKENDS) if name != "fts5" or Fts5SearchIndex.supported()
+        ]
+        rng = random.Random(0)
+        queries = [
+            (rng.choice(QUERIES), rng.choice([None, None, "Veg", "Non-Veg"]), rng.choice([None, None, "Large"]))
+            for _ in range(options["queries"])
+        ]
+
+        # Everything runs in a transaction that is rolled back, so no pizzas are left behind
+        with transaction.atomic():
+            started = time.perf_counter()
+            Pizza.objects.bulk_create([self.pizza(rng, i) for i in range(options["items"])], batch_size=2000)
+            self.stdout.write(f"Created {options['items']} pizzas in {time.perf_counter() - started:.1f}s")
+
+            for name in backends:
+                index = SEARCH_BACKENDS[name]()
+                started = time.perf_counter()
+                index.rebuild()
+                self.stdout.write(f"{name}: index built in {time.perf_counter() - started:.2f}s")
+                self.report(
+                    name, [lambda query=query: index.search(tokenize(query[0]), (), *query[1:]) for query in queries]
+                )
+
+            if options["baseline"]:
+                self.report("icontains scan", [lambda query=query: self.scan(*query) for query in queries])
+
+            transaction.set_rollback(True)
+
+    def pizza(self, rng, i):
+        toppings = rng.sample(INGREDIENTS, 4)
+        return Pizza(
+            name=f"{rng.choice(STYLES)} {toppings[0].title()} {i}",
+            description=" ".join(rng.choices(WORDS + INGREDIENTS, k=12)),
+            price=Decimal(rng.randint(600, 1800)) / 100,
+            stock=rng.randint(0, 50),
+            category=rng.choice(["Veg", "Non-Veg", "Specialty"]),
+            available_sizes=rng.choice(["Small", "Medium", "Large"]),
+            toppings=", ".join(toppings),
+        )
+
+    def scan(self, query, category, size):
+        # What search costs without an index: every term matched against every row, and every
+        # match fetched, since ranking them needs all of them
+        pizzas = Pizza.objects.filter(stock__gt=0)
+        for term in tokenize(query):
+            pizzas = pizzas.filter(Q(name__icontains=term) | Q(description__icontains=term) | Q(toppings__icontains=term))
+        if category:
+            pizzas = pizzas.filter(category=category)
+        if size:
+            pizzas = pizzas.filter(available_sizes=size)
+        return list(pizzas.values_list("id", "name", "description", "toppings"))
+
+    def report(self, name, searches):
+        searches[0]()  # Warm up
+        latencies = []
+        for search in searches:
+            started = time.perf_counter()
+            search()
+            latencies.append(time.perf_counter() - started)
+        self.stdout.write(
+            f"{name}: {len(latencies)} queries, p50 {percentile(latencies, 0.5) * 1000:.2f}ms, "
+            f"p95 {percentile(latencies, 0.95) * 1000:.2f}ms"
+        )
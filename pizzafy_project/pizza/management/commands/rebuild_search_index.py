@@ -0,0 +1,16 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pizza.search import get_search_index, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the pizza search index from the Pizza table, e.g. after bulk imports that skip signals"
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt the {get_search_index().name} search index in {time.perf_counter() - started:.2f}s"
+        ))
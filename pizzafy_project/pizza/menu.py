@@ -0,0 +1,40 @@
+"""
+Customer menu snapshot.
+
+The public menu is serialised once into JSON bytes and kept in Django's cache
+together with a strong ETag, so menu requests never touch the Pizza table.
+Sold-out pizzas are dropped when the snapshot is built. The snapshot is rebuilt
+whenever a pizza is saved or deleted (see pizza.signals) and whenever a stock
+change sells a pizza out or brings it back (see pizza.stock).
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from .models import Pizza
+from .serializers import MenuSerializer
+
+MENU_CACHE_KEY = "pizza:menu-snapshot"
+
+
+def build_menu_snapshot():
+    pizzas = Pizza.objects.filter(stock__gt=0).order_by("category", "name", "id")
+    body = JSONRenderer().render(MenuSerializer(pizzas, many=True).data)
+    snapshot = {
+        "body": body,
+        "etag": '"%s"' % hashlib.sha256(body).hexdigest(),
+    }
+    cache.set(MENU_CACHE_KEY, snapshot, getattr(settings, "MENU_SNAPSHOT_TIMEOUT", None))
+    return snapshot
+
+
+def get_menu_snapshot():
+    return cache.get(MENU_CACHE_KEY) or build_menu_snapshot()
+
+
+def schedule_menu_rebuild():
+    # Rebuild only once the change is committed so the snapshot never shows rolled-back data
+    transaction.on_commit(build_menu_snapshot)
@@ -0,0 +1,144 @@
+"""
+Server-side checkout pricing.
+
+Every (pizza, size) unit price is precomputed from ``Pizza.price`` and the
+``PRICING_SIZE_MULTIPLIERS`` setting into an in-process table of integer
+cents. A line's unit price is its (pizza, size) entry plus
+``PRICING_CUSTOMIZATION_SURCHARGE`` for each comma-separated customization.
+Whole carts are priced in one pass of table lookups and integer additions,
+with Decimal only at the edges.
+
+The table is rebuilt lazily. Saving or deleting a pizza replaces a version
+token in Django's cache once the change commits (see pizza.signals), and
+each process compares that version with its own before pricing, so every
+worker drops its table without talking to the others.
+
+With a shared cache that happens on the next request. The token also
+expires after ``PRICING_VERSION_TTL_SECONDS``, and a fresh one is never
+equal to any table's, so with a per-process cache (the default LocMemCache)
+a price change reaches the other workers within that time instead of never.
+"""
+import threading
+import uuid
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Pizza
+
+PRICE_MATRIX_VERSION_KEY = "pizza:price-matrix-version"
+
+CENT = Decimal("0.01")
+
+
+class UnknownSize(Exception):
+    def __init__(self, size):
+        super().__init__(f"Unknown size {size!r}")
+        self.size = size
+
+
+def to_cents(amount):
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+class PriceMatrix:
+    def __init__(self, base_prices, size_multipliers, customization_surcharge):
+        # (pizza_id, size) -> unit price in cents
+        self.table = {
+            (pizza_id, size): to_cents(Decimal(price) * Decimal(str(multiplier)))
+            for pizza_id, price in base_prices.items()
+            for size, multiplier in size_multipliers.items()
+        }
+        self.sizes = frozenset(size_multipliers)
+        self.surcharge = to_cents(customization_surcharge)
+
+    @classmethod
+    def build(cls):
+        return cls(
+            dict(Pizza.objects.values_list("id", "price")),
+            getattr(settings, "PRICING_SIZE_MULTIPLIERS", {"Small": 1, "Medium": 1, "Large": 1}),
+            getattr(settings, "PRICING_CUSTOMIZATION_SURCHARGE", 0),
+        )
+
+    def surcharge_count(self, customizations):
+        if not customizations:
+            return 0
+        return sum(1 for item in customizations.split(",") if item.strip())
+
+    def price_lines(self, lines):
+        """
+        Set ``price`` on every line from the table and return the total.
+
+        Lines are anything with ``pizza_id``, ``size``, ``quantity`` and
+        ``customizations`` attributes, e.g. unsaved CheckoutLines. Raises
+        KeyError for a pizza missing from the table and UnknownSize for a size
+        with no multiplier.
+        """
+        table, surcharge = self.table, self.surcharge
+        surcharges = {}
+        total = 0
+        for line in lines:
+            if line.size not in self.sizes:
+                raise UnknownSize(line.size)
+            customizations = line.customizations
+            extra = surcharges.get(customizations)
+            if extra is None:
+                extra = surcharges[customizations] = self.surcharge_count(customizations) * surcharge
+            unit = table[(int(line.pizza_id), line.size)] + extra
+            line.price = Decimal(unit).scaleb(-2)
+            total += unit * line.quantity
+        return Decimal(total).scaleb(-2).quantize(CENT)
+
+
+_lock = threading.Lock()
+_matrix = None
+_matrix_version = None
+
+
+def new_version():
+    # Random rather than a counter, so a cleared or evicted key can never match a stale table
+    return uuid.uuid4().hex
+
+
+def version_ttl():
+    return getattr(settings, "PRICING_VERSION_TTL_SECONDS", 60)
+
+
+def get_price_matrix():
+    global _matrix, _matrix_version
+    version = cache.get_or_set(PRICE_MATRIX_VERSION_KEY, new_version, version_ttl())
+    matrix = _matrix
+    if matrix is not None and _matrix_version == version:
+        return matrix
+    with _lock:
+        if _matrix is None or _matrix_version != version:
+            _matrix, _matrix_version = PriceMatrix.build(), version
+        return _matrix
+
+
+def price_lines(lines):
+    """
+    Price a whole cart with the current table; see PriceMatrix.price_lines.
+    """
+    global _matrix
+    lines = list(lines)
+    try:
+        return get_price_matrix().price_lines(lines)
+    except KeyError:
+        # A pizza newer than our table, e.g. created in another worker a moment ago
+        with _lock:
+            _matrix = matrix = PriceMatrix.build()
+        return matrix.price_lines(lines)
+
+
+def invalidate_price_matrix():
+    global _matrix
+    _matrix = None
+    cache.set(PRICE_MATRIX_VERSION_KEY, new_version(), version_ttl())
+
+
+def schedule_price_matrix_rebuild():
+    # Drop the table only once the price change is committed, like the menu snapshot
+    transaction.on_commit(invalidate_price_matrix)
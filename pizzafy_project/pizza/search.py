@@ -0,0 +1,358 @@
+"""
+Full-text pizza search.
+
+Pizzas are searched by name, description and toppings through an inverted
+index, ranked with BM25, with name matches weighted above topping matches
+and those above description matches. Every query term must match, as a
+prefix ("spic pan" finds "Spicy Paneer"). Results can be narrowed by
+category, size and toppings, and sold-out pizzas are left out, as on the menu.
+
+Two interchangeable indexes implement this:
+
+* Fts5SearchIndex keeps an SQLite FTS5 table next to the Pizza table. It is
+  written by the same transaction that saves the pizza, so it can never
+  disagree with committed data, and a query is a single SQL statement.
+* MemorySearchIndex is a pure-Python inverted index, used on databases
+  without FTS5. Each process builds its own from the Pizza table on first
+  use. Changes are applied locally once they commit, and other processes
+  notice a changed version token in Django's default cache and rebuild, like
+  the price matrix (see pizza.pricing). Only a cache every worker shares
+  carries that token between processes: check_search_cache, run at startup
+  by PizzaConfig.ready, refuses ``PIZZA_SEARCH_BACKEND = "memory"`` over a
+  per-process one. When "auto" falls back to this index on such a cache,
+  searches are only right in a single-process deployment.
+
+``PIZZA_SEARCH_BACKEND`` picks one ("fts5" or "memory"); the default, "auto",
+uses FTS5 when the database supports it. Both are kept in sync by
+pizza.signals. Writes that skip signals (bulk_create, queryset.update of
+indexed columns) need a rebuild_search_index afterwards.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import unicodedata
+import uuid
+from collections import defaultdict
+from functools import lru_cache
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connection, transaction
+
+from core.routers import PROCESS_LOCAL_CACHES
+from .models import Pizza
+
+SEARCH_TABLE = "pizza_search"
+SEARCH_VERSION_KEY = "pizza:search-index-version"
+
+# Columns searched, with their BM25 weights
+FIELD_WEIGHTS = {"name": 10.0, "description": 1.0, "toppings": 4.0}
+
+# Columns whose change means a pizza must be reindexed
+INDEXED_FIELDS = frozenset(FIELD_WEIGHTS) | {"category", "available_sizes"}
+
+# Ids checked against stock per query when an index cannot filter on it itself
+STOCK_CHECK_BATCH = 500
+
+_word = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    """
+    Lower-cased words with accents removed, the same way FTS5's unicode61 tokenizer splits them.
+    """
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    return _word.findall("".join(char for char in text if not unicodedata.combining(char)))
+
+
+class Fts5SearchIndex:
+    name = "fts5"
+
+    @staticmethod
+    def supported():
+        if connection.vendor != "sqlite":
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA compile_options")
+            return ("ENABLE_FTS5",) in cursor.fetchall()
+
+    def create(self, cursor):
+        # Migrations cannot declare virtual tables, so the table is created on first use
+        columns = ", ".join(FIELD_WEIGHTS)
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            f"{columns}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+
+    def rebuild(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.create(cursor)
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, toppings) "
+                f"SELECT id, name, description, COALESCE(toppings, '') FROM {Pizza._meta.db_table}"
+            )
+
+    def run(self, sql, params):
+        """
+        Execute against the index table, building it first if this database has none yet.
+        """
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+        except OperationalError as exc:
+            if "no such table" not in str(exc):
+                raise
+        self.rebuild()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def index(self, pizza):
+        # Same transaction as the save, so a rollback undoes both
+        self.run(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [pizza.id])
+        self.run(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, name, description, toppings) VALUES (%s, %s, %s, %s)",
+            [pizza.id, pizza.name, pizza.description, pizza.toppings or ""],
+        )
+
+    def remove(self, pizza_id):
+        self.run(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [pizza_id])
+
+    def match_expression(self, terms, toppings):
+        phrases = [f'"{term}"*' for term in terms] + [f'toppings : "{term}"*' for term in toppings]
+        return " ".join(phrases)
+
+    def search(self, terms, toppings=(), category=None, size=None, limit=20):
+        pizza_table = Pizza._meta.db_table
+        conditions, params = ["p.stock > 0"], [self.match_expression(terms, toppings)]
+        if category:
+            conditions.append("p.category = %s")
+            params.append(category)
+        if size:
+            conditions.append("p.available_sizes = %s")
+            params.append(size)
+        weights = ", ".join(str(weight) for weight in FIELD_WEIGHTS.values())
+        rows = self.run(
+            f"SELECT p.id FROM {SEARCH_TABLE} JOIN {pizza_table} p ON p.id = {SEARCH_TABLE}.rowid "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND {' AND '.join(conditions)} "
+            f"ORDER BY bm25({SEARCH_TABLE}, {weights}), p.id LIMIT %s",
+            params + [limit],
+        )
+        return [pizza_id for pizza_id, in rows]
+
+
+class MemorySearchIndex:
+    name = "memory"
+
+    # BM25 parameters, the same defaults FTS5 uses
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self.clear()
+
+    def clear(self):
+        self.postings = defaultdict(dict)  # term -> {pizza_id: weighted term frequency}
+        self.docs = {}  # pizza_id -> (weighted length, category, size, terms, topping terms)
+        self.total_length = 0.0
+        self._vocabulary = None  # Sorted terms for prefix lookups, rebuilt when needed
+        self._impacts = {}  # term -> {pizza_id: BM25 contribution}, filled as terms are searched
+
+    def rebuild(self):
+        with self._lock:
+            # Read the version first, so a change committed while we build makes us rebuild again
+            version = cache.get_or_set(SEARCH_VERSION_KEY, new_version, None)
+            self.clear()
+            for pizza in Pizza.objects.only(*INDEXED_FIELDS).iterator(chunk_size=2000):
+                self._add(pizza)
+            self._version = version
+
+    def _add(self, pizza):
+        frequencies = defaultdict(float)
+        length = 0.0
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(getattr(pizza, field)):
+                frequencies[term] += weight
+                length += weight
+        for term, frequency in frequencies.items():
+            self.postings[term][pizza.id] = frequency
+        topping_terms = frozenset(tokenize(pizza.toppings))
+        self.docs[pizza.id] = (length, pizza.category, pizza.available_sizes, tuple(frequencies), topping_terms)
+        self.total_length += length
+        self._vocabulary = None
+        self._impacts = {}
+
+    def _remove(self, pizza_id):
+        doc = self.docs.pop(pizza_id, None)
+        if doc is None:
+            return
+        length, _, _, terms, _ = doc
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(pizza_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= length
+        self._vocabulary = None
+        self._impacts = {}
+
+    def _ensure_current(self):
+        # Another process changed the catalogue if the shared version moved on
+        version = cache.get(SEARCH_VERSION_KEY)
+        if self._version is None or version != self._version:
+            self.rebuild()
+
+    def _apply(self, pizza_id):
+        with self._lock:
+            self._remove(pizza_id)
+            pizza = Pizza.objects.only(*INDEXED_FIELDS).filter(id=pizza_id).first()
+            if pizza is not None:
+                self._add(pizza)
+            # Ours already has the change; everyone else rebuilds
+            self._version = new_version()
+            cache.set(SEARCH_VERSION_KEY, self._version, None)
+
+    def index(self, pizza):
+        pizza_id = pizza.id
+        transaction.on_commit(lambda: self._apply(pizza_id))
+
+    def remove(self, pizza_id):
+        transaction.on_commit(lambda: self._apply(pizza_id))
+
+    def expand(self, prefix):
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, prefix)
+        end = bisect.bisect_left(vocabulary, prefix + "\U0010ffff", start)
+        return vocabulary[start:end]
+
+    def impacts(self, term):
+        # Every pizza's BM25 contribution for one term; fixed until the index next changes
+        impacts = self._impacts.get(term)
+        if impacts is None:
+            docs, k1, b = self.docs, self.k1, self.b
+            average_length = self.total_length / len(docs)
+            postings = self.postings[term]
+            idf = math.log(1 + (len(docs) - len(postings) + 0.5) / (len(postings) + 0.5))
+            impacts = self._impacts[term] = {
+                pizza_id: idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * docs[pizza_id][0] / average_length))
+                for pizza_id, frequency in postings.items()
+            }
+        return impacts
+
+    def score(self, terms):
+        """
+        BM25 score of every pizza that matches all ``terms``, each as a prefix. Do not modify the result.
+        """
+        per_term = []
+        for prefix in terms:
+            expansions = [self.impacts(term) for term in self.expand(prefix)]
+            if not expansions:
+                return {}
+            if len(expansions) == 1:
+                per_term.append(expansions[0])
+                continue
+            # A pizza can match several words that share the prefix
+            merged = defaultdict(float)
+            for impacts in expansions:
+                for pizza_id, impact in impacts.items():
+                    merged[pizza_id] += impact
+            per_term.append(merged)
+
+        # Walk the rarest term and look the others up
+        per_term.sort(key=len)
+        scores, others = per_term[0], per_term[1:]
+        if not others:
+            return scores
+        return {
+            pizza_id: score + sum(other[pizza_id] for other in others)
+            for pizza_id, score in scores.items()
+            if all(pizza_id in other for other in others)
+        }
+
+    def search(self, terms, toppings=(), category=None, size=None, limit=20):
+        with self._lock:
+            self._ensure_current()
+            scores = self.score(terms)
+            if category or size or toppings:
+                docs = self.docs
+                scores = {
+                    pizza_id: score
+                    for pizza_id, score in scores.items()
+                    if (not category or docs[pizza_id][1] == category)
+                    and (not size or docs[pizza_id][2] == size)
+                    and all(any(term.startswith(topping) for term in docs[pizza_id][4]) for topping in toppings)
+                }
+
+        # Stock changes skip the index, so availability comes from the table. Only the best
+        # few are ranked and checked; the window widens when too many of them are sold out.
+        results, checked, wanted = [], 0, limit * 2
+        while True:
+            ranked = [pizza_id for pizza_id, _ in heapq.nlargest(wanted, scores.items(), key=itemgetter(1))]
+            for start in range(checked, len(ranked), STOCK_CHECK_BATCH):
+                batch = ranked[start : start + STOCK_CHECK_BATCH]
+                in_stock = set(Pizza.objects.filter(id__in=batch, stock__gt=0).values_list("id", flat=True))
+                results += [pizza_id for pizza_id in batch if pizza_id in in_stock]
+            checked = len(ranked)
+            if len(results) >= limit or checked < wanted:
+                return results[:limit]
+            wanted *= 4
+
+
+SEARCH_BACKENDS = {
+    "fts5": Fts5SearchIndex,
+    "memory": MemorySearchIndex,
+}
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+@lru_cache(maxsize=None)
+def _search_index(name):
+    if name == "auto":
+        name = "fts5" if Fts5SearchIndex.supported() else "memory"
+    return SEARCH_BACKENDS[name]()
+
+
+def get_search_index():
+    return _search_index(getattr(settings, "PIZZA_SEARCH_BACKEND", "auto"))
+
+
+def check_search_cache():
+    """
+    Raise ImproperlyConfigured when the memory index is chosen without a shared cache for its version token.
+    """
+    if getattr(settings, "PIZZA_SEARCH_BACKEND", "auto") != "memory":
+        return
+    if settings.CACHES["default"]["BACKEND"] in PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            'PIZZA_SEARCH_BACKEND = "memory" needs a default cache every worker shares, '
+            "or workers keep searching an old index after a pizza changes"
+        )
+
+
+def rebuild_search_index():
+    # Memory indexes live in every process; a new version makes each of them rebuild on its next search
+    cache.set(SEARCH_VERSION_KEY, new_version(), None)
+    get_search_index().rebuild()
+
+
+def search_pizzas(query, toppings="", category=None, size=None, limit=20):
+    """
+    Ids of in-stock pizzas matching every word of ``query``, best match first.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return []
+    return get_search_index().search(terms, tokenize(toppings), category, size, limit)
@@ -5,3 +5,10 @@ class PizzaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Pizza
         fields = ['id', 'name', 'description', 'price', 'stock', 'toppings', 'available_sizes', 'category']
+
+
+class MenuSerializer(serializers.ModelSerializer):
+    # Customer-facing menu: no stock counts, so stock changes don't invalidate the menu snapshot
+    class Meta:
+        model = Pizza
+        fields = ['id', 'name', 'description', 'price', 'toppings', 'available_sizes', 'category']
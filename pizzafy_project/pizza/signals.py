@@ -0,0 +1,33 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .menu import schedule_menu_rebuild
+from .models import Pizza
+from .pricing import schedule_price_matrix_rebuild
+from .search import INDEXED_FIELDS, get_search_index
+
+
+@receiver(post_save, sender=Pizza)
+@receiver(post_delete, sender=Pizza)
+def rebuild_menu_snapshot(sender, **kwargs):
+    schedule_menu_rebuild()
+
+
+@receiver(post_save, sender=Pizza)
+@receiver(post_delete, sender=Pizza)
+def rebuild_price_matrix(sender, update_fields=None, **kwargs):
+    # Saves limited to other columns cannot change a price
+    if update_fields is None or "price" in update_fields:
+        schedule_price_matrix_rebuild()
+
+
+@receiver(post_save, sender=Pizza)
+def index_pizza(sender, instance, update_fields=None, **kwargs):
+    # Stock-only saves leave the search index alone; availability is checked at query time
+    if update_fields is None or INDEXED_FIELDS.intersection(update_fields):
+        get_search_index().index(instance)
+
+
+@receiver(post_delete, sender=Pizza)
+def unindex_pizza(sender, instance, **kwargs):
+    get_search_index().remove(instance.id)
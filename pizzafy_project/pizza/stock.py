@@ -0,0 +1,81 @@
+"""
+Race-free stock changes.
+
+Stock is only ever changed with a single conditional UPDATE covering every
+pizza involved, so there is no read-modify-write window for concurrent
+requests to slip through. Callers must run these inside a transaction.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .menu import schedule_menu_rebuild
+from .models import Pizza
+
+
+class InsufficientStock(Exception):
+    def __init__(self, pizza_ids):
+        self.pizza_ids = sorted(pizza_ids)
+        super().__init__(f"Not enough stock for pizza(s) {self.pizza_ids}")
+
+
+def count_quantities(lines):
+    """
+    Total quantity per pizza_id for a list of checkout or order lines.
+    """
+    quantities = Counter()
+    for line in lines:
+        quantities[line.pizza_id] += line.quantity
+    return quantities
+
+
+def _per_pizza(quantities):
+    return Case(
+        *[When(id=pizza_id, then=Value(quantity)) for pizza_id, quantity in quantities.items()],
+        output_field=IntegerField(),
+    )
+
+
+def reserve_stock(quantities):
+    """
+    Take ``quantities`` ({pizza_id: quantity}) out of stock, all or nothing.
+
+    Runs ``UPDATE ... SET stock = stock - n WHERE stock >= n`` for every pizza
+    in one statement. Raises InsufficientStock, with nothing taken, if any
+    pizza is short.
+    """
+    quantities = {pizza_id: quantity for pizza_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    try:
+        with transaction.atomic():
+            reserved = Pizza.objects.filter(id__in=quantities, stock__gte=_per_pizza(quantities)).update(
+                stock=F("stock") - _per_pizza(quantities)
+            )
+            if reserved != len(quantities):
+                raise InsufficientStock(())
+    except InsufficientStock:
+        # Partial decrements are rolled back above; read the stock again to report which pizzas are short
+        stock = dict(Pizza.objects.filter(id__in=quantities).values_list("id", "stock"))
+        raise InsufficientStock(
+            pizza_id for pizza_id, quantity in quantities.items() if stock.get(pizza_id, 0) < quantity
+        ) from None
+
+    # The menu only changes when a pizza sells out
+    if Pizza.objects.filter(id__in=quantities, stock=0).exists():
+        schedule_menu_rebuild()
+
+
+def release_stock(quantities):
+    """
+    Put ``quantities`` ({pizza_id: quantity}) back into stock in one statement.
+    """
+    quantities = {pizza_id: quantity for pizza_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return
+    Pizza.objects.filter(id__in=quantities).update(stock=F("stock") + _per_pizza(quantities))
+
+    # The menu only changes when a sold-out pizza comes back
+    if Pizza.objects.filter(id__in=quantities, stock=_per_pizza(quantities)).exists():
+        schedule_menu_rebuild()
@@ -1,3 +1,245 @@
-from django.test import TestCase
+import tempfile
+import threading
+import unittest
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.models import User as CustomUser
+from order.models import CheckoutLine
+from .models import Pizza
+from .pricing import PRICE_MATRIX_VERSION_KEY, UnknownSize, get_price_matrix, price_lines
+from .search import Fts5SearchIndex, _search_index, check_search_cache
+from .stock import InsufficientStock, reserve_stock
+
+
+class MenuViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.margherita = Pizza.objects.create(name="Margherita", description="", price=10, stock=5)
+            self.sold_out = Pizza.objects.create(name="Pepperoni", description="", price=12, stock=0)
+
+    def test_menu_skips_sold_out_pizzas(self):
+        response = self.client.get(reverse("pizza-menu"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([pizza["id"] for pizza in response.json()], [self.margherita.id])
+
+    def test_matching_etag_returns_not_modified(self):
+        etag = self.client.get(reverse("pizza-menu"))["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("pizza-menu"), HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    @override_settings(RESPONSE_COMPRESSION_MIN_BYTES=0)
+    def test_compressed_etag_revalidates(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(20):
+                Pizza.objects.create(name=f"Special {i}", description="Tomato, mozzarella, basil", price=11, stock=5)
+        first = self.client.get(reverse("pizza-menu"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(first["Content-Encoding"], "gzip")
+        self.assertTrue(first["ETag"].startswith('W/"'))
+
+        response = self.client.get(
+            reverse("pizza-menu"), HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=first["ETag"]
+        )
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_snapshot_rebuilt_when_pizza_changes(self):
+        etag = self.client.get(reverse("pizza-menu"))["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sold_out.stock = 3
+            self.sold_out.save()
+
+        response = self.client.get(reverse("pizza-menu"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.margherita.delete()
+
+        self.assertEqual([pizza["id"] for pizza in self.client.get(reverse("pizza-menu")).json()], [self.sold_out.id])
+
+
+class PricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pizza = Pizza.objects.create(name="Margherita", description="", price="10.00", stock=5)
+
+    def _line(self, size="Medium", quantity=1, customizations=""):
+        return CheckoutLine(pizza=self.pizza, size=size, quantity=quantity, customizations=customizations)
+
+    def test_prices_by_size_and_customizations(self):
+        lines = [self._line("Small", 2), self._line("Large"), self._line("Medium", 3, "olives, extra cheese")]
+
+        total = price_lines(lines)
+
+        self.assertEqual([str(line.price) for line in lines], ["8.00", "12.50", "12.00"])
+        self.assertEqual(str(total), "64.50")
+
+    def test_unknown_size_is_rejected(self):
+        with self.assertRaises(UnknownSize):
+            price_lines([self._line("Family")])
+
+    def test_saving_a_pizza_invalidates_the_table(self):
+        matrix = get_price_matrix()
+        with self.assertNumQueries(0):
+            self.assertIs(get_price_matrix(), matrix)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pizza.price = 20
+            self.pizza.save()
+
+        line = self._line()
+        price_lines([line])
+        self.assertEqual(str(line.price), "20.00")
+
+    def test_expired_version_rebuilds_the_table(self):
+        # Another worker's price change, which this process's cache never heard about
+        get_price_matrix()
+        Pizza.objects.filter(id=self.pizza.id).update(price=20)
+
+        cache.delete(PRICE_MATRIX_VERSION_KEY)  # What PRICING_VERSION_TTL_SECONDS does eventually
+        line = self._line()
+        price_lines([line])
+
+        self.assertEqual(str(line.price), "20.00")
+
+    def test_checkout_ignores_client_price(self):
+        user = CustomUser.objects.create_user(email="customer@example.com", username="customer", password="secret")
+        client = APIClient()
+        client.force_authenticate(user=user)
+        payload = {
+            "shipping_address": "1 Main St",
+            "billing_address": "1 Main St",
+            "checkout_lines": [{"pizza_id": self.pizza.id, "price": 0.01, "quantity": 2, "size": "Large"}],
+        }
+
+        response = client.post(reverse("create-checkout"), payload, format="json")
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["checkout_data"]["total_price"], "25.00")
+
+
+class StockReservationTests(TransactionTestCase):
+    def test_concurrent_reservations_never_oversell(self):
+        pizza = Pizza.objects.create(name="Margherita", description="", price=10, stock=5)
+        outcomes = []
+        start = threading.Barrier(20)
+
+        def reserve():
+            start.wait()
+            try:
+                with transaction.atomic():
+                    reserve_stock({pizza.id: 1})
+                outcomes.append(True)
+            except InsufficientStock:
+                outcomes.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reserve) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(outcomes.count(True), 5)
+        self.assertEqual(outcomes.count(False), 15)
+        self.assertEqual(Pizza.objects.get(id=pizza.id).stock, 0)
+
+    def test_reservation_is_all_or_nothing(self):
+        plenty = Pizza.objects.create(name="Margherita", description="", price=10, stock=5)
+        scarce = Pizza.objects.create(name="Pepperoni", description="", price=12, stock=1)
+
+        with self.assertRaises(InsufficientStock) as raised:
+            reserve_stock({plenty.id: 2, scarce.id: 2})
+
+        self.assertEqual(raised.exception.pizza_ids, [scarce.id])
+        self.assertEqual(Pizza.objects.get(id=plenty.id).stock, 5)
+        self.assertEqual(Pizza.objects.get(id=scarce.id).stock, 1)
+
+
+class PizzaSearchTestsMixin:
+    def setUp(self):
+        cache.clear()
+        _search_index.cache_clear()
+        self.addCleanup(_search_index.cache_clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.paneer = self._pizza("Spicy Paneer", "Cottage cheese in a fiery sauce", "paneer, onion, chilli")
+            self.tikka = self._pizza("Paneer Tikka", "Smoky and spicy", "paneer, capsicum", category="Specialty")
+            self.veggie = self._pizza("Garden Veggie", "Spicy paneer on request", "olives, onion", size="Large")
+            self.chicken = self._pizza("Chicken Supreme", "Spicy chicken", "chicken, olives", category="Non-Veg")
+
+    def _pizza(self, name, description, toppings, category="Veg", size="Medium", stock=5):
+        return Pizza.objects.create(
+            name=name, description=description, toppings=toppings, category=category,
+            available_sizes=size, price=10, stock=stock,
+        )
+
+    def _search(self, **params):
+        response = self.client.get(reverse("pizza-search"), params)
+        self.assertEqual(response.status_code, 200)
+        return [pizza["id"] for pizza in response.json()["results"]]
+
+    def test_every_word_must_match_and_names_rank_first(self):
+        self.assertEqual(self._search(q="spicy paneer"), [self.paneer.id, self.tikka.id, self.veggie.id])
+
+    def test_words_match_as_prefixes(self):
+        self.assertEqual(self._search(q="chick sup"), [self.chicken.id])
+
+    def test_filters_by_category_size_and_toppings(self):
+        self.assertEqual(self._search(q="spicy", category="Specialty"), [self.tikka.id])
+        self.assertEqual(self._search(q="spicy", size="Large"), [self.veggie.id])
+        self.assertEqual(self._search(q="spicy", toppings="oliv"), [self.chicken.id, self.veggie.id])
+
+    def test_sold_out_pizzas_are_left_out(self):
+        Pizza.objects.filter(id=self.paneer.id).update(stock=0)
+
+        self.assertEqual(self._search(q="spicy paneer"), [self.tikka.id, self.veggie.id])
+
+    def test_index_follows_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chicken.name = "Chicken Tandoori"
+            self.chicken.save()
+            self.tikka.delete()
+
+        self.assertEqual(self._search(q="tandoori"), [self.chicken.id])
+        self.assertEqual(self._search(q="tikka"), [])
+
+    def test_validates_parameters(self):
+        self.assertEqual(self.client.get(reverse("pizza-search")).status_code, 400)
+        self.assertEqual(self.client.get(reverse("pizza-search"), {"q": "x", "category": "Vegan"}).status_code, 400)
+
+
+@override_settings(PIZZA_SEARCH_BACKEND="fts5")
+class Fts5PizzaSearchTests(PizzaSearchTestsMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        if not Fts5SearchIndex.supported():
+            raise unittest.SkipTest("SQLite without FTS5")
+
+
+@override_settings(PIZZA_SEARCH_BACKEND="memory")
+class MemoryPizzaSearchTests(PizzaSearchTestsMixin, TestCase):
+    def test_requires_a_shared_cache(self):
+        self.assertRaises(ImproperlyConfigured, check_search_cache)
+
+        with tempfile.TemporaryDirectory() as directory:
+            shared = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory}
+            with self.settings(CACHES={"default": shared}):
+                check_search_cache()
+        with self.settings(PIZZA_SEARCH_BACKEND="auto"):
+            check_search_cache()
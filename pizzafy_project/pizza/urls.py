@@ -1,8 +1,10 @@
 from django.urls import path
-from .views import PizzaViewSet
+from .views import PizzaViewSet, MenuView, PizzaSearchView
 
 urlpatterns = [
     path('', PizzaViewSet.as_view({'get': 'list', 'post': 'create'}), name='pizza-list-create'),
+    path('menu/', MenuView.as_view(), name='pizza-menu'),
+    path('search/', PizzaSearchView.as_view(), name='pizza-search'),
     path('<int:pk>/', PizzaViewSet.as_view({'get': 'retrieve', 'put': 'update', 'delete': 'destroy'}), name='pizza-detail'),
 
     # Custom actions
@@ -1,8 +1,16 @@
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
 from rest_framework import viewsets
+from rest_framework.views import APIView
+from rest_framework.permissions import AllowAny
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from .models import Pizza
-from .serializers import PizzaSerializer
+from .serializers import MenuSerializer, PizzaSerializer
+from .menu import get_menu_snapshot, schedule_menu_rebuild
+from .search import search_pizzas
+from .stock import InsufficientStock, release_stock, reserve_stock
 from core.permissions import IsAdmin
 # from rest_framework.permissions import IsAdminUser
 from rest_framework import status
@@ -14,19 +22,90 @@ class PizzaViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAdmin]  # Use Django's admin permission check
 
     # PATCH /pizzas/<pk>/update_stock/
+    # Either {"stock": n} to set the level or {"delta": n} to adjust it; both only touch the stock column
     @action(detail=True, methods=['patch'], url_path='update_stock')
     def update_stock(self, request, pk=None):
         pizza = self.get_object()
         stock = request.data.get('stock')
-        if stock is not None:
-            pizza.stock = stock
-            pizza.save()
-            return Response({"status": "stock updated"}, status=status.HTTP_200_OK)
-        return Response({"error": "stock is required"}, status=status.HTTP_400_BAD_REQUEST)
+        delta = request.data.get('delta')
+        if stock is None and delta is None:
+            return Response({"error": "stock or delta is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            with transaction.atomic():
+                if stock is not None:
+                    Pizza.objects.filter(pk=pizza.pk).update(stock=int(stock))
+                    schedule_menu_rebuild()
+                elif int(delta) < 0:
+                    reserve_stock({pizza.pk: -int(delta)})
+                else:
+                    release_stock({pizza.pk: int(delta)})
+        except (TypeError, ValueError):
+            return Response({"error": "stock and delta must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        except InsufficientStock:
+            return Response({"error": "stock cannot go below zero"}, status=status.HTTP_409_CONFLICT)
+        return Response({"status": "stock updated"}, status=status.HTTP_200_OK)
 
     # DELETE /pizzas/<pk>/delete/
     @action(detail=True, methods=['delete'], url_path='delete')
     def delete_pizza(self, request, pk=None):
         pizza = self.get_object()
         pizza.delete()
-        return Response({"status": "pizza deleted"}, status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        return Response({"status": "pizza deleted"}, status=status.HTTP_204_NO_CONTENT)
+
+
+def etag_matches(etag, if_none_match):
+    # Weak comparison, as Django's conditional GET does: compression hands out our ETag as W/"..."
+    etags = parse_etags(if_none_match)
+    return "*" in etags or etag.removeprefix("W/") in {tag.removeprefix("W/") for tag in etags}
+
+
+# GET /pizzas/menu/
+class MenuView(APIView):
+    """
+    Public, read-only menu served from the cached snapshot
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        snapshot = get_menu_snapshot()
+        if etag_matches(snapshot["etag"], request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(snapshot["body"], content_type="application/json")
+        response["ETag"] = snapshot["etag"]
+        return response
+
+
+# GET /pizzas/search/?q=spicy paneer&category=Veg&size=Large&toppings=olives
+class PizzaSearchView(APIView):
+    """
+    Public full-text search over the menu, best match first
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    max_limit = 100
+
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response({"error": "q is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+        category = request.query_params.get("category")
+        if category and category not in dict(Pizza.CATEGORY_CHOICES):
+            return Response({"error": f"Unknown category {category!r}"}, status=status.HTTP_400_BAD_REQUEST)
+        size = request.query_params.get("size")
+        if size and size not in dict(Pizza.SIZE_CHOICES):
+            return Response({"error": f"Unknown size {size!r}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get("limit", 20)), 1), self.max_limit)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = search_pizzas(query, request.query_params.get("toppings", ""), category, size, limit)
+        pizzas = Pizza.objects.in_bulk(ids)
+        results = MenuSerializer([pizzas[pizza_id] for pizza_id in ids if pizza_id in pizzas], many=True).data
+        return Response({"query": query, "results": results}, status=status.HTTP_200_OK)
@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pizzafy_project.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Live order events are served outside Django's request handler (see order/events.py)
+from order.events import with_order_events  # noqa: E402
+
+application = with_order_events(django_application)
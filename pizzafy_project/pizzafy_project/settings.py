@@ -34,8 +34,70 @@ AUTH_USER_MODEL = "core.User"  # Custom user model
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "core.authentication.RoleJWTAuthentication",
     ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "core.renderers.TimedJSONRenderer",
+        "core.renderers.MessagePackRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "rest_framework.parsers.JSONParser",
+        "core.parsers.MessagePackParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
+}
+
+# Serve the async variants of views when running under ASGI (uvicorn/daphne)
+USE_ASYNC_VIEWS = os.getenv('DJANGO_ASYNC_VIEWS', 'false').lower() == 'true'
+LOGIN_HASH_WORKERS = int(os.getenv('LOGIN_HASH_WORKERS', 4))  # Threads hashing passwords for async login
+
+# Delivery partner dispatch (see order/dispatch.py)
+DISPATCH_STRATEGY = os.getenv('DISPATCH_STRATEGY', 'least_loaded')  # 'least_loaded' or 'round_robin'
+DISPATCH_PARTNER_CAPACITY = int(os.getenv('DISPATCH_PARTNER_CAPACITY', 3))  # Open orders per delivery partner
+ORDER_STATUS_BULK_LIMIT = 1000  # Most orders one bulk status update may touch
+
+# Abandoned checkout cleanup (see order/reaper.py)
+CHECKOUT_REAPER_AGE_HOURS = float(os.getenv('CHECKOUT_REAPER_AGE_HOURS', 72))  # Checkouts untouched this long are deleted
+CHECKOUT_REAPER_BATCH = int(os.getenv('CHECKOUT_REAPER_BATCH', 500))  # Checkouts deleted per transaction
+
+# Order archival (see order/archive.py)
+ORDER_ARCHIVE_AGE_DAYS = float(os.getenv('ORDER_ARCHIVE_AGE_DAYS', 90))  # Fulfilled/cancelled orders placed this long ago are archived
+ORDER_ARCHIVE_BATCH = int(os.getenv('ORDER_ARCHIVE_BATCH', 500))  # Orders moved per transaction
+
+# Online payment processing (see payment/gateway.py)
+PAYMENT_GATEWAY = os.getenv('PAYMENT_GATEWAY', 'stub')  # 'stub' or a dotted path to a gateway class
+PAYMENT_WORKERS = int(os.getenv('PAYMENT_WORKERS', 8))  # Threads charging payments in the background
+PAYMENT_STUB_LATENCY_SECONDS = float(os.getenv('PAYMENT_STUB_LATENCY_SECONDS', 0.5))
+PAYMENT_STUB_FAILURE_RATE = float(os.getenv('PAYMENT_STUB_FAILURE_RATE', 0.0))  # Share of stub charges declined
+PAYMENT_RESUBMIT_AFTER_MINUTES = float(os.getenv('PAYMENT_RESUBMIT_AFTER_MINUTES', 15))  # Pending this long, a charge is presumed lost and sent again
+
+# Pizza search (see pizza/search.py)
+PIZZA_SEARCH_BACKEND = os.getenv('PIZZA_SEARCH_BACKEND', 'auto')  # 'fts5', 'memory' (needs a shared default cache) or 'auto' (FTS5 where SQLite has it)
+
+# Checkout pricing (see pizza/pricing.py); Pizza.price is the Medium price
+PRICING_SIZE_MULTIPLIERS = {"Small": "0.80", "Medium": "1.00", "Large": "1.25"}
+PRICING_CUSTOMIZATION_SURCHARGE = os.getenv('PRICING_CUSTOMIZATION_SURCHARGE', '1.00')  # Per comma-separated customization
+PRICING_VERSION_TTL_SECONDS = int(os.getenv('PRICING_VERSION_TTL_SECONDS', '60'))  # Longest a worker prices with an old table
+
+# Live order events (see order/events.py), served at api/checkout/events/ by the ASGI app
+ORDER_EVENTS_BROKER = os.getenv('ORDER_EVENTS_BROKER', 'order.events.InProcessBroker')  # Dotted path to the broker class
+ORDER_EVENTS_HEARTBEAT_SECONDS = 15  # Keep-alive comment interval on idle streams
+ORDER_EVENTS_QUEUE_SIZE = 100  # Events buffered per subscriber before the oldest are dropped
+
+# Request metrics (see core/metrics.py), exposed at /metrics to admins and METRICS_ALLOWED_IPS
+METRICS_ALLOWED_IPS = [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip]  # Internal scrapers, let in without a token
+METRICS_DIR = os.getenv('METRICS_DIR')  # Shared directory so /metrics covers every worker process
+METRICS_FLUSH_SECONDS = 5  # How often each process writes its totals to METRICS_DIR
+METRICS_QUERY_BUDGET = 20  # Warn when a request runs more queries than this; None disables
+METRICS_QUERY_BUDGETS = {  # Tighter budgets for endpoints that must not regress into N+1
+    "customer-order-history": 8,
+    "checkouts": 6,
+    "checkout-detail": 6,
+    "complete-checkout": 24,  # Fixed cost: stock, dispatch, order, lines, payment and sales summaries
+    "update-order-status": 24,  # Most when an archived order is restored and cancelled: stock and sales summaries
+    "bulk-update-order-status": 24,  # The same, for any number of orders
 }
 
 # Application definition
@@ -57,6 +119,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.metrics_middleware",
+    "core.middleware.compression_middleware",
+    "core.middleware.read_replica_middleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -89,13 +154,94 @@ WSGI_APPLICATION = "pizzafy_project.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite tuning applied to every connection: WAL lets readers run alongside the writer,
+# NORMAL sync is safe under WAL, and IMMEDIATE transactions take the write lock up front
+# so concurrent checkouts queue on the busy timeout rather than deadlock on lock upgrades
+SQLITE_OPTIONS = {
+    "timeout": 20,
+    "transaction_mode": "IMMEDIATE",
+    "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;",
+}
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        "OPTIONS": SQLITE_OPTIONS,
+        "CONN_MAX_AGE": int(os.getenv('DB_CONN_MAX_AGE', 60)),  # Reuse connections across requests
+        "CONN_HEALTH_CHECKS": True,  # Check a reused connection is still alive before the request uses it
+        "TEST": {
+            # File-backed so concurrency tests get real locking instead of shared-cache table locks
+            "NAME": BASE_DIR / "test_db.sqlite3",
+        },
     }
 }
 
+# Optional read replica, e.g. DATABASE_REPLICA_NAME=db_replica.sqlite3 to try it locally with a
+# second SQLite file (copy db.sqlite3 to seed it). Read paths are routed by core.routers, which
+# also needs ROUTING_CACHE_LOCATION (see Cache below).
+DATABASE_REPLICA_NAME = os.getenv('DATABASE_REPLICA_NAME')
+if DATABASE_REPLICA_NAME:
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": BASE_DIR / DATABASE_REPLICA_NAME,
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["core.routers.ReadReplicaRouter"]
+READ_REPLICA_ALIAS = "replica" if DATABASE_REPLICA_NAME else None
+READ_AFTER_WRITE_SECONDS = 5  # After a write, the user's reads stay on the primary this long
+READ_AFTER_WRITE_CACHE = "routing"  # Cache alias holding those pins; must be shared by every worker
+READ_REPLICA_URL_NAMES = [
+    "checkouts",
+    "checkout-detail",
+    "customer-order-history",
+    "pizza-list-create",
+    "pizza-detail",
+    "pizza-menu",
+]
+
+
+# Cache
+# Per-process by default; point this at a shared backend (e.g. Redis) when running several workers
+# so a menu rebuild in one worker is seen by all of them.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Read-after-write pins must be seen by whichever worker serves the next read, so with a replica
+# configured startup fails unless this points at a shared cache: a redis:// URL, or a directory
+# the workers on one host share.
+ROUTING_CACHE_LOCATION = os.getenv('ROUTING_CACHE_LOCATION')
+if ROUTING_CACHE_LOCATION:
+    CACHES["routing"] = {
+        "BACKEND": (
+            "django.core.cache.backends.redis.RedisCache"
+            if ROUTING_CACHE_LOCATION.startswith(("redis://", "rediss://"))
+            else "django.core.cache.backends.filebased.FileBasedCache"
+        ),
+        "LOCATION": ROUTING_CACHE_LOCATION,
+    }
+
+MENU_SNAPSHOT_TIMEOUT = None  # Menu snapshot lives until a pizza changes
+TOKEN_VERSION_CACHE_TIMEOUT = 300  # Upper bound on how long another worker may accept a revoked access token
+
+# Idempotency-Key handling for payment and checkout completion (see core/idempotency.py)
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600  # How long a stored response can be replayed
+IDEMPOTENCY_WAIT_SECONDS = 10  # How long a duplicate waits for the original request to finish
+IDEMPOTENCY_LOCK_SECONDS = 30  # After this a claim is presumed dead and may be taken over
+IDEMPOTENCY_EVICT_SECONDS = 60  # Minimum gap between sweeps of expired keys, per process
+
+# Response compression (see core/compression.py)
+RESPONSE_COMPRESSION_MIN_BYTES = int(os.getenv('RESPONSE_COMPRESSION_MIN_BYTES', 1024))  # Smaller bodies are sent as they are
+RESPONSE_COMPRESSION_LEVEL = int(os.getenv('RESPONSE_COMPRESSION_LEVEL', 6))  # gzip level 1-9; brotli quality is one higher
+
+# Finance exports (see core/export.py)
+EXPORT_CHUNK_SIZE = 1000  # Parents read per query while streaming an export
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -144,6 +290,8 @@ if ENVIRONMENT == 'production':
         'REFRESH_TOKEN_LIFETIME': timedelta(days=7),  # Refresh token expiry (7 days)
         'ROTATE_REFRESH_TOKENS': False,
         'BLACKLIST_AFTER_ROTATION': True,
+        'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.RoleTokenObtainPairSerializer',
+        'TOKEN_REFRESH_SERIALIZER': 'core.serializers.RoleTokenRefreshSerializer',
     }
 else:
     SIMPLE_JWT = {
@@ -151,4 +299,6 @@ else:
         'REFRESH_TOKEN_LIFETIME': timedelta(days=365),  # Refresh token expiry (effectively never expires)
         'ROTATE_REFRESH_TOKENS': False,
         'BLACKLIST_AFTER_ROTATION': True,
+        'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.RoleTokenObtainPairSerializer',
+        'TOKEN_REFRESH_SERIALIZER': 'core.serializers.RoleTokenRefreshSerializer',
     }
\ No newline at end of file
@@ -17,6 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from core.views import MetricsView
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
 
@@ -39,5 +40,6 @@ urlpatterns = [
     path('api/checkout/', include('order.urls')),
     # path('api/payment/', include('payment.urls')),
     
+    path('metrics', MetricsView.as_view(), name='metrics'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='swagger-docs'),
 ]